@@ -9,7 +9,8 @@ if __name__ == '__main__':
     thewe = robot.Robot('thewe-1',
                         image_url='http://a3.twimg.com/profile_images/401079957/256px-Circle.svg_bigger.png')
 
-    # Doesn't really do anything - the proxying is done within class Robot
+    # Doesn't really do anything - the proxying is done within class Robot.
+    # Handlers only run for event types passed to thewe.dispatch_locally().
     thewe.register_handler(events.BlipSubmitted, Proxy)
     thewe.register_handler(events.GadgetStateChanged, Proxy)
     thewe.register_handler(events.AnnotatedTextChanged, Proxy, filter='we/eval')
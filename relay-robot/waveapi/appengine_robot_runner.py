@@ -20,24 +20,40 @@
 import logging
 import traceback
 import events
+import logs
+import robot as robot_module
 import urllib
 
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 from google.appengine.api import urlfetch
 
+_log = logs.get('events')
+
 
 class GetHandler(webapp.RequestHandler):
   """Handler for serving capabilities.xml given a robot."""
 
-  def __init__(self, method, contenttype):
-    """Initializes this handler with a specific robot."""
+  def __init__(self, method, contenttype, etag=None):
+    """Initializes this handler with a specific robot.
+
+    etag is an optional function returning the etag of what method
+    returns, or None if it should not be cached.
+    """
     self._method = method
     self._contenttype = contenttype
+    self._etag = etag
 
   def get(self):
     """Handles HTTP GET request."""
     self.response.headers['Content-Type'] = self._contenttype
+    etag = self._etag and self._etag()
+    if etag:
+      self.response.headers['ETag'] = etag
+      if robot_module.etag_matches(self.request.headers.get('If-None-Match'),
+                                   etag):
+        self.response.set_status(304)
+        return
     self.response.out.write(self._method())
 
 
@@ -57,7 +73,7 @@ class RobotEventHandler(webapp.RequestHandler):
   def get(self):
     """Handles the get event for debugging. Ops usually too long."""
     ops = self.request.get('ops')
-    logging.info('get: ' + ops)
+    _log.info('get: %s', logs.Payload(ops))
     if ops:
       self.request.body = ops
       self.post()
@@ -69,28 +85,17 @@ class RobotEventHandler(webapp.RequestHandler):
       # TODO(davidbyttow): Log error?
       return
 
-    json_body = unicode(json_body, 'utf8')
-    logging.info('Incoming: ' + json_body)
+    _log.info('Incoming: %s', logs.Payload(json_body))
     json_response = self._robot.process_events(json_body)
-
-
-    
-
-
-
-
-    logging.info('Outgoing: ' + json_response)
+    _log.info('Outgoing: %s', logs.Payload(json_response))
 
     # Build the response.
     self.response.headers['Content-Type'] = 'application/json; charset=utf-8'
     self.response.out.write(json_response.encode('utf-8'))
 
 
-def operation_error_handler(event, wavelet):
-  """Default operation error handler, logging what went wrong."""
-  if isinstance(event, events.OperationError):
-    logging.error('Previously operation failed: id=%s, message: %s' %
-                  (event.operation_id, event.error_message))
+# Kept here for robots registering it themselves.
+operation_error_handler = robot_module.operation_error_handler
 
 
 def appengine_post(robot, url, data, headers):
@@ -128,10 +133,12 @@ def create_robot_webapp(robot, debug=False):
   """Returns an instance of webapp.WSGIApplication with robot handlers."""
   return webapp.WSGIApplication([('/_wave/capabilities.xml',
                                   lambda: GetHandler(robot.capabilities_xml,
-                                                     'application/xml')),
+                                                     'application/xml',
+                                                     robot.capabilities_etag)),
                                  ('/_wave/robot/profile',
                                   lambda: GetHandler(robot.profile_json,
-                                                     'application/json')),
+                                                     'application/json',
+                                                     robot.profile_etag)),
                                  ('/_wave/robot/jsonrpc',
                                   lambda: RobotEventHandler(robot)),
                                  ('/_wave/verify_token',
@@ -0,0 +1,442 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A module to run wave robots in a single process event loop.
+
+The robot is served on the same urls as by appengine_robot_runner, but
+from an asyncore loop instead of a WSGI application. Event bundles that
+have to go to the relay, and operations submitted with submit_async, are
+posted without blocking the loop, so a single process can keep many
+deliveries in flight while it waits for the relay or the wave server.
+
+The handlers themselves still run on the loop; they should not do
+blocking io of their own. Neither does the loop look up host names
+while serving: the relay host is resolved when the server is set up,
+other hosts once on their first request.
+"""
+
+import asynchat
+import asyncore
+import cgi
+import socket
+import sys
+import time
+import urlparse
+
+import events
+import logs
+import relay
+import robot as robot_module
+import simplejson
+
+_log = logs.get('events')
+_rpc_log = logs.get('rpc')
+
+HTTP_REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+    502: 'Bad Gateway',
+    504: 'Gateway Timeout',
+}
+
+# Seconds the loop waits for io at most before it looks for expired
+# requests.
+POLL_INTERVAL = 1.0
+
+
+def _split_host(netloc, default_port=80):
+  """Returns the host and port of a host[:port] string."""
+  parts = netloc.split(':', 1)
+  if len(parts) == 1:
+    return parts[0], default_port
+  return parts[0], int(parts[1])
+
+
+_addresses = {}
+
+
+def resolve(host, port):
+  """Returns the (ip, port) to connect to, looking host up only once."""
+  address = _addresses.get((host, port))
+  if address is None:
+    address = (socket.gethostbyname(host), port)
+    _addresses[(host, port)] = address
+  return address
+
+
+def _parse_response(data):
+  """Returns the status code and body of a raw http response."""
+  parts = data.split('\r\n\r\n', 1)
+  body = ''
+  if len(parts) == 2:
+    body = parts[1]
+  status_line = parts[0].split('\r\n', 1)[0]
+  try:
+    return int(status_line.split()[1]), body
+  except (IndexError, ValueError):
+    return None, 'Malformed response: %r' % status_line
+
+
+class HttpClient(asynchat.async_chat):
+  """A single http request made without blocking.
+
+  callback is called with the status code and the body of the response
+  once the server closes the connection, or with None and a message if
+  the request failed. A request still running after timeout seconds is
+  given up by expire_requests, which answers it with a 504.
+  """
+
+  def __init__(self, host, port, method, path, body, headers, callback,
+               address=None, timeout=relay.DEFAULT_TIMEOUT):
+    """Starts the request.
+
+    Args:
+      host: the host to send the request to, as sent in the Host header.
+      port: the port to connect to.
+      method: the http method.
+      path: the path, with the query string if any.
+      body: the request body or None.
+      headers: dictionary of extra headers.
+      callback: function called with the status code and body.
+      address: the resolved (ip, port) to connect to. By default host is
+          looked up with resolve.
+      timeout: seconds after which the request is given up.
+    """
+    asynchat.async_chat.__init__(self)
+    self._callback = callback
+    self.deadline = time.time() + timeout
+    self._data = []
+    if body is None:
+      body = ''
+    lines = ['%s %s HTTP/1.0' % (method, path), 'Host: %s' % host,
+             'Content-Length: %d' % len(body)]
+    lines.extend(['%s: %s' % header for header in headers.items()])
+    self._request = '\r\n'.join(lines) + '\r\n\r\n' + body
+    self.set_terminator(None)
+    if address is None:
+      address = resolve(host, port)
+    self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+      self.connect(address)
+    except:
+      # Otherwise the socket would stay in the loop.
+      self.close()
+      raise
+
+  def handle_connect(self):
+    self.push(self._request)
+
+  def collect_incoming_data(self, data):
+    self._data.append(data)
+
+  def _finish(self, code, content):
+    self.close()
+    callback = self._callback
+    if callback is not None:
+      self._callback = None
+      try:
+        callback(code, content)
+      except:
+        # Left to handle_error, the error would be lost, as the callback
+        # has been cleared already.
+        _rpc_log.exception('Request callback failed')
+
+  def handle_close(self):
+    self._finish(*_parse_response(''.join(self._data)))
+
+  def handle_error(self):
+    error = sys.exc_info()[1]
+    _rpc_log.warning('Request failed: %s', error)
+    self._finish(None, 'Request failed: %s' % error)
+
+  def expire(self):
+    """Gives up the request, answering it with a 504."""
+    _rpc_log.warning('Request timed out')
+    self._finish(504, 'Request timed out')
+
+
+def expire_requests(now=None):
+  """Gives up the requests whose deadline has passed."""
+  if now is None:
+    now = time.time()
+  for channel in asyncore.socket_map.values():
+    if isinstance(channel, HttpClient) and channel.deadline <= now:
+      channel.expire()
+
+
+def poll(timeout=POLL_INTERVAL):
+  """Handles the io that is ready within timeout, then expires requests."""
+  asyncore.loop(timeout=timeout, use_poll=True, count=1)
+  expire_requests()
+
+
+def post(url, data, headers, callback, timeout=relay.DEFAULT_TIMEOUT):
+  """Posts data to an http url without blocking, see HttpClient."""
+  scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+  if scheme != 'http':
+    raise ValueError('Only http urls are supported: %s' % url)
+  host, port = _split_host(netloc)
+  if query:
+    path += '?' + query
+  return HttpClient(host, port, 'POST', path or '/', data, headers,
+                    callback, timeout=timeout)
+
+
+def submit_async(robot, wavelet, callback):
+  """Submits the pending operations of a wavelet without blocking.
+
+  Unlike Robot.submit, the operations are taken off the wavelet right
+  away, so they are not retried by a later submit if this one fails.
+
+  Args:
+    robot: the robot to sign the request with.
+    wavelet: the wavelet whose operations should be submitted.
+    callback: called with the decoded result, or with None and the
+        IOError or ValueError if the submission failed, also when it
+        could not be started.
+  """
+  url, body, headers = robot.submit_request(wavelet)
+
+  def done(code, content):
+    try:
+      res = robot.rpc_result(url, code, content)
+    except (IOError, ValueError), e:
+      callback(None, e)
+      return
+    _rpc_log.info('submit returned:%s', logs.Payload(res))
+    callback(res, None)
+
+  try:
+    post(url, body, headers, done)
+  except (IOError, ValueError), e:
+    callback(None, e)
+
+
+class RobotChannel(asynchat.async_chat):
+  """Connection of the wave server to the robot; serves a single request."""
+
+  def __init__(self, server, sock):
+    asynchat.async_chat.__init__(self, sock)
+    self._server = server
+    self._robot = server.robot
+    self._data = []
+    self._method = None
+    self._path = None
+    self._query = None
+    self._if_none_match = None
+    self.set_terminator('\r\n\r\n')
+
+  def collect_incoming_data(self, data):
+    self._data.append(data)
+
+  def found_terminator(self):
+    data = ''.join(self._data)
+    self._data = []
+    if self._method is not None:
+      self.set_terminator(None)
+      self._handle(data)
+      return
+    lines = data.split('\r\n')
+    try:
+      self._method, target, _ = lines[0].split()
+    except ValueError:
+      self._method = 'GET'
+      self.set_terminator(None)
+      self.respond(400, 'text/plain', 'Bad request')
+      return
+    self._path = target.split('?', 1)[0]
+    self._query = target[len(self._path) + 1:]
+    length = 0
+    for line in lines[1:]:
+      header = line.split(':', 1)
+      if len(header) != 2:
+        continue
+      name = header[0].strip().lower()
+      if name == 'content-length':
+        try:
+          length = int(header[1].strip() or 0)
+          if length < 0:
+            raise ValueError('Negative length')
+        except ValueError:
+          self.set_terminator(None)
+          self.respond(400, 'text/plain', 'Bad Content-Length')
+          return
+      elif name == 'if-none-match':
+        self._if_none_match = header[1].strip()
+    if length:
+      self.set_terminator(length)
+    else:
+      self.set_terminator(None)
+      self._handle('')
+
+  def respond(self, code, content_type, body, etag=None):
+    """Sends the response and closes the connection."""
+    if isinstance(body, unicode):
+      body = body.encode('utf-8')
+    head = ['HTTP/1.0 %d %s' % (code, HTTP_REASONS.get(code, '')),
+            'Content-Type: %s' % content_type,
+            'Content-Length: %d' % len(body),
+            'Connection: close']
+    if etag:
+      head.append('ETag: %s' % etag)
+    self.push('\r\n'.join(head) + '\r\n\r\n' + body)
+    self.close_when_done()
+
+  def _param(self, name):
+    return cgi.parse_qs(self._query or '').get(name, [''])[0]
+
+  def _handle(self, body):
+    path = self._path
+    try:
+      if path == '/_wave/capabilities.xml':
+        self._respond_cached('application/xml',
+                             self._robot.capabilities_etag(),
+                             self._robot.capabilities_xml)
+      elif path == '/_wave/robot/profile':
+        self._respond_cached('application/json', self._robot.profile_etag(),
+                             self._robot.profile_json)
+      elif path == '/_wave/robot/jsonrpc':
+        if self._method == 'GET':
+          body = self._param('ops')
+        self._handle_events(body)
+      elif path == '/_wave/verify_token':
+        self._handle_verify_token()
+      else:
+        self.respond(404, 'text/plain', 'Not found')
+    except:
+      _log.exception('Handling %s failed', path)
+      self.respond(500, 'text/plain', 'Internal error')
+
+  def _respond_cached(self, content_type, etag, method):
+    if robot_module.etag_matches(self._if_none_match, etag):
+      self.respond(304, content_type, '', etag)
+    else:
+      self.respond(200, content_type, method(), etag)
+
+  def _handle_events(self, json_body):
+    if not json_body:
+      self.respond(200, 'text/plain', '')
+      return
+    _log.info('Incoming: %s', logs.Payload(json_body))
+    operations, port, relay_json = self._robot.process_local_events(json_body)
+    if port is None:
+      self._send_operations(operations)
+      return
+
+    def relayed(code, content):
+      if code == 504:
+        self.respond(504, 'text/plain', 'Relay timed out')
+        return
+      if code != 200:
+        _log.info('Relay failed: %s', logs.Payload(content))
+        self.respond(502, 'text/plain', 'Relay failed')
+        return
+      try:
+        relayed_operations = simplejson.loads(content)
+      except ValueError:
+        _log.exception('Relay answered garbage')
+        self.respond(502, 'text/plain', 'Relay failed')
+        return
+      try:
+        operations.extend(relayed_operations)
+        self._send_operations(operations)
+      except:
+        _log.exception('Handling %s failed', self._path)
+        self.respond(500, 'text/plain', 'Internal error')
+
+    path, body, headers = relay.relay_request(port, relay_json)
+    host, port = _split_host(self._server.relay_host)
+    HttpClient(host, port, 'POST', path, body, headers, relayed,
+               self._server.relay_address, self._server.relay_timeout)
+
+  def _send_operations(self, operations):
+    json_response = simplejson.dumps(operations)
+    _log.info('Outgoing: %s', logs.Payload(json_response))
+    self.respond(200, 'application/json; charset=utf-8', json_response)
+
+  def _handle_verify_token(self):
+    token, st = self._robot.get_verification_token_info()
+    if token is None:
+      self.respond(404, 'text/plain', 'No token set')
+      return
+    if st is not None and self._param('st') != st:
+      self.respond(200, 'text/plain', 'Invalid st value passed')
+      return
+    self.respond(200, 'text/plain', token)
+
+
+class RobotServer(asyncore.dispatcher):
+  """Listens for the wave server and serves each connection on a channel."""
+
+  def __init__(self, robot, address, relay_host=None,
+               relay_timeout=relay.DEFAULT_TIMEOUT):
+    """Initializes the server and starts listening.
+
+    Args:
+      robot: the robot to serve.
+      address: (host, port) tuple to listen on.
+      relay_host: host[:port] of the relay server. Defaults to the host
+          of the robot's relay transport. It is looked up right away.
+      relay_timeout: seconds to wait for the relay before answering the
+          wave server with a 504.
+    """
+    asyncore.dispatcher.__init__(self)
+    self.robot = robot
+    self.relay_timeout = relay_timeout
+    if relay_host is None:
+      relay_host = getattr(robot.relay_transport, 'host',
+                           relay.DEFAULT_RELAY_HOST)
+    self.set_relay_host(relay_host)
+    self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.set_reuse_addr()
+    self.bind(address)
+    self.listen(128)
+
+  def set_relay_host(self, relay_host):
+    """Sets the host[:port] of the relay server and looks it up."""
+    self.relay_address = resolve(*_split_host(relay_host))
+    self.relay_host = relay_host
+
+  @property
+  def address(self):
+    """The (host, port) the server listens on."""
+    return self.socket.getsockname()
+
+  def handle_accept(self):
+    pair = self.accept()
+    if pair is not None:
+      RobotChannel(self, pair[0])
+
+
+def run(robot, host='', port=8080, log_errors=True):
+  """Serves the robot on host and port until the process is stopped.
+
+  Args:
+    robot: the robot to run.
+    host: interface to listen on, all of them by default.
+    port: port to listen on.
+    log_errors: whether to register a handler logging failed operations.
+  """
+  if log_errors:
+    robot.register_handler(events.OperationError,
+                           robot_module.operation_error_handler)
+  RobotServer(robot, (host, port))
+  while True:
+    poll()
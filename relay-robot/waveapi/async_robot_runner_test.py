@@ -0,0 +1,208 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the async_robot_runner module."""
+
+
+import BaseHTTPServer
+import cgi
+import httplib
+import socket
+import threading
+import unittest
+
+import async_robot_runner
+import events
+import ops
+import robot
+import robot_test
+import simplejson
+
+
+class FakeRelayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Answers every post with a single operation and records the bundle."""
+
+  posted = []
+  response = '[{"method":"relayed"}]'
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    FakeRelayHandler.posted.append((self.path, cgi.parse_qs(body)['events'][0]))
+    response = FakeRelayHandler.response
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(response)))
+    self.end_headers()
+    self.wfile.write(response)
+
+  def log_message(self, *args):
+    pass
+
+
+class TestRobotServer(unittest.TestCase):
+
+  def setUp(self):
+    FakeRelayHandler.posted = []
+    FakeRelayHandler.response = '[{"method":"relayed"}]'
+    self.relay = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeRelayHandler)
+    self.relay_thread = threading.Thread(target=self.relay.serve_forever)
+    self.relay_thread.setDaemon(True)
+    self.relay_thread.start()
+
+    self.robot = robot.Robot('Testy')
+    self.server = async_robot_runner.RobotServer(
+        self.robot, ('127.0.0.1', 0),
+        relay_host='127.0.0.1:%d' % self.relay.server_address[1])
+    self.running = True
+    self.loop_thread = threading.Thread(target=self._loop)
+    self.loop_thread.setDaemon(True)
+    self.loop_thread.start()
+
+  def _loop(self):
+    while self.running:
+      async_robot_runner.poll(0.01)
+
+  def tearDown(self):
+    self.running = False
+    self.loop_thread.join()
+    self.server.close()
+    self.relay.shutdown()
+    self.relay.server_close()
+
+  def request(self, method, path, body=None, headers=None):
+    conn = httplib.HTTPConnection('127.0.0.1', self.server.address[1],
+                                  timeout=5)
+    conn.request(method, path, body, headers or {})
+    response = conn.getresponse()
+    content = response.read()
+    conn.close()
+    self.etag = response.getheader('ETag')
+    return response.status, response.getheader('Content-Type'), content
+
+  def testCapabilities(self):
+    self.robot.register_handler(events.BlipSubmitted, lambda e, w: None)
+    code, content_type, content = self.request('GET',
+                                               '/_wave/capabilities.xml')
+    self.assertEquals(200, code)
+    self.assertEquals('application/xml', content_type)
+    self.assertEquals(self.robot.capabilities_xml(), content)
+
+  def testCapabilitiesNotModified(self):
+    self.request('GET', '/_wave/capabilities.xml')
+    self.assertEquals(self.robot.capabilities_etag(), self.etag)
+    code, _, content = self.request('GET', '/_wave/capabilities.xml',
+                                    headers={'If-None-Match': self.etag})
+    self.assertEquals(304, code)
+    self.assertEquals('', content)
+
+  def testProfile(self):
+    code, content_type, content = self.request('GET', '/_wave/robot/profile')
+    self.assertEquals(200, code)
+    self.assertEquals('Testy', simplejson.loads(content)['name'])
+
+  def testVerifyToken(self):
+    self.assertEquals(404, self.request('GET', '/_wave/verify_token')[0])
+    self.robot.set_verification_token_info('token', 'st')
+    self.assertEquals('token',
+                      self.request('GET', '/_wave/verify_token?st=st')[2])
+    self.assertEquals('Invalid st value passed',
+                      self.request('GET', '/_wave/verify_token?st=x')[2])
+
+  def testUnknownPath(self):
+    self.assertEquals(404, self.request('GET', '/nothing')[0])
+
+  def testBadContentLength(self):
+    conn = socket.create_connection(self.server.address, 5)
+    try:
+      conn.sendall('POST /_wave/robot/jsonrpc HTTP/1.0\r\n'
+                   'Content-Length: abc\r\n\r\n')
+      self.assertTrue(conn.recv(1024).startswith('HTTP/1.0 400 '))
+    finally:
+      conn.close()
+
+  def testLocalEvents(self):
+    def check(event, wavelet):
+      wavelet.title = 'new title'
+
+    self.robot.register_handler(events.WaveletParticipantsChanged, check)
+    code, _, content = self.request('POST', '/_wave/robot/jsonrpc',
+                                    robot_test.TEST_JSON)
+    self.assertEquals(200, code)
+    self.assertEquals([ops.ROBOT_NOTIFY_CAPABILITIES_HASH,
+                       ops.WAVELET_SET_TITLE],
+                      [op['method'] for op in simplejson.loads(content)])
+    self.assertEquals([], FakeRelayHandler.posted)
+
+  def testRelayedEvents(self):
+    self.robot.dispatch_locally(events.BlipSubmitted)
+    code, _, content = self.request('POST', '/_wave/robot/jsonrpc',
+                                    robot_test.PROXYING_JSON)
+    self.assertEquals(200, code)
+    self.assertEquals([ops.ROBOT_NOTIFY_CAPABILITIES_HASH, 'relayed'],
+                      [op['method'] for op in simplejson.loads(content)])
+    path, relayed = FakeRelayHandler.posted[0]
+    self.assertEquals('/8080/wave', path)
+    self.assertEquals(['WAVELET_PARTICIPANTS_CHANGED'],
+                      [e['type'] for e in simplejson.loads(relayed)['events']])
+
+  def testRelayDown(self):
+    self.server.set_relay_host('127.0.0.1:1')
+    code, _, _ = self.request('POST', '/_wave/robot/jsonrpc',
+                              robot_test.PROXYING_JSON)
+    self.assertEquals(502, code)
+
+  def testRelayTimesOut(self):
+    silent = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    silent.bind(('127.0.0.1', 0))
+    silent.listen(1)
+    try:
+      self.server.set_relay_host('127.0.0.1:%d' % silent.getsockname()[1])
+      self.server.relay_timeout = 0.1
+      code, _, _ = self.request('POST', '/_wave/robot/jsonrpc',
+                                robot_test.PROXYING_JSON)
+    finally:
+      silent.close()
+    self.assertEquals(504, code)
+
+  def testRelayAnswerFailsToMerge(self):
+    FakeRelayHandler.response = '5'
+    code, _, _ = self.request('POST', '/_wave/robot/jsonrpc',
+                              robot_test.PROXYING_JSON)
+    self.assertEquals(500, code)
+
+  def testRelayHostResolvedUpfront(self):
+    self.server.set_relay_host('localhost:1234')
+    self.assertEquals(('127.0.0.1', 1234), self.server.relay_address)
+    self.assertEquals(('127.0.0.1', 1234),
+                      async_robot_runner.resolve('localhost', 1234))
+
+
+class TestSubmitAsync(unittest.TestCase):
+
+  def testPostFailsUpfront(self):
+    test_robot = robot.Robot('Testy')
+    test_robot.setup_oauth('key', 'secret', 'https://127.0.0.1/rpc')
+    wavelet = test_robot.blind_wavelet(robot_test.TEST_JSON)
+    wavelet.title = 'new title'
+    results = []
+    async_robot_runner.submit_async(test_robot, wavelet,
+                                    lambda res, e: results.append((res, e)))
+    self.assertEquals(1, len(results))
+    self.assertEquals(None, results[0][0])
+    self.assertTrue(isinstance(results[0][1], ValueError))
+
+
+if __name__ == '__main__':
+  unittest.main()
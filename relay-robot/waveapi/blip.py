@@ -17,6 +17,24 @@
 
 import logging
 import element
+import positions
+import rope
+import textsearch
+
+
+# Element properties that Blip.all and Blip.first find through an index.
+INDEXED_ELEMENT_PROPERTIES = ('url', 'name')
+
+
+def _element_groups(el):
+  """Returns the keys under which an element is found in Blip._elements."""
+  groups = [el.type]
+  for name in INDEXED_ELEMENT_PROPERTIES:
+    value = getattr(el, name, None)
+    if isinstance(value, basestring):
+      groups.append((el.type, name, value))
+  return groups
+
 
 class Annotation(object):
   """Models an annotation on a document.
@@ -77,67 +95,45 @@ class Annotations(object):
 
   def _add_internal(self, name, value, start, end):
     """Internal add annotation does not send out operations."""
-    if name in self._store:
-      # this could be done more efficient if the list was sorted
-      new_list = []
-      for existing in self._store[name]:
-        if start > existing.end or end < existing.start:
-          new_list.append(existing)
-        else:
-          if existing.value == value:
-            # merge the annotations:
-            start = min(existing.start, start)
-            end = max(existing.end, end)
-          else:
-            # chop the bits off the existing annotation
-            if existing.start < start:
-              new_list.append(Annotation(
-                  existing.name, existing.value, existing.start, start))
-            if existing.end > end:
-              new_list.append(Annotation(
-                  existing.name, existing.value, existing.end, end))
-      new_list.append(Annotation(name, value, start, end))
-      self._store[name] = new_list
-    else:
-      self._store[name] = [Annotation(name, value, start, end)]
+    index = self._store.get(name)
+    if index is None:
+      index = self._store[name] = positions.IntervalIndex()
+    index.add(start, end, value)
 
   def _delete_internal(self, name, start=0, end=-1):
     if not name in self._store:
       return
     if end < 0:
       end = len(self._blip) + end
-
-    new_list = []
-    for a in self._store[name]:
-      if start > a.end or end < a.start:
-        new_list.append(a)
-      elif start < a.start and end > a.end:
-        continue
-      else:
-        if a.start < start:
-          new_list.append(Annotation(name, a.value, a.start, start))
-        if a.end > end:
-          new_list.append(Annotation(name, a.value, a.end, end))
-    if new_list:
-      self._store[name] = new_list
-    else:
+    index = self._store[name]
+    index.delete(start, end)
+    if not index:
       del self._store[name]
 
   def _shift(self, where, inc):
-    for annotations in self._store.values():
-      for annotation in annotations:
-        annotation._shift(where, inc)
+    for name, index in self._store.items():
+      index.shift(where, inc)
+      if not index:
+        del self._store[name]
 
   def __len__(self):
     return len(self._store)
 
   def __getitem__(self, key):
-    return self._store[key]
-  
+    return [Annotation(key, value, start, end)
+            for start, end, value in self._store[key]]
+
+  def overlapping(self, name, start, end):
+    """Returns the annotations with a name that overlap a range."""
+    if not name in self._store:
+      return []
+    return [Annotation(name, value, s, e)
+            for s, e, value in self._store[name].overlapping(start, end)]
+
   def serialize(self):
     res = []
-    for v in self._store.values():
-      res += [a.serialize() for a in v]
+    for name in self._store:
+      res += [a.serialize() for a in self[name]]
     return res
 
 
@@ -156,6 +152,9 @@ class Blips(object):
   def __len__(self):
     return len(self._blips)
 
+  def __contains__(self, blip_id):
+    return blip_id in self._blips
+
   def _add(self, ablip):
     self._blips[ablip.blip_id] = ablip
 
@@ -172,6 +171,210 @@ class Blips(object):
     return res
 
 
+class LazyBlips(Blips):
+  """Blips that are only constructed from their json when first accessed.
+
+  Incoming bundles contain every blip of the wavelet, while a handler
+  typically only looks at one or two of them. LazyBlips holds on to the
+  raw json and constructs a Blip the first time it is asked for.
+  """
+
+  def __init__(self, raw_blips, operation_queue):
+    """Initializes self with the raw json of the blips.
+
+    Args:
+      raw_blips: dictionary like object from blip id to blip json.
+      operation_queue: the operation queue for the constructed blips.
+    """
+    super(LazyBlips, self).__init__({})
+    self._raw_blips = raw_blips
+    self._operation_queue = operation_queue
+    self._all_blips = self
+    self._materialized = {}
+    self._removed = set()
+    self._wave_id = None
+    self._wavelet_id = None
+
+  def restricted_to(self, wave_id, wavelet_id):
+    """Returns a view on just the blips of the specified wavelet.
+
+    The view shares the constructed blips with self, but blips added to
+    or removed from it are not reflected in self.
+    """
+    res = LazyBlips(self._raw_blips, self._operation_queue)
+    res._all_blips = self
+    res._materialized = self._materialized
+    res._wave_id = wave_id
+    res._wavelet_id = wavelet_id
+    return res
+
+  @property
+  def materialized_count(self):
+    """The number of blips constructed from their json so far."""
+    return len(self._materialized)
+
+  def _has_raw(self, blip_id):
+    if blip_id in self._removed or blip_id not in self._raw_blips:
+      return False
+    if self._wave_id is None:
+      return True
+    raw_blip_data = self._raw_blips[blip_id]
+    return (raw_blip_data.get('waveId') == self._wave_id and
+            raw_blip_data.get('waveletId') == self._wavelet_id)
+
+  def _ids(self):
+    res = [blip_id for blip_id in self._raw_blips if self._has_raw(blip_id)]
+    return res + [blip_id for blip_id in self._blips
+                  if not blip_id in self._raw_blips]
+
+  def __getitem__(self, blip_id):
+    if blip_id in self._blips:
+      return self._blips[blip_id]
+    if not self._has_raw(blip_id):
+      raise KeyError(blip_id)
+    instance = self._materialized.get(blip_id)
+    if instance is None:
+      instance = Blip(self._raw_blips[blip_id], self._all_blips,
+                      self._operation_queue)
+      self._materialized[blip_id] = instance
+    return instance
+
+  def __iter__(self):
+    return self._ids().__iter__()
+
+  def __len__(self):
+    return len(self._ids())
+
+  def __contains__(self, blip_id):
+    return blip_id in self._blips or self._has_raw(blip_id)
+
+  def _add(self, ablip):
+    self._removed.discard(ablip.blip_id)
+    self._blips[ablip.blip_id] = ablip
+
+  def _remove_with_id(self, blip_id):
+    if blip_id in self._blips:
+      del self._blips[blip_id]
+    elif self._has_raw(blip_id):
+      self._removed.add(blip_id)
+    else:
+      raise KeyError(blip_id)
+
+  def get(self, blip_id, default_value=None):
+    try:
+      return self[blip_id]
+    except KeyError:
+      return default_value
+
+  def serialize(self):
+    res = {}
+    for id in self._ids():
+      res[id] = self[id].serialize()
+    return res
+
+
+def _touching(a, b):
+  """Returns whether two ranges overlap or touch."""
+  return a['start'] <= b['end'] and b['start'] <= a['end']
+
+
+def _single_text(modify_action):
+  """Returns the text of a modify action inserting one string, or None."""
+  values = modify_action.get('values')
+  if (values and len(values) == 1 and isinstance(values[0], basestring) and
+      not 'elements' in modify_action):
+    return values[0]
+  return None
+
+
+def _merge_modify(operation, params, modify_action):
+  """Merges a document modify into the one queued right before it.
+
+  Only modifications of single ranges or of the whole document are
+  merged, and only when applying the merged one gives the same document
+  as applying both.
+
+  Args:
+    operation: the document modify operation queued last.
+    params: the parameters for the new operation.
+    modify_action: the modifyAction parameter for the new operation.
+
+  Returns:
+    Whether the new modification was merged into operation.
+  """
+  last_action = operation.params['modifyAction']
+  modify_how = modify_action['modifyHow']
+  if (last_action['modifyHow'] != modify_how or 'modifyQuery' in params or
+      'modifyQuery' in operation.params):
+    return False
+  last_range = operation.params.get('range')
+  new_range = params.get('range')
+  if last_range is None or new_range is None:
+    # Only appends to the whole document can be merged.
+    if last_range is not None or new_range is not None:
+      return False
+    last_text = _single_text(last_action)
+    new_text = _single_text(modify_action)
+    if (modify_how != BlipRefs.INSERT_AFTER or last_text is None or
+        new_text is None):
+      return False
+    last_action['values'] = [last_text + new_text]
+    return True
+  start = last_range['start']
+  end = last_range['end']
+  if modify_how in (BlipRefs.ANNOTATE, BlipRefs.CLEAR_ANNOTATION):
+    if (last_action.get('annotationKey') != modify_action.get('annotationKey')
+        or last_action.get('values') != modify_action.get('values')
+        or len(modify_action.get('values', [None])) != 1
+        or not _touching(last_range, new_range)):
+      return False
+    start = min(start, new_range['start'])
+    end = max(end, new_range['end'])
+  elif modify_how == BlipRefs.DELETE:
+    if new_range['start'] == start:
+      end += new_range['end'] - new_range['start']
+    elif new_range['end'] == start:
+      start = new_range['start']
+    else:
+      return False
+  else:
+    last_text = _single_text(last_action)
+    new_text = _single_text(modify_action)
+    if last_text is None or new_text is None:
+      return False
+    if modify_how == BlipRefs.INSERT:
+      if new_range['start'] != start + len(last_text):
+        return False
+    elif modify_how == BlipRefs.INSERT_AFTER:
+      if new_range['end'] != end + len(last_text):
+        return False
+    elif modify_how == BlipRefs.REPLACE:
+      if new_range['start'] != start + len(last_text):
+        return False
+      end += new_range['end'] - new_range['start']
+    else:
+      return False
+    last_action['values'] = [last_text + new_text]
+  # The range may be shared with a BlipRefs, so it is replaced, not changed.
+  operation.params['range'] = {'start': start, 'end': end}
+  return True
+
+
+class _Batch(object):
+  """Context manager returned by Blip.batch()."""
+
+  def __init__(self, blip):
+    self._blip = blip
+
+  def __enter__(self):
+    self._blip.begin_batch()
+    return self._blip
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self._blip.end_batch()
+    return False
+
+
 class BlipRefs(object):
   """Represents a set of references to contents in a blip.
 
@@ -206,6 +409,10 @@ class BlipRefs(object):
     if findwhat is None:
       # No findWhat, take the entire blip
       obj._params = {}
+    elif textsearch.is_pattern_set(findwhat):
+      # The server cannot repeat this search, _execute sends every hit
+      # as a range instead.
+      obj._params = None
     else:
       query = {'maxRes': maxres}
       if isinstance(findwhat, basestring):
@@ -237,11 +444,14 @@ class BlipRefs(object):
   def _find(self, what, maxres=-1, **restrictions):
     """Iterates where 'what' occurs in the blip.
 
-    What can be either a string or a class reference.
+    What can be either a string, a class reference or a pattern set as
+    understood by textsearch.compile.
     Examples:
         blip.Find('hello') will return the first occurence of the word hello
         blip.Find(element.Gadget, url='http://example.com/gadget.xml')
             will return the first gadget that has as url example.com.
+        blip.Find(set(['hello', re.compile('wor+ld')])) will return
+            the first hello or world, whichever comes first.
 
     Args:
       what: what to search for. Can be a class or a string. The class
@@ -266,9 +476,28 @@ class BlipRefs(object):
         if count == maxres:
           raise StopIteration
         idx = blip._content.find(what, idx + len(what))
+    elif textsearch.is_pattern_set(what):
+      # The hits are found in one pass over the text as it is now. An
+      # edit made at a hit moves the ones after it by the change in length.
+      hits = textsearch.compile(what).find_all(blip._content, maxres)
+      shift = 0
+      for start, end in hits:
+        length = len(blip)
+        yield start + shift, end + shift
+        shift += len(blip) - length
     else:
       count = 0
-      for idx, el in blip._elements.items():
+      element_type = getattr(what, 'type', None)
+      if isinstance(element_type, basestring):
+        group = element_type
+        for name in INDEXED_ELEMENT_PROPERTIES:
+          if isinstance(restrictions.get(name), basestring):
+            group = (element_type, name, restrictions[name])
+            break
+        candidates = blip._elements.in_group(group)
+      else:
+        candidates = blip._elements.items()
+      for idx, el in candidates:
         if self._elem_matches(el, what, **restrictions):
           yield idx, idx + 1
           count += 1
@@ -298,6 +527,8 @@ class BlipRefs(object):
     # updated_elements is used to store the element type of the
     # element to update
     updated_elements = []
+    # the range and value of every hit, for when each is sent on its own
+    hits = []
 
     for start, end in self._hits():
       if start < 0:
@@ -311,21 +542,22 @@ class BlipRefs(object):
           raise IndexError('Start and end have to be 0 for empty document')
       elif start < 0 or end < 1 or start >= len(blip) or end > len(blip):
         raise IndexError('Position outside the document')
+      hit_range = {'start': start, 'end': end}
       if modify_how == BlipRefs.DELETE:
-        for i in range(start, end):
-          if i in blip._elements:
-            del blip._elements[i]
+        blip._elements.delete_range(start, end)
         blip._shift(end, start - end)
-        blip._content = blip._content[:start] + blip._content[end:]
+        blip._content.delete(start, end)
+        hits.append((hit_range, None))
       else:
         if callable(what):
-          next = what(blip._content, start, end)
+          next = what(blip.text, start, end)
           matched.append(next)
         else:
           next = what[next_index]
           next_index = (next_index + 1) % len(what)
         if isinstance(next, str):
           next = next.decode('utf-8')
+        hits.append((hit_range, next))
         if modify_how == BlipRefs.ANNOTATE:
           key, value = next
           blip.annotations._add_internal(key, value, start, end)
@@ -333,10 +565,11 @@ class BlipRefs(object):
           blip.annotations._delete_internal(next, start, end)
         elif modify_how == BlipRefs.UPDATE_ELEMENT:
           el = blip._elements.get(start)
-          if not element:
+          if el is None:
             raise ValueError('No element found at index %s' % start)
           # the passing around of types this way feels a bit dirty:
           updated_elements.append(element.Element(el.type, properties=next))
+          hits[-1] = (hit_range, updated_elements[-1])
           for k, b in next.items():
             setattr(el, k, b)
         else:
@@ -350,41 +583,75 @@ class BlipRefs(object):
             raise ValueError('Unexpected modify_how: ' + modify_how)
           if isinstance(next, basestring):
             blip._shift(end, len(next) + start - end)
-            blip._content = blip._content[:start] + next + blip._content[end:]
+            blip._content.replace(start, end, next)
           else:
             blip._shift(end, 1 + start - end)
-            blip._content = blip._content[:start] + ' ' + blip._content[end:]
-            blip._elements[start] = next
+            blip._content.replace(start, end, ' ')
+            blip._add_element(start, next)
 
-    operation = blip._operation_queue.DocumentModify(blip.wave_id,
-                                                     blip.wavelet_id,
-                                                     blip.blip_id)
-    for param, value in self._params.items():
-      operation.set_param(param, value)
+    if self._params is None:
+      for hit_range, value in hits:
+        if modify_how == BlipRefs.DELETE:
+          values = None
+        else:
+          values = [value]
+        self._queue_modify({'range': hit_range},
+                           self._modify_action(modify_how, values))
+      return self
+
+    if modify_how == BlipRefs.UPDATE_ELEMENT:
+      values = updated_elements
+    elif callable(what):
+      values = matched
+    else:
+      values = what
+    self._queue_modify(self._params, self._modify_action(modify_how, values))
+    return self
 
+  def _modify_action(self, modify_how, values):
+    """Returns the modifyAction parameter for a document modify operation."""
     modify_action = {'modifyHow': modify_how}
     if modify_how == BlipRefs.DELETE:
       pass
     elif modify_how == BlipRefs.UPDATE_ELEMENT:
-      modify_action['elements'] = updated_elements
+      modify_action['elements'] = values
     elif (modify_how == BlipRefs.REPLACE or
           modify_how == BlipRefs.INSERT or
           modify_how == BlipRefs.INSERT_AFTER):
-      if callable(what):
-        what = matched
-      if what:
-        if isinstance(what[0], basestring):
-          modify_action['values'] = what
+      if values:
+        if isinstance(values[0], basestring):
+          modify_action['values'] = values
         else:
-          modify_action['elements'] = what
+          modify_action['elements'] = values
     elif modify_how == BlipRefs.ANNOTATE:
-      modify_action['values'] = [x[1] for x in what]
-      modify_action['annotationKey'] = what[0][0]
+      modify_action['values'] = [x[1] for x in values]
+      modify_action['annotationKey'] = values[0][0]
     elif modify_how == BlipRefs.CLEAR_ANNOTATION:
-      modify_action['annotationKey'] = what[0]
-    operation.set_param('modifyAction', modify_action)
+      modify_action['annotationKey'] = values[0]
+    return modify_action
 
-    return self
+  def _queue_modify(self, params, modify_action):
+    """Queues a document modify operation on the blip.
+
+    Inside a batch, the modification is merged into the operation queued
+    right before it when possible. The local state of the blip has been
+    updated by the caller either way.
+    """
+    blip = self._blip
+    queue = blip._operation_queue
+    if blip._batch_depth and blip._last_modify is not None:
+      last_operation, queue_length = blip._last_modify
+      if (queue_length == len(queue) and
+          _merge_modify(last_operation, params, modify_action)):
+        return
+    operation = queue.DocumentModify(blip.wave_id,
+                                     blip.wavelet_id,
+                                     blip.blip_id)
+    for param, value in params.items():
+      operation.set_param(param, value)
+    operation.set_param('modifyAction', modify_action)
+    if blip._batch_depth:
+      blip._last_modify = (operation, len(queue))
 
   def insert(self, what):
     """Inserts what at the matched positions."""
@@ -493,14 +760,17 @@ class Blip(object):
     self._blip_id = json.get('blipId')
     self._operation_queue = operation_queue
     self._child_blip_ids = set(json.get('childBlipIds', []))
-    self._content = json.get('content', '')
+    self._content = rope.Rope(json.get('content', ''))
     self._contributors = set(json.get('contributors', []))
     self._creator = json.get('creator')
     self._last_modified_time = json.get('lastModifiedTime', 0)
     self._parent_blip_id = json.get('parentBlipId')
     self._wave_id = json.get('waveId')
     self._wavelet_id = json.get('waveletId')
-    self._other_blips = Blips(other_blips)
+    if isinstance(other_blips, Blips):
+      self._other_blips = other_blips
+    else:
+      self._other_blips = Blips(other_blips)
     self._annotations = Annotations(operation_queue, self)
     for annjson in json.get('annotations', []):
       range = annjson['range']
@@ -508,11 +778,14 @@ class Blip(object):
                                       annjson['value'],
                                       range['start'],
                                       range['end'])
-    self._elements = {}
+    self._elements = positions.PositionIndex(groups_of=_element_groups)
     json_elements = json.get('elements', {})
     for elem in json_elements:
-      self._elements[int(elem)] = element.Element.from_json(json_elements[elem])
+      self._add_element(int(elem),
+                        element.Element.from_json(json_elements[elem]))
     self.raw_data = json
+    self._batch_depth = 0
+    self._last_modify = None
 
   @property
   def blip_id(self):
@@ -607,16 +880,47 @@ class Blip(object):
     """short cut for self.range/at().delete()."""
     self.__getitem__(item).delete()
 
+  def _add_element(self, position, el):
+    """Stores el at position, regrouping it when its properties change."""
+    el._on_change = self._elements.values_changed
+    self._elements[position] = el
+
   def _shift(self, where, inc):
     """Move element and annotations after where up by inc."""
-    new_elements = {}
-    for idx, el in self._elements.items():
-      if idx >= where:
-        idx += inc
-      new_elements[idx] = el
-    self._elements = new_elements
+    self._elements.shift(where, inc)
     self._annotations._shift(where, inc)
 
+  def begin_batch(self):
+    """Starts merging the document modifications made to this blip.
+
+    Consecutive modifications that can be expressed as one, like a
+    series of appends or annotations of adjacent ranges with the same
+    value, are sent as a single document modify operation until the
+    matching end_batch(). Batches can be nested.
+
+    Only the operations are merged. The content, elements and
+    annotations of the blip are still updated by every modification,
+    as later ones in the batch find their ranges in the updated blip.
+    """
+    self._batch_depth += 1
+
+  def end_batch(self):
+    """Ends the batch started by the matching begin_batch()."""
+    if self._batch_depth == 0:
+      raise ValueError('end_batch() without begin_batch()')
+    self._batch_depth -= 1
+    if self._batch_depth == 0:
+      self._last_modify = None
+
+  def batch(self):
+    """Returns a context manager wrapping begin_batch() and end_batch().
+
+      with blip.batch():
+        blip.append('hello ')
+        blip.append('world')
+    """
+    return _Batch(self)
+
   def all(self, findwhat=None, maxres=-1, **restrictions):
     return BlipRefs.all(self, findwhat, maxres, **restrictions)
 
@@ -633,7 +937,7 @@ class Blip(object):
     """Return a dictionary representation of this blip ready for json."""
     return {'blipId': self._blip_id,
             'childBlipIds': list(self._child_blip_ids),
-            'content': self._content,
+            'content': self._content.text,
             'creator': self._creator,
             'contributors': list(self._contributors),
             'lastModifiedTime': self._last_modified_time,
@@ -660,7 +964,7 @@ class Blip(object):
                operation_queue=operation_queue)
     res._blip_id = self._blip_id
     res._child_blip_ids = self._child_blip_ids
-    res._content = self._content
+    res._content = self._content.copy()
     res._contributors = self._contributors
     res._creator = self._creator
     res._last_modified_time = self._last_modified_time
@@ -676,7 +980,7 @@ class Blip(object):
   @property
   def text(self):
     """Returns the raw text content of this document."""
-    return self._content
+    return self._content.text
 
   def find(self, what, **restrictions):
     """Iterate to matching bits of contents.
@@ -715,7 +1019,7 @@ class Blip(object):
                                                self.blip_id,
                                                markup)
     #TODO(Douwe): at least strip the html out
-    self._content += markup
+    self._content.append(markup)
 
   def insert_inline_blip(self, position):
     """Inserts an inline blip into this blip at a specific position.
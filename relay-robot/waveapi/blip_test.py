@@ -17,6 +17,7 @@
 """Unit tests for the blip module."""
 
 
+import re
 import unittest
 
 import blip
@@ -112,6 +113,16 @@ class TestBlip(unittest.TestCase):
     blip.at(3).insert(' ')
     self.assertBlipStartswith('\nho la jupiter', blip)
 
+  def testManyEditsInLongBlip(self):
+    content = u'\n' + u'foo bar ' * 500
+    blip = self.new_blip(blipId=ROOT_BLIP_ID, content=content)
+    blip.all('foo').replace('quux')
+    blip.all('bar').delete()
+    expected = content.replace(u'foo', u'quux').replace(u'bar', u'')
+    self.assertEquals(expected, blip.text)
+    self.assertEquals(len(expected), len(blip))
+    self.assertEquals(expected, blip.serialize()['content'])
+
   def testElementHandling(self):
     blip = self.new_blip(blipId=ROOT_BLIP_ID)
     url = 'http://www.test.com/image.png'
@@ -142,6 +153,41 @@ class TestBlip(unittest.TestCase):
     elem = blip[1].value()
     self.assertTrue(isinstance(elem, element.Image))
 
+  def testElementsInDocumentOrder(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    for i in range(5):
+      blip.append(element.Gadget('http://test.com/%d.xml' % i))
+      blip.append(element.Image(url='http://test.com/%d.png' % i))
+    blip.at(0).insert('more text')
+    urls = [elem.url for elem in blip.find(element.Gadget)]
+    self.assertEquals(['http://test.com/%d.xml' % i for i in range(5)], urls)
+    self.assertEquals(10, len(blip.elements))
+    blip.first(element.Image).delete()
+    self.assertEquals(['http://test.com/%d.png' % i for i in range(1, 5)],
+                      [elem.url for elem in blip.find(element.Image)])
+
+  def testFindElementByProperty(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    for i in range(3):
+      blip.append(element.Gadget('http://test.com/%d.xml' % i))
+    blip.at(0).insert('more text')
+    found = blip.first(element.Gadget, url='http://test.com/1.xml')
+    self.assertEquals('http://test.com/1.xml', found.value().url)
+    found.update_element({'url': 'http://test.com/new.xml'})
+    self.assertFalse(blip.first(element.Gadget, url='http://test.com/1.xml'))
+    found = blip.first(element.Gadget, url='http://test.com/new.xml')
+    self.assertEquals('http://test.com/new.xml', found.value().url)
+
+  def testFindElementAfterPropertySetDirectly(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    for i in range(3):
+      blip.append(element.Gadget('http://test.com/%d.xml' % i))
+    gadget = blip.first(element.Gadget, url='http://test.com/2.xml').value()
+    gadget.url = 'http://test.com/set.xml'
+    self.assertFalse(blip.first(element.Gadget, url='http://test.com/2.xml'))
+    self.assertEquals([gadget], list(blip.find(element.Gadget,
+                                               url='http://test.com/set.xml')))
+
   def testAnnotationHandling(self):
     key = 'style/fontWeight'
 
@@ -178,6 +224,19 @@ class TestBlip(unittest.TestCase):
     # getting to the key should now throw an exception
     self.assertRaises(KeyError, blip.annotations.__getitem__, key)
 
+  def testAnnotationsFollowEdits(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID, annotations=[])
+    blip.range(1, 6).annotate('we/eval', 'x')
+    blip.range(7, 12).annotate('we/eval', 'y')
+    blip.range(2, 4).annotate('we/eval', 'z')
+    self.assertEquals([(1, 2), (2, 4), (4, 6), (7, 12)],
+                      [(a.start, a.end) for a in blip.annotations['we/eval']])
+    blip.first('hello').insert('oh ')
+    self.assertEquals([(1, 5), (5, 7), (7, 9), (10, 15)],
+                      [(a.start, a.end) for a in blip.annotations['we/eval']])
+    self.assertEquals(['y'], [a.value for a in
+                              blip.annotations.overlapping('we/eval', 9, 11)])
+
   def testBlipOperations(self):
     blip = self.new_blip(blipId=ROOT_BLIP_ID)
     self.assertEquals(1, len(self.all_blips))
@@ -197,6 +256,72 @@ class TestBlip(unittest.TestCase):
     self.assertEquals('a thing thing with thing and then some thing',
                       blip.text)
 
+  def testMultiPatternModify(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    blip.all().replace('cats and dogs and birds')
+    count = len(self.operation_queue)
+    blip.all(set(['cats', 'dogs', re.compile('b[aeiou]rds')])).replace('pets')
+    self.assertEquals('pets and pets and pets', blip.text)
+    operations = list(self.operation_queue)[count:]
+    self.assertEquals([{'start': 0, 'end': 4}, {'start': 9, 'end': 13},
+                       {'start': 18, 'end': 23}],
+                      [op.params['range'] for op in operations])
+    self.assertEquals(['pets'], operations[0].params['modifyAction']['values'])
+    self.assertEquals(['pets', 'pets'],
+                      list(blip.find(('pets', re.compile('nothing')),
+                                     maxres=2)))
+
+  def testMultiPatternModifyChangingLength(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    blip.all().replace('cat dog cat dooog')
+    blip.all(set(['cat', re.compile('do+g')])).replace('kitten')
+    self.assertEquals('kitten kitten kitten kitten', blip.text)
+    blip.all(set(['kitten'])).delete()
+    self.assertEquals('   ', blip.text)
+
+  def testBatchMergesModifications(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    count = len(self.operation_queue)
+    batch = blip.batch()
+    self.assertTrue(batch.__enter__() is blip)
+    blip.append('hello ')
+    blip.append('world')
+    blip.range(1, 3).annotate('we/eval', 'x')
+    blip.range(3, 6).annotate('we/eval', 'x')
+    blip.range(6, 8).annotate('we/eval', 'y')
+    blip.range(1, 2).insert('a')
+    blip.range(2, 3).insert('b')
+    batch.__exit__(None, None, None)
+    blip.append('!')
+    operations = list(self.operation_queue)[count:]
+    self.assertEquals(5, len(operations))
+    self.assertEquals(['hello world'],
+                      operations[0].params['modifyAction']['values'])
+    self.assertEquals({'start': 1, 'end': 6}, operations[1].params['range'])
+    self.assertEquals({'start': 6, 'end': 8}, operations[2].params['range'])
+    self.assertEquals(['ab'], operations[3].params['modifyAction']['values'])
+    self.assertEquals({'start': 1, 'end': 2}, operations[3].params['range'])
+    self.assertEquals(['!'], operations[4].params['modifyAction']['values'])
+    self.assertTrue(blip.text.endswith('hello world!'))
+    self.assertEquals('\nabhello', blip.text[:8])
+
+  def testBatchOnlyMergesConsecutiveOperations(self):
+    blip = self.new_blip(blipId=ROOT_BLIP_ID)
+    count = len(self.operation_queue)
+    blip.begin_batch()
+    blip.range(3, 5).delete()
+    blip.range(3, 4).delete()
+    blip.range(1, 3).delete()
+    blip.reply()
+    blip.range(1, 2).delete()
+    blip.end_batch()
+    operations = list(self.operation_queue)[count:]
+    self.assertEquals(3, len(operations))
+    self.assertEquals({'start': 1, 'end': 6}, operations[0].params['range'])
+    self.assertEquals({'start': 1, 'end': 2}, operations[2].params['range'])
+    self.assertEquals('\nwor', blip.text[:4])
+    self.assertRaises(ValueError, blip.end_batch)
+
   def testBlipRefValue(self):
     blip = self.new_blip(blipId=ROOT_BLIP_ID)
     content = blip.text
@@ -226,5 +351,52 @@ class TestBlip(unittest.TestCase):
     self.assertTrue(blip.first('geheim'))
     self.assertFalse(blip.first(element.Gadget))
 
+class TestLazyBlips(unittest.TestCase):
+  """Tests constructing blips on first access."""
+
+  def setUp(self):
+    raw_blips = {}
+    for blip_id, wavelet_id in [(ROOT_BLIP_ID, 'test.com!root+conv'),
+                                (CHILD_BLIP_ID, 'test.com!root+conv'),
+                                ('b+44', 'test.com!other')]:
+      data = TEST_BLIP_DATA.copy()
+      data.update(blipId=blip_id, waveletId=wavelet_id)
+      raw_blips[blip_id] = data
+    raw_blips[ROOT_BLIP_ID]['childBlipIds'] = [CHILD_BLIP_ID]
+    raw_blips[CHILD_BLIP_ID]['parentBlipId'] = ROOT_BLIP_ID
+    self.all_blips = blip.LazyBlips(raw_blips, ops.OperationQueue())
+    self.wavelet_blips = self.all_blips.restricted_to('test.com!w+g3h3im',
+                                                      'test.com!root+conv')
+
+  def testMaterializeOnAccess(self):
+    self.assertEquals(0, self.all_blips.materialized_count)
+    self.assertTrue(CHILD_BLIP_ID in self.wavelet_blips)
+    self.assertEquals(0, self.all_blips.materialized_count)
+    child = self.wavelet_blips[CHILD_BLIP_ID]
+    self.assertEquals(1, self.all_blips.materialized_count)
+    self.assertTrue(child is self.all_blips[CHILD_BLIP_ID])
+    self.assertEquals(ROOT_BLIP_ID, child.parent_blip.blip_id)
+    self.assertEquals(2, self.wavelet_blips.materialized_count)
+
+  def testRestrictedToWavelet(self):
+    self.assertEquals(3, len(self.all_blips))
+    self.assertEquals(2, len(self.wavelet_blips))
+    self.assertFalse('b+44' in self.wavelet_blips)
+    self.assertEquals(None, self.wavelet_blips.get('b+44'))
+    self.assertEquals('test.com!other', self.all_blips['b+44'].wavelet_id)
+    self.assertEquals(set([ROOT_BLIP_ID, CHILD_BLIP_ID]),
+                      set(self.wavelet_blips.serialize().keys()))
+
+  def testAddAndRemove(self):
+    root = self.wavelet_blips[ROOT_BLIP_ID]
+    reply = root.reply()
+    self.assertTrue(reply.blip_id in self.all_blips)
+    self.assertEquals(4, len(self.all_blips))
+    self.wavelet_blips._remove_with_id(CHILD_BLIP_ID)
+    self.assertFalse(CHILD_BLIP_ID in self.wavelet_blips)
+    self.assertTrue(CHILD_BLIP_ID in self.all_blips)
+    self.assertRaises(KeyError, self.wavelet_blips._remove_with_id, 'b+44')
+
+
 if __name__ == '__main__':
   unittest.main()
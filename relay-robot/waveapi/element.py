@@ -20,11 +20,12 @@ This module defines the Element class and the derived classes.
 """
 
 
-import logging
-
+import logs
 import util
 import sys
 
+_log = logs.get('element')
+
 class Element(object):
   """Elements are non-text content within a document.
 
@@ -57,14 +58,24 @@ class Element(object):
     # will set the operation_queue to make sure all changes to the
     # element are properly send to the server.
     self._operation_queue = None
+    # Called without arguments whenever a property is set, so an index
+    # of the blip holding the element can follow the change.
+    self._on_change = None
     for key, val in properties.items():
       setattr(self, key, val)
 
+  def __setattr__(self, name, value):
+    object.__setattr__(self, name, value)
+    if not name.startswith('_'):
+      on_change = self.__dict__.get('_on_change')
+      if on_change is not None:
+        on_change()
+
   @classmethod
   def from_json(cls, json):
     """Class method to instantiate an Element based on a json string."""
     etype = json['type']
-    logging.info('constructing: ' + str(json))
+    _log.debug('constructing: %s', logs.Payload(json))
     props = json['properties'].copy()
 
     element_class = ALL.get(etype)
@@ -243,7 +254,7 @@ class Image(Element):
   def from_props(cls, props):
     props = dict([(key.encode('utf-8'), value)
                   for key, value in props.items()])
-    logging.info('from_props=' + str(props))
+    _log.debug('from_props=%s', logs.Payload(props))
     return apply(Image, [], props)
 
 
@@ -25,3 +25,15 @@ __author__ = 'davidbyttow@google.com (David Byttow)'
 
 class Error(Exception):
   """Base library error type."""
+
+
+class HttpError(Error, IOError):
+  """An http request was answered with a status code other than 200."""
+
+  def __init__(self, code):
+    IOError.__init__(self, 'HttpError %s' % code)
+    self.code = code
+
+
+class ResponseError(Error, ValueError):
+  """A request was answered with 200, but the answer could not be read."""
@@ -0,0 +1,173 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental decoding of json objects.
+
+Incoming event bundles carry the complete blip tree of the wavelet, of
+which a handler typically only looks at a small part. LazyObject scans
+a json object once to find where each of its members lives in the
+document and only decodes a member when it is first accessed.
+"""
+
+import re
+
+import simplejson
+from simplejson import decoder
+
+FLAGS = re.VERBOSE | re.MULTILINE | re.DOTALL
+
+WHITESPACE = re.compile(r'[ \t\n\r]*', FLAGS)
+STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', FLAGS)
+# Strings are matched as a whole so brackets inside them are skipped.
+STRING_OR_BRACKET = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]', FLAGS)
+
+
+def _raw_decode(s, idx):
+  # Goes through the default decoder so simplejson.toggle_speedups applies.
+  return simplejson._default_decoder.raw_decode(s, idx)
+
+
+def skip_value(s, idx):
+  """Returns the index just past the json value starting at idx.
+
+  Objects, arrays and strings are skipped without decoding them.
+  """
+  nextchar = s[idx:idx + 1]
+  if nextchar == '"':
+    m = STRING.match(s, idx)
+    if m is None:
+      raise decoder.JSONDecodeError('Unterminated string', s, idx)
+    return m.end()
+  if nextchar != '{' and nextchar != '[':
+    return _raw_decode(s, idx)[1]
+  depth = 0
+  for m in STRING_OR_BRACKET.finditer(s, idx):
+    c = s[m.start()]
+    if c == '{' or c == '[':
+      depth += 1
+    elif c == '}' or c == ']':
+      depth -= 1
+      if depth == 0:
+        return m.end()
+  raise decoder.JSONDecodeError('Unterminated value', s, idx)
+
+
+class LazyObject(object):
+  """Dictionary like view on a json object that decodes members on access.
+
+  Construction only scans the object for the positions of its members.
+  Members are decoded the first time they are read and cached from then
+  on. Members named in lazy_keys that are objects themselves are
+  returned as LazyObjects rather than dictionaries.
+  """
+
+  def __init__(self, s, idx=0, lazy_keys=(), _w=WHITESPACE.match):
+    """Scans the json object starting at idx in s.
+
+    Args:
+      s: the json document, either a utf-8 encoded str or unicode.
+      idx: index in s where the object starts.
+      lazy_keys: names of the members to decode lazily as well.
+    """
+    self._s = s
+    self._lazy_keys = lazy_keys
+    self._spans = {}
+    self._values = {}
+    idx = _w(s, idx).end()
+    if s[idx:idx + 1] != '{':
+      raise decoder.JSONDecodeError('Expecting object', s, idx)
+    self._start = idx
+    idx = _w(s, idx + 1).end()
+    if s[idx:idx + 1] == '}':
+      self._end = idx + 1
+      return
+    while True:
+      if s[idx:idx + 1] != '"':
+        raise decoder.JSONDecodeError('Expecting property name', s, idx)
+      key, idx = decoder.scanstring(s, idx + 1, 'utf-8', True)
+      idx = _w(s, idx).end()
+      if s[idx:idx + 1] != ':':
+        raise decoder.JSONDecodeError('Expecting : delimiter', s, idx)
+      idx = _w(s, idx + 1).end()
+      end = skip_value(s, idx)
+      self._spans[key] = (idx, end)
+      idx = _w(s, end).end()
+      nextchar = s[idx:idx + 1]
+      idx += 1
+      if nextchar == '}':
+        break
+      if nextchar != ',':
+        raise decoder.JSONDecodeError('Expecting , delimiter', s, idx - 1)
+      idx = _w(s, idx).end()
+    self._end = idx
+
+  @property
+  def end(self):
+    """Index in the document just past this object."""
+    return self._end
+
+  def __getitem__(self, key):
+    try:
+      return self._values[key]
+    except KeyError:
+      pass
+    start, end = self._spans[key]
+    if key in self._lazy_keys and self._s[start] == '{':
+      value = LazyObject(self._s, start)
+    else:
+      value = _raw_decode(self._s, start)[0]
+    self._values[key] = value
+    return value
+
+  def __contains__(self, key):
+    return key in self._spans
+
+  def __iter__(self):
+    return self._spans.__iter__()
+
+  def __len__(self):
+    return len(self._spans)
+
+  def get(self, key, default_value=None):
+    if key in self._spans:
+      return self[key]
+    return default_value
+
+  def keys(self):
+    return self._spans.keys()
+
+  def items(self):
+    return [(key, self[key]) for key in self._spans]
+
+  def raw(self, key):
+    """Returns the undecoded json text of a member."""
+    start, end = self._spans[key]
+    return self._s[start:end]
+
+  def splice(self, key, json_value):
+    """Returns the json text of this object with a member replaced.
+
+    Args:
+      key: name of an existing member.
+      json_value: the json encoded value to put in its place.
+    """
+    start, end = self._spans[key]
+    return (self._s[self._start:start] + json_value +
+            self._s[end:self._end])
+
+  def decode(self):
+    """Decodes the whole object into a dictionary."""
+    return _raw_decode(self._s, self._start)[0]
@@ -0,0 +1,80 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the lazyjson module."""
+
+
+import unittest
+
+import lazyjson
+import simplejson
+
+BUNDLE_JSON = ('{"blips": {"b+1": {"content": "a \\"quoted\\" {brace]",'
+               '                    "elements": {}},'
+               '           "b+2": {"content": "\\u05e9", "annotations": []}},'
+               ' "events" : [{"type": "BLIP_SUBMITTED", "timestamp": 12}],'
+               ' "proxyingFor": "{\\"port\\":8080}",'
+               ' "robotAddress": null, "version": 3.5, "empty": {}}')
+
+
+class TestLazyObject(unittest.TestCase):
+
+  def testMatchesFullDecode(self):
+    expected = simplejson.loads(BUNDLE_JSON)
+    parsed = lazyjson.LazyObject(BUNDLE_JSON)
+    self.assertEquals(len(expected), len(parsed))
+    self.assertEquals(sorted(expected.keys()), sorted(parsed.keys()))
+    for key, value in expected.items():
+      self.assertEquals(value, parsed[key])
+    self.assertEquals(expected, parsed.decode())
+
+  def testUtf8Bytes(self):
+    parsed = lazyjson.LazyObject(u'{"content": "\u05e9"}'.encode('utf-8'))
+    self.assertEquals(u'\u05e9', parsed['content'])
+
+  def testLazyKeys(self):
+    parsed = lazyjson.LazyObject(BUNDLE_JSON, lazy_keys=('blips',))
+    blips = parsed['blips']
+    self.assertTrue(isinstance(blips, lazyjson.LazyObject))
+    self.assertTrue(blips is parsed['blips'])
+    self.assertTrue('b+2' in blips)
+    self.assertEquals(u'\u05e9', blips['b+2']['content'])
+    self.assertEquals(None, blips.get('b+3'))
+    self.assertEquals({}, parsed['empty'])
+
+  def testRawAndSplice(self):
+    parsed = lazyjson.LazyObject('  ' + BUNDLE_JSON + '  ')
+    self.assertEquals('"{\\"port\\":8080}"', parsed.raw('proxyingFor'))
+    spliced = parsed.splice('events', '[]')
+    expected = simplejson.loads(BUNDLE_JSON)
+    expected['events'] = []
+    self.assertEquals(expected, simplejson.loads(spliced))
+
+  def testSkipValue(self):
+    for value in ['"a\\\\"', '[1, [2, "]"], {}]', '{"a": {"b": "}"}}',
+                  'true', '-1.5e3', 'null']:
+      doc = value + ', 42'
+      self.assertEquals(len(value), lazyjson.skip_value(doc, 0))
+
+  def testErrors(self):
+    self.assertRaises(ValueError, lazyjson.LazyObject, '[1, 2]')
+    self.assertRaises(ValueError, lazyjson.LazyObject, '{"a": [1, 2}')
+    self.assertRaises(ValueError, lazyjson.LazyObject, '{"a": 1 "b": 2}')
+    self.assertRaises(ValueError, lazyjson.LazyObject, '{"a": "b')
+
+
+if __name__ == '__main__':
+  unittest.main()
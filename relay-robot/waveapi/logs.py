@@ -0,0 +1,165 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Loggers of the parts of the library.
+
+Every part logs to a logger of its own below 'waveapi', for instance
+'waveapi.events' for the event bundles coming in and the operations
+going out, so their levels can be set one by one. Levels are read from
+the WAVEAPI_LOG environment variable when the module is loaded, or can
+be set with configure:
+
+  WAVEAPI_LOG=warning,events=info,ops=debug
+
+Payloads such as event bundles are passed to the logger wrapped in a
+Payload. It is only turned into a string if the message is emitted, and
+is cut off after MAX_PAYLOAD_LENGTH characters. Lists and dictionaries
+are only formatted up to that point.
+"""
+
+import logging
+import os
+
+ROOT = 'waveapi'
+
+# Characters of a payload that are logged; 0 logs payloads in full.
+MAX_PAYLOAD_LENGTH = 2048
+
+ENVIRONMENT_VARIABLE = 'WAVEAPI_LOG'
+
+
+def get(part):
+  """Returns the logger of a part of the library."""
+  return logging.getLogger('%s.%s' % (ROOT, part))
+
+
+class _Truncated(Exception):
+  """Raised once a _BoundedWriter has been given enough text."""
+
+
+class _BoundedWriter(object):
+  """Formats values like str does, stopping after limit characters."""
+
+  def __init__(self, limit):
+    self.parts = []
+    self._left = limit
+
+  def write(self, text):
+    self.parts.append(text)
+    self._left -= len(text)
+    if self._left < 0:
+      raise _Truncated()
+
+  def format(self, value):
+    """Writes the repr of value, raising _Truncated when the limit is hit."""
+    if isinstance(value, dict):
+      self.write('{')
+      separator = ''
+      for key, item in value.iteritems():
+        self.write(separator)
+        self.format(key)
+        self.write(': ')
+        self.format(item)
+        separator = ', '
+      self.write('}')
+    elif isinstance(value, (list, tuple)):
+      if isinstance(value, list):
+        self.write('[')
+      else:
+        self.write('(')
+      separator = ''
+      for item in value:
+        self.write(separator)
+        self.format(item)
+        separator = ', '
+      if isinstance(value, list):
+        self.write(']')
+      elif len(value) == 1:
+        self.write(',)')
+      else:
+        self.write(')')
+    elif isinstance(value, basestring):
+      # Only what can still be shown is escaped.
+      self.write(repr(value[:self._left + 1]))
+    else:
+      self.write(repr(value))
+
+
+class Payload(object):
+  """Defers converting a possibly large value to a string until logged."""
+
+  def __init__(self, value, limit=None):
+    """Initializes the payload.
+
+    Args:
+      value: the value to log.
+      limit: characters to log, by default MAX_PAYLOAD_LENGTH.
+    """
+    self._value = value
+    self._limit = limit
+
+  def __str__(self):
+    value = self._value
+    limit = self._limit
+    if limit is None:
+      limit = MAX_PAYLOAD_LENGTH
+    if limit and isinstance(value, (dict, list, tuple)):
+      writer = _BoundedWriter(limit)
+      try:
+        writer.format(value)
+      except _Truncated:
+        return '%s... (truncated)' % ''.join(writer.parts)[:limit]
+      return ''.join(writer.parts)
+    if not isinstance(value, basestring):
+      value = str(value)
+    if limit and len(value) > limit:
+      value = '%s... (%d more characters)' % (value[:limit],
+                                              len(value) - limit)
+    if isinstance(value, unicode):
+      value = value.encode('utf-8')
+    return value
+
+
+def configure(spec):
+  """Sets the levels of the loggers from a spec like the environment variable.
+
+  Args:
+    spec: comma separated items that are either part=level to set the
+        level of one part, or a level for all of the library.
+
+  Raises:
+    ValueError: if a level is not known.
+  """
+  for item in spec.split(','):
+    item = item.strip()
+    if not item:
+      continue
+    if '=' in item:
+      part, level_name = [s.strip() for s in item.split('=', 1)]
+      logger = get(part)
+    else:
+      level_name = item
+      logger = logging.getLogger(ROOT)
+    level = logging.getLevelName(level_name.upper())
+    if not isinstance(level, int):
+      raise ValueError('Unknown log level: %s' % level_name)
+    logger.setLevel(level)
+
+
+try:
+  configure(os.environ.get(ENVIRONMENT_VARIABLE, ''))
+except ValueError, e:
+  logging.warning('Ignoring %s: %s', ENVIRONMENT_VARIABLE, e)
@@ -0,0 +1,102 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the logs module."""
+
+
+import logging
+import unittest
+
+import logs
+
+
+class CountingValue(object):
+  """Value counting how often it is converted to a string."""
+
+  def __init__(self):
+    self.conversions = 0
+
+  def __str__(self):
+    self.conversions += 1
+    return 'x' * 100
+
+
+class RecordingHandler(logging.Handler):
+
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.messages = []
+
+  def emit(self, record):
+    self.messages.append(record.getMessage())
+
+
+class TestLogs(unittest.TestCase):
+
+  def setUp(self):
+    self.logger = logs.get('test')
+    self.handler = RecordingHandler()
+    self.logger.addHandler(self.handler)
+    self.logger.propagate = False
+
+  def tearDown(self):
+    self.logger.removeHandler(self.handler)
+    self.logger.propagate = True
+    self.logger.setLevel(logging.NOTSET)
+    logging.getLogger(logs.ROOT).setLevel(logging.NOTSET)
+
+  def testPayloadOnlyFormattedWhenEmitted(self):
+    value = CountingValue()
+    self.logger.setLevel(logging.WARNING)
+    self.logger.info('payload: %s', logs.Payload(value))
+    self.assertEquals(0, value.conversions)
+    self.assertEquals([], self.handler.messages)
+    self.logger.setLevel(logging.INFO)
+    self.logger.info('payload: %s', logs.Payload(value, limit=10))
+    self.assertEquals(1, value.conversions)
+    self.assertEquals(['payload: xxxxxxxxxx... (90 more characters)'],
+                      self.handler.messages)
+
+  def testPayloadLimit(self):
+    self.assertEquals('abc', str(logs.Payload('abc', limit=3)))
+    self.assertEquals('ab... (1 more characters)',
+                      str(logs.Payload('abc', limit=2)))
+    self.assertEquals('abc', str(logs.Payload('abc', limit=0)))
+    self.assertEquals('\xd7\xa9', str(logs.Payload(u'\u05e9')))
+
+  def testContainersFormattedOnlyUpToLimit(self):
+    value = {'ops': [{'id': 'op1', 'values': (u'x', 2)}], 'n': None}
+    self.assertEquals(str(value), str(logs.Payload(value)))
+    self.assertEquals(str((1,)), str(logs.Payload((1,))))
+    self.assertEquals(str(value), str(logs.Payload(value, limit=0)))
+    counting = CountingValue()
+    large = ['a' * 100] * 1000 + [counting]
+    self.assertEquals("['aaaaaaaa... (truncated)",
+                      str(logs.Payload(large, limit=10)))
+    self.assertEquals(0, counting.conversions)
+
+  def testConfigure(self):
+    logs.configure('warning, test=debug')
+    self.assertEquals(logging.WARNING,
+                      logging.getLogger(logs.ROOT).level)
+    self.assertEquals(logging.DEBUG, self.logger.level)
+    self.assertTrue(logs.get('ops').isEnabledFor(logging.WARNING))
+    self.assertFalse(logs.get('ops').isEnabledFor(logging.INFO))
+    self.assertRaises(ValueError, logs.configure, 'test=loud')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,11 +21,15 @@ applied on the server.
 """
 
 import errors
-import logging
+import itertools
+import logs
+import os
 import util
 
 PROTOCOL_VERSION = '0.2'
 
+_log = logs.get('ops')
+
 # Operation Types
 WAVELET_APPEND_BLIP = 'wavelet.appendBlip'
 WAVELET_CREATE = 'wavelet.create'
@@ -174,6 +178,99 @@ class WaveletData(dict):
     self['participants'] = participants
 
 
+def _temp_id(number):
+  """Returns a temporary id that differs between the processes of a server.
+
+  Worker processes forked from one parent start out with the same
+  counters, so the process id is made part of the id where it is known.
+  """
+  getpid = getattr(os, 'getpid', None)
+  if getpid is None:
+    return str(number)
+  return '%s.%s' % (getpid(), number)
+
+
+# Operations of which only the last one for the same target has effect.
+_OVERWRITING_OPERATIONS = {
+    WAVELET_SET_TITLE: (),
+    WAVELET_DATADOC_SET: ('datadocName',),
+}
+
+
+def _overwrite_key(operation):
+  """Returns what an overwriting operation sets, or None for other ones."""
+  key_params = _OVERWRITING_OPERATIONS.get(operation.method)
+  if key_params is None:
+    return None
+  params = operation.params
+  return ((operation.method, params.get('waveId'), params.get('waveletId'),
+           params.get('proxyingFor')) +
+          tuple([params.get(name) for name in key_params]))
+
+
+def _blip_key(operation):
+  """Returns the blip an operation works on, or None."""
+  params = operation.params
+  if not 'blipId' in params:
+    return None
+  return params.get('waveId'), params.get('waveletId'), params['blipId']
+
+
+def _modify_target(operation):
+  """Returns the parameters of a document modify apart from its action."""
+  target = operation.params.copy()
+  del target['modifyAction']
+  return target
+
+
+def _appended_text(operation):
+  """Returns the text a plain append to a whole document adds, or None."""
+  params = operation.params
+  if operation.method == DOCUMENT_APPEND:
+    return params.get('content')
+  if (operation.method != DOCUMENT_MODIFY or 'range' in params or
+      'modifyQuery' in params):
+    return None
+  action = params['modifyAction']
+  values = action.get('values')
+  if (action['modifyHow'] != 'INSERT_AFTER' or 'elements' in action or
+      not values or len(values) != 1 or
+      not isinstance(values[0], basestring)):
+    return None
+  return values[0]
+
+
+def _merge_appends(first, second):
+  """Returns an operation doing both appends, or None if there is none."""
+  if (first.method != second.method or
+      first.params.get('proxyingFor') != second.params.get('proxyingFor')):
+    return None
+  first_text = _appended_text(first)
+  second_text = _appended_text(second)
+  if first_text is None or second_text is None:
+    return None
+  params = first.params.copy()
+  if first.method == DOCUMENT_APPEND:
+    params['content'] = first_text + second_text
+  else:
+    params['modifyAction'] = first.params['modifyAction'].copy()
+    params['modifyAction']['values'] = [first_text + second_text]
+  return Operation(first.method, first.id, params)
+
+
+def _cleared_by(first, second):
+  """Returns whether second clears exactly the annotation first sets."""
+  if first.method != DOCUMENT_MODIFY or second.method != DOCUMENT_MODIFY:
+    return False
+  first_action = first.params['modifyAction']
+  second_action = second.params['modifyAction']
+  return (first_action['modifyHow'] == 'ANNOTATE' and
+          second_action['modifyHow'] == 'CLEAR_ANNOTATION' and
+          first_action.get('annotationKey') ==
+          second_action.get('annotationKey') and
+          _modify_target(first) == _modify_target(second))
+
+
 class OperationQueue(object):
   """Wraps the queuing of operations using easily callable functions.
 
@@ -190,18 +287,20 @@ class OperationQueue(object):
   server.
   """
 
-  # Some class global counters:
-  __nextBlipId = 1
-  __nextWaveId = 1
-  __nextOperationId = 1
+  # Process wide counters. Calling next() on an itertools.count is a
+  # single step for the interpreter, so threads can share them without
+  # a lock.
+  __nextBlipId = itertools.count(1).next
+  __nextWaveId = itertools.count(1).next
+  __nextOperationId = itertools.count(1).next
 
   def __init__(self):
     self.clear()
 
   def __CreateNewBlipData(self, wave_id, wavelet_id, initial_content=''):
     """Creates JSON of the blip used for this session."""
-    temp_blip_id = 'TBD_%s_%s' % (wavelet_id, OperationQueue.__nextBlipId)
-    OperationQueue.__nextBlipId += 1
+    temp_blip_id = 'TBD_%s_%s' % (wavelet_id,
+                                  _temp_id(OperationQueue.__nextBlipId()))
     return BlipData(wave_id, wavelet_id, temp_blip_id, initial_content)
 
   def CreateNewWaveletData(self, domain, participants):
@@ -212,8 +311,7 @@ class OperationQueue(object):
       participants initially on the wavelet
     Returns:
       Blipdata (for the rootblip), WaveletData."""
-    wave_id = domain + '!TBD_%s' % OperationQueue.__nextWaveId
-    OperationQueue.__nextWaveId += 1
+    wave_id = domain + '!TBD_%s' % _temp_id(OperationQueue.__nextWaveId())
     wavelet_id = domain + '!conv+root'
     root_blip_data = self.__CreateNewBlipData(wave_id, wavelet_id)
     participants = set(participants)
@@ -254,9 +352,58 @@ class OperationQueue(object):
                       {'capabilitiesHash': self._capability_hash})
     operations = [first] + self.__pending
     res = util.serialize(operations)
-    logging.info('>>>>>' + str(res))
+    _log.debug('>>>>>%s', logs.Payload(res))
     return res
 
+  def compact(self):
+    """Removes operations that do not change the outcome of the queue.
+
+    The following is removed:
+      - operations that occur more than once, as happens when a wavelet
+        is submitted with one whose operations it already has.
+      - title and data document settings overwritten later on.
+      - annotations cleared by the next operation on the same blip.
+    Appends to the same blip with no other operation on that blip in
+    between are merged into one.
+
+    Returns:
+      The number of operations removed.
+    """
+    count = len(self.__pending)
+    operations = []
+    seen = set()
+    for op in self.__pending:
+      if not op.id in seen:
+        seen.add(op.id)
+        operations.append(op)
+    last_set = {}
+    for index, op in enumerate(operations):
+      key = _overwrite_key(op)
+      if key is not None:
+        last_set[key] = index
+    res = []
+    # Index in res of the last operation on a blip.
+    last_on_blip = {}
+    for index, op in enumerate(operations):
+      key = _overwrite_key(op)
+      if key is not None and last_set[key] != index:
+        continue
+      blip_key = _blip_key(op)
+      previous = last_on_blip.get(blip_key)
+      if previous is not None and res[previous] is not None:
+        merged = _merge_appends(res[previous], op)
+        if merged is not None:
+          res[previous] = merged
+          continue
+        if _cleared_by(res[previous], op):
+          res[previous] = None
+      res.append(op)
+      if blip_key is not None:
+        last_on_blip[blip_key] = len(res) - 1
+    # Changed in place, the list may be shared with proxy_for views.
+    self.__pending[:] = [op for op in res if op is not None]
+    return count - len(self.__pending)
+
   def copy_operations(self, other_queue):
     """Copy the pending operations from other_queue into this one."""
     for op in other_queue:
@@ -272,10 +419,9 @@ class OperationQueue(object):
     if self._proxy_for_id:
       props['proxyingFor'] = self._proxy_for_id
     operation = Operation(method,
-                          'op%s' % OperationQueue.__nextOperationId,
+                          'op%s' % OperationQueue.__nextOperationId(),
                           props)
     self.__pending.append(operation)
-    OperationQueue.__nextOperationId += 1
     return operation
 
   def WaveletAppendBlip(self, wave_id, wavelet_id, initial_content=''):
@@ -17,6 +17,7 @@
 """Unit tests for the ops module."""
 
 
+import threading
 import unittest
 
 import ops
@@ -34,5 +35,88 @@ class TestOperation(unittest.TestCase):
     self.assertEquals(2, len(op.params))
 
 
+
+class TestOperationQueue(unittest.TestCase):
+  """Test case for OperationQueue class."""
+
+  def setUp(self):
+    self.queue = ops.OperationQueue()
+
+  def append(self, blip_id, text):
+    op = self.queue.DocumentModify('wave', 'wavelet', blip_id)
+    op.set_param('modifyAction', {'modifyHow': 'INSERT_AFTER',
+                                  'values': [text]})
+    return op
+
+  def annotate(self, modify_how, start, end):
+    op = self.queue.DocumentModify('wave', 'wavelet', 'b+1')
+    op.set_param('range', {'start': start, 'end': end})
+    op.set_param('modifyAction', {'modifyHow': modify_how,
+                                  'annotationKey': 'we/eval',
+                                  'values': ['x']})
+
+  def testCompact(self):
+    self.queue.WaveletSetTitle('wave', 'wavelet', 'first')
+    self.append('b+1', 'hello ')
+    self.queue.DocumentAppend('wave', 'wavelet', 'b+2', 'a')
+    self.append('b+1', 'world')
+    self.queue.DocumentAppend('wave', 'wavelet', 'b+2', 'b')
+    self.queue.WaveletSetDataDoc('wave', 'wavelet', 'doc', '1')
+    self.queue.WaveletSetTitle('wave', 'wavelet', 'second')
+    self.queue.WaveletSetDataDoc('wave', 'wavelet', 'doc', '2')
+    self.annotate('ANNOTATE', 0, 5)
+    self.annotate('CLEAR_ANNOTATION', 0, 5)
+    self.assertEquals(5, self.queue.compact())
+    operations = list(self.queue)
+    self.assertEquals([ops.DOCUMENT_MODIFY, ops.DOCUMENT_APPEND,
+                       ops.WAVELET_SET_TITLE, ops.WAVELET_DATADOC_SET,
+                       ops.DOCUMENT_MODIFY],
+                      [op.method for op in operations])
+    self.assertEquals(['hello world'],
+                      operations[0].params['modifyAction']['values'])
+    self.assertEquals('ab', operations[1].params['content'])
+    self.assertEquals('second', operations[2].params['waveletTitle'])
+    self.assertEquals('2', operations[3].params['datadocValue'])
+    self.assertEquals('CLEAR_ANNOTATION',
+                      operations[4].params['modifyAction']['modifyHow'])
+    self.assertEquals(0, self.queue.compact())
+
+  def testCompactKeepsOrderOnSameBlip(self):
+    self.append('b+1', 'hello')
+    self.annotate('ANNOTATE', 0, 5)
+    self.append('b+1', 'world')
+    self.annotate('CLEAR_ANNOTATION', 0, 3)
+    self.assertEquals(0, self.queue.compact())
+    self.assertEquals(4, len(self.queue))
+
+  def testIdsAreUniqueAcrossThreads(self):
+    queues = [ops.OperationQueue() for i in range(4)]
+
+    def fill(queue):
+      for i in range(200):
+        queue.DocumentAppend('wave', 'wavelet', 'b+1', 'text')
+        queue.BlipCreateChild('wave', 'wavelet', 'b+1')
+
+    threads = [threading.Thread(target=fill, args=(queue,))
+               for queue in queues]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    operations = [op for queue in queues for op in queue]
+    self.assertEquals(1600, len(set([op.id for op in operations])))
+    blip_ids = [op.params['blipData']['blipId'] for op in operations
+                if op.method == ops.BLIP_CREATE_CHILD]
+    self.assertEquals(800, len(set(blip_ids)))
+    self.assertTrue(blip_ids[0].startswith('TBD_wavelet_'))
+
+  def testCompactRemovesDuplicates(self):
+    other = ops.OperationQueue()
+    other.DocumentAppend('wave', 'wavelet', 'b+1', 'text')
+    self.queue.copy_operations(other)
+    self.queue.copy_operations(other)
+    self.assertEquals(1, self.queue.compact())
+    self.assertEquals('text', list(self.queue)[0].params['content'])
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,451 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Indexes of things living at positions in a blip.
+
+Ranges are kept in a treap ordered on their start. Moving everything
+after a position, as happens on every edit of the document, only marks
+the subtree involved with an offset that is pushed down when the nodes
+below it are visited, so it costs O(log n) rather than touching every
+range.
+"""
+
+import random
+
+
+class _Node(object):
+  """Treap node for the range [start, end) holding value.
+
+  delta is an offset that still has to be added to this node and to
+  everything below it.
+  """
+
+  def __init__(self, start, end, value):
+    self.start = start
+    self.end = end
+    self.value = value
+    self.priority = random.random()
+    self.left = None
+    self.right = None
+    self.delta = 0
+
+
+def _push(node):
+  """Applies the pending offset of node and hands it to its children."""
+  delta = node.delta
+  if delta:
+    node.start += delta
+    node.end += delta
+    if node.left is not None:
+      node.left.delta += delta
+    if node.right is not None:
+      node.right.delta += delta
+    node.delta = 0
+
+
+def _merge(left, right):
+  """Joins two trees where all of left starts before all of right."""
+  if left is None:
+    return right
+  if right is None:
+    return left
+  if left.priority > right.priority:
+    _push(left)
+    left.right = _merge(left.right, right)
+    return left
+  _push(right)
+  right.left = _merge(left, right.left)
+  return right
+
+
+def _split(node, start, inclusive=False):
+  """Splits a tree in the nodes starting before start and the others.
+
+  With inclusive set, nodes starting at start go to the first part.
+  """
+  if node is None:
+    return None, None
+  _push(node)
+  if node.start < start or (inclusive and node.start == start):
+    left, right = _split(node.right, start, inclusive)
+    node.right = left
+    return node, right
+  left, right = _split(node.left, start, inclusive)
+  node.left = right
+  return left, node
+
+
+def _first(node):
+  """Returns the first node of a tree with its offsets applied."""
+  _push(node)
+  while node.left is not None:
+    node = node.left
+    _push(node)
+  return node
+
+
+def _last(node):
+  """Returns the last node of a tree with its offsets applied."""
+  _push(node)
+  while node.right is not None:
+    node = node.right
+    _push(node)
+  return node
+
+
+def _nodes(node):
+  """Yields the nodes of a tree in order, applying their offsets."""
+  stack = []
+  while node is not None or stack:
+    if node is not None:
+      _push(node)
+      stack.append(node)
+      node = node.left
+    else:
+      node = stack.pop()
+      yield node
+      node = node.right
+
+
+def _pop_first(node):
+  """Returns a tuple of the tree without its first node and that node."""
+  first = _first(node)
+  first_node, rest = _split(node, first.start, inclusive=True)
+  return rest, first_node
+
+
+def _pop_last(node):
+  """Returns a tuple of the tree without its last node and that node."""
+  last = _last(node)
+  rest, last_node = _split(node, last.start)
+  return rest, last_node
+
+
+def _find(node, position):
+  """Returns the node starting at position or None."""
+  while node is not None:
+    _push(node)
+    if node.start == position:
+      return node
+    if position < node.start:
+      node = node.left
+    else:
+      node = node.right
+  return None
+
+
+def _cut(node, start, end):
+  """Returns a tuple of the trees before start, from start to end and after."""
+  left, rest = _split(node, start)
+  middle, right = _split(rest, end)
+  return left, middle, right
+
+
+def _shift(node, where, inc):
+  """Moves the nodes of a tree starting at where or after it by inc."""
+  left, right = _split(node, where)
+  if right is not None:
+    right.delta += inc
+  return _merge(left, right)
+
+
+class IntervalIndex(object):
+  """Sorted, non overlapping ranges that each carry a value.
+
+  This is how the annotations of a single name are kept. Ranges next to
+  each other may touch, but never overlap.
+  """
+
+  def __init__(self):
+    self._root = None
+    self._count = 0
+
+  def __len__(self):
+    return self._count
+
+  def __iter__(self):
+    """Iterates (start, end, value) tuples ordered on start."""
+    for node in _nodes(self._root):
+      yield node.start, node.end, node.value
+
+  def _insert(self, left, node, right):
+    self._root = _merge(_merge(left, node), right)
+
+  def add(self, start, end, value):
+    """Puts value on the range [start, end).
+
+    Touching or overlapping ranges with the same value are merged into
+    the new range; ranges with a different value are cut back to the
+    part outside of it.
+    """
+    left, rest = _split(self._root, start)
+    touching, right = _split(rest, end, inclusive=True)
+    before = []
+    after = []
+    while True:
+      if touching is not None:
+        touching, existing = _pop_first(touching)
+      elif left is not None and _last(left).end >= start:
+        left, existing = _pop_last(left)
+      elif right is not None and _first(right).start <= end:
+        right, existing = _pop_first(right)
+      else:
+        break
+      self._count -= 1
+      if existing.value == value:
+        start = min(existing.start, start)
+        end = max(existing.end, end)
+        continue
+      if existing.start < start:
+        before.append(_Node(existing.start, start, existing.value))
+      if existing.end > end:
+        after.append(_Node(end, existing.end, existing.value))
+    before.sort(key=lambda n: n.start)
+    after.sort(key=lambda n: n.start)
+    for node in before:
+      left = _merge(left, node)
+    for node in reversed(after):
+      right = _merge(node, right)
+    self._count += len(before) + len(after) + 1
+    self._insert(left, _Node(start, end, value), right)
+
+  def delete(self, start, end):
+    """Removes the range [start, end), cutting back what overlaps it."""
+    left, rest = _split(self._root, start)
+    touching, right = _split(rest, end, inclusive=True)
+    if left is not None and _last(left).end >= start:
+      left, existing = _pop_last(left)
+      touching = _merge(existing, touching)
+    for existing in list(_nodes(touching)):
+      self._count -= 1
+      if existing.start < start:
+        self._count += 1
+        left = _merge(left, _Node(existing.start, start, existing.value))
+      if existing.end > end:
+        self._count += 1
+        right = _merge(_Node(end, existing.end, existing.value), right)
+    self._root = _merge(left, right)
+
+  def overlapping(self, start, end):
+    """Returns (start, end, value) tuples of the ranges overlapping a range."""
+    left, middle, right = _cut(self._root, start, end)
+    res = []
+    if left is not None:
+      last = _last(left)
+      if last.end > start:
+        res.append((last.start, last.end, last.value))
+    res.extend([(node.start, node.end, node.value)
+                for node in _nodes(middle)])
+    self._root = _merge(_merge(left, middle), right)
+    return res
+
+  def shift(self, where, inc):
+    """Moves the range boundaries after where by inc.
+
+    For a negative inc the text from where + inc up to where is gone, so
+    boundaries inside it are moved to where + inc. Ranges that end up
+    empty are dropped.
+    """
+    if not inc:
+      return
+    left, right = _split(self._root, where, inclusive=True)
+    if right is not None:
+      right.delta += inc
+    if inc < 0:
+      left, gone = _split(left, where + inc, inclusive=True)
+      if gone is not None:
+        gone, last = _pop_last(gone)
+        self._count -= len(list(_nodes(gone)))
+        if last.end > where:
+          last.start = where + inc
+          last.end += inc
+          right = _merge(last, right)
+        else:
+          self._count -= 1
+    if left is not None:
+      last = _last(left)
+      if last.end > where:
+        last.end += inc
+      elif last.end > where + inc:
+        last.end = where + inc
+      if last.end <= last.start:
+        left, last = _pop_last(left)
+        self._count -= 1
+    self._root = _merge(left, right)
+
+
+# Number of shifts remembered for groups that have not caught up yet.
+MAX_SHIFT_LOG = 256
+
+
+class _Group(object):
+  """Tree of the nodes in one group of a PositionIndex.
+
+  synced is the number of shifts of the index this tree has seen.
+  """
+
+  def __init__(self, synced):
+    self.root = None
+    self.synced = synced
+
+
+class PositionIndex(object):
+  """Dictionary like index from position to value, ordered on position.
+
+  If groups_of is given, it is called for every value that is stored and
+  should return the hashable keys of the groups the value belongs to.
+  in_group then lists the values of a group without looking at the
+  others. Each group is a tree of its own. Shifts are not applied to a
+  group right away but logged, and replayed on the group the next time
+  it is used.
+  """
+
+  def __init__(self, groups_of=None):
+    self._root = None
+    self._count = 0
+    self._groups_of = groups_of
+    self._groups = {}
+    self._values_changed = False
+    self._shifts = []
+    # Number of shifts that were dropped from the log.
+    self._shifts_base = 0
+
+  def __len__(self):
+    return self._count
+
+  def __contains__(self, position):
+    return _find(self._root, position) is not None
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __getitem__(self, position):
+    node = _find(self._root, position)
+    if node is None:
+      raise KeyError(position)
+    return node.value
+
+  def get(self, position, default_value=None):
+    node = _find(self._root, position)
+    if node is None:
+      return default_value
+    return node.value
+
+  def __setitem__(self, position, value):
+    if position in self:
+      del self[position]
+    node = _Node(position, position + 1, value)
+    left, right = _split(self._root, position)
+    self._root = _merge(_merge(left, node), right)
+    self._count += 1
+    if self._groups_of is None:
+      node.groups = ()
+      return
+    node.groups = tuple(self._groups_of(value))
+    for key in node.groups:
+      group = self._group(key)
+      if group is None:
+        group = self._groups[key] = _Group(
+            self._shifts_base + len(self._shifts))
+      left, right = _split(group.root, position)
+      group.root = _merge(_merge(left, _Node(position, position + 1, value)),
+                          right)
+
+  def __delitem__(self, position):
+    if not self.delete_range(position, position + 1):
+      raise KeyError(position)
+
+  def keys(self):
+    return [node.start for node in _nodes(self._root)]
+
+  def values(self):
+    return [node.value for node in _nodes(self._root)]
+
+  def items(self):
+    """Returns the (position, value) tuples ordered on position."""
+    return [(node.start, node.value) for node in _nodes(self._root)]
+
+  def _group(self, key):
+    """Returns the group with key brought up to date, or None."""
+    group = self._groups.get(key)
+    if group is None:
+      return None
+    for where, inc in self._shifts[group.synced - self._shifts_base:]:
+      group.root = _shift(group.root, where, inc)
+    group.synced = self._shifts_base + len(self._shifts)
+    return group
+
+  def in_group(self, key):
+    """Returns the (position, value) tuples of a group ordered on position."""
+    if self._values_changed:
+      self._values_changed = False
+      for node in list(_nodes(self._root)):
+        if tuple(self._groups_of(node.value)) != node.groups:
+          self.regroup(node.start)
+    group = self._group(key)
+    if group is None:
+      return []
+    return [(node.start, node.value) for node in _nodes(group.root)]
+
+  def regroup(self, position):
+    """Updates the groups of the value at position after it changed."""
+    self[position] = self[position]
+
+  def values_changed(self):
+    """Notes that some values changed in a way that may move their groups.
+
+    The groups are brought up to date before in_group answers next.
+    """
+    self._values_changed = True
+
+  def delete_range(self, start, end):
+    """Removes the values from start up to end and returns them."""
+    left, middle, right = _cut(self._root, start, end)
+    self._root = _merge(left, right)
+    removed = list(_nodes(middle))
+    self._count -= len(removed)
+    keys = set()
+    for node in removed:
+      keys.update(node.groups)
+    for key in keys:
+      group = self._group(key)
+      left, middle, right = _cut(group.root, start, end)
+      group.root = _merge(left, right)
+      if group.root is None:
+        del self._groups[key]
+    return [node.value for node in removed]
+
+  def shift(self, where, inc):
+    """Moves the values at where or after it by inc.
+
+    For a negative inc, whatever sits from where + inc up to where is
+    removed first.
+    """
+    if not inc:
+      return
+    if inc < 0:
+      self.delete_range(where + inc, where)
+    self._root = _shift(self._root, where, inc)
+    if not self._groups:
+      self._shifts_base += len(self._shifts) + 1
+      self._shifts = []
+      return
+    self._shifts.append((where, inc))
+    if len(self._shifts) > MAX_SHIFT_LOG:
+      for key in self._groups:
+        self._group(key)
+      self._shifts_base += len(self._shifts)
+      self._shifts = []
@@ -0,0 +1,217 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the positions module."""
+
+
+import random
+import unittest
+
+import positions
+
+
+def naive_add(ranges, start, end, value):
+  """Reference for IntervalIndex.add working on a list of tuples."""
+  ranges = list(ranges)
+  res = []
+  while True:
+    for existing in ranges:
+      if not (start > existing[1] or end < existing[0]):
+        break
+    else:
+      break
+    ranges.remove(existing)
+    s, e, v = existing
+    if v == value:
+      start = min(s, start)
+      end = max(e, end)
+    else:
+      if s < start:
+        res.append((s, start, v))
+      if e > end:
+        res.append((end, e, v))
+  return sorted(ranges + res + [(start, end, value)])
+
+
+def naive_delete(ranges, start, end):
+  res = []
+  for s, e, v in ranges:
+    if start > e or end < s:
+      res.append((s, e, v))
+      continue
+    if s < start:
+      res.append((s, start, v))
+    if e > end:
+      res.append((end, e, v))
+  return sorted(res)
+
+
+def naive_shift(ranges, where, inc):
+  def move(pos):
+    if pos > where:
+      return pos + inc
+    if pos > where + inc:
+      return where + inc
+    return pos
+  return sorted([(move(s), move(e), v) for s, e, v in ranges
+                 if move(e) > move(s)])
+
+
+class TestIntervalIndex(unittest.TestCase):
+
+  def testAddMergesAndChops(self):
+    index = positions.IntervalIndex()
+    index.add(3, 6, 'bold')
+    index.add(5, 8, 'bold')
+    self.assertEquals([(3, 8, 'bold')], list(index))
+    index.add(4, 12, 'italic')
+    self.assertEquals([(3, 4, 'bold'), (4, 12, 'italic')], list(index))
+    index.add(6, 7, 'bold')
+    self.assertEquals([(3, 4, 'bold'), (4, 6, 'italic'), (6, 7, 'bold'),
+                       (7, 12, 'italic')], list(index))
+    self.assertEquals(4, len(index))
+
+  def testDelete(self):
+    index = positions.IntervalIndex()
+    index.add(0, 10, 'x')
+    index.delete(3, 5)
+    self.assertEquals([(0, 3, 'x'), (5, 10, 'x')], list(index))
+    index.delete(0, 10)
+    self.assertEquals(0, len(index))
+
+  def testShift(self):
+    index = positions.IntervalIndex()
+    index.add(2, 4, 'x')
+    index.add(6, 9, 'y')
+    index.shift(3, 10)
+    self.assertEquals([(2, 14, 'x'), (16, 19, 'y')], list(index))
+    # Removing the text from 10 to 17 drops what was inside of it.
+    index.shift(17, -7)
+    self.assertEquals([(2, 10, 'x'), (10, 12, 'y')], list(index))
+
+  def testOverlapping(self):
+    index = positions.IntervalIndex()
+    index.add(0, 2, 'x')
+    index.add(4, 6, 'y')
+    index.add(8, 10, 'z')
+    self.assertEquals([(0, 2, 'x'), (4, 6, 'y')], index.overlapping(1, 5))
+    self.assertEquals([], index.overlapping(2, 4))
+
+  def testMatchesNaiveImplementation(self):
+    rand = random.Random(42)
+    for i in range(200):
+      index = positions.IntervalIndex()
+      ranges = []
+      for j in range(30):
+        start = rand.randint(0, 30)
+        end = start + rand.randint(1, 6)
+        action = rand.random()
+        if action < 0.5:
+          value = rand.choice('xyz')
+          index.add(start, end, value)
+          ranges = naive_add(ranges, start, end, value)
+        elif action < 0.7:
+          index.delete(start, end)
+          ranges = naive_delete(ranges, start, end)
+        else:
+          inc = max(rand.randint(-5, 5), -start)
+          index.shift(start, inc)
+          ranges = naive_shift(ranges, start, inc)
+        self.assertEquals(ranges, list(index))
+        self.assertEquals(len(ranges), len(index))
+
+
+
+class TestPositionIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.index = positions.PositionIndex(groups_of=lambda value: [value[0]])
+    for position, value in [(5, 'b1'), (1, 'a1'), (9, 'a2'), (3, 'b2')]:
+      self.index[position] = value
+
+  def testDictionaryInterface(self):
+    self.assertEquals(4, len(self.index))
+    self.assertEquals([1, 3, 5, 9], self.index.keys())
+    self.assertEquals([1, 3, 5, 9], list(self.index))
+    self.assertEquals(['a1', 'b2', 'b1', 'a2'], self.index.values())
+    self.assertEquals('b1', self.index[5])
+    self.assertTrue(3 in self.index)
+    self.assertFalse(4 in self.index)
+    self.assertEquals(None, self.index.get(4))
+    self.assertRaises(KeyError, self.index.__getitem__, 4)
+    self.index[5] = 'a3'
+    self.assertEquals([(1, 'a1'), (5, 'a3'), (9, 'a2')],
+                      self.index.in_group('a'))
+    self.assertEquals([(3, 'b2')], self.index.in_group('b'))
+    del self.index[1]
+    self.assertRaises(KeyError, self.index.__delitem__, 1)
+    self.assertEquals([(3, 'b2'), (5, 'a3'), (9, 'a2')], self.index.items())
+
+  def testShift(self):
+    self.index.shift(5, 2)
+    self.assertEquals([(1, 'a1'), (3, 'b2'), (7, 'b1'), (11, 'a2')],
+                      self.index.items())
+    self.assertEquals([(1, 'a1'), (11, 'a2')], self.index.in_group('a'))
+    # Moving back drops whatever was in the way.
+    self.index.shift(7, -4)
+    self.assertEquals([(1, 'a1'), (3, 'b1'), (7, 'a2')], self.index.items())
+    self.assertEquals([(3, 'b1')], self.index.in_group('b'))
+
+  def testDeleteRange(self):
+    self.assertEquals(['b2', 'b1'], self.index.delete_range(2, 9))
+    self.assertEquals([(1, 'a1'), (9, 'a2')], self.index.items())
+    self.assertEquals([], self.index.in_group('b'))
+    self.assertEquals(2, len(self.index))
+
+  def testRegroup(self):
+    values = {5: ['b', 'x']}
+    index = positions.PositionIndex(groups_of=lambda value: value)
+    index[5] = values[5]
+    values[5][1] = 'y'
+    index.regroup(5)
+    self.assertEquals([], index.in_group('x'))
+    self.assertEquals([(5, ['b', 'y'])], index.in_group('y'))
+
+  def testValuesChanged(self):
+    values = {2: ['a'], 5: ['b', 'x']}
+    index = positions.PositionIndex(groups_of=lambda value: value)
+    index[2] = values[2]
+    index[5] = values[5]
+    values[5][1] = 'y'
+    index.values_changed()
+    self.assertEquals([], index.in_group('x'))
+    self.assertEquals([(5, ['b', 'y'])], index.in_group('y'))
+    self.assertEquals([(2, ['a'])], index.in_group('a'))
+
+  def testGroupsCatchUpWithShifts(self):
+    rand = random.Random(42)
+    index = positions.PositionIndex(groups_of=lambda value: [value % 3])
+    for i in range(3 * positions.MAX_SHIFT_LOG):
+      action = rand.random()
+      position = rand.randint(0, 50)
+      if action < 0.4:
+        index[position] = rand.randint(0, 100)
+      elif action < 0.5:
+        index.delete_range(position, position + rand.randint(1, 5))
+      else:
+        index.shift(position, max(rand.randint(-3, 3), -position))
+      if action > 0.9:
+        key = rand.randint(0, 2)
+        self.assertEquals([item for item in index.items()
+                           if item[1] % 3 == key], index.in_group(key))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,370 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Transports used to forward event bundles to the relay server.
+
+The relay server does the actual event processing for TheWe. The robot
+hands every incoming bundle to a RelayTransport, which posts it to
+http://<host>/<port>/wave and returns the json encoded operations
+the relay answered with.
+"""
+
+import errno
+import httplib
+import socket
+import threading
+import urllib
+import urlparse
+
+import logs
+
+DEFAULT_RELAY_HOST = 'jem.thewe.net'
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 30
+
+_log = logs.get('relay')
+
+
+class ConnectionStats(object):
+  """Counters describing how a connection pool has been used."""
+
+  def __init__(self):
+    self.requests = 0
+    self.connections_opened = 0
+    self.connections_reused = 0
+    self.retries = 0
+    self.errors = 0
+
+  def serialize(self):
+    return {'requests': self.requests,
+            'connectionsOpened': self.connections_opened,
+            'connectionsReused': self.connections_reused,
+            'retries': self.retries,
+            'errors': self.errors}
+
+
+def _send_request(conn, method, path, body, headers):
+  """Sends a request whose body is a string or a list of strings.
+
+  httplib sends a body that is not a string after the headers, in a
+  write of its own, which Nagle's algorithm then holds back until the
+  headers are acknowledged. The first chunk therefore goes out together
+  with the headers.
+  """
+  if not isinstance(body, list):
+    conn.request(method, path, body, headers)
+    return
+  conn.putrequest(method, path)
+  for name, value in headers.items():
+    conn.putheader(name, value)
+  conn.endheaders(body[0])
+  for chunk in body[1:]:
+    conn.send(chunk)
+
+
+def _is_stale(error, sent):
+  """Returns whether error shows a kept alive connection had been closed.
+
+  Such a connection is reset while the request is sent, or is closed
+  without a status line. A timeout never counts, the server might just
+  be slow.
+  """
+  if isinstance(error, socket.timeout):
+    return False
+  if isinstance(error, httplib.BadStatusLine):
+    return True
+  return (not sent and isinstance(error, socket.error) and
+          error.args[:1] in ((errno.ECONNRESET,), (errno.EPIPE,)))
+
+
+class ConnectionPool(object):
+  """A bounded pool of keep-alive http connections to a single host.
+
+  Connections are handed out to one request at a time and put back
+  afterwards, so subsequent requests skip the connection setup. At
+  most pool_size idle connections are kept around; any surplus is
+  closed when it is released.
+  """
+
+  def __init__(self, host, pool_size=DEFAULT_POOL_SIZE,
+               timeout=DEFAULT_TIMEOUT,
+               connection_class=httplib.HTTPConnection):
+    """Initializes the pool.
+
+    Args:
+      host: host (optionally host:port) to connect to.
+      pool_size: maximum number of idle connections to keep open.
+      timeout: socket timeout in seconds for each connection.
+      connection_class: class used to open new connections. Should
+          behave like httplib.HTTPConnection.
+    """
+    self._host = host
+    self._pool_size = pool_size
+    self._timeout = timeout
+    self._connection_class = connection_class
+    self._idle = []
+    self._lock = threading.Lock()
+    self.stats = ConnectionStats()
+
+  @property
+  def host(self):
+    return self._host
+
+  def _count(self, counter):
+    self._lock.acquire()
+    try:
+      setattr(self.stats, counter, getattr(self.stats, counter) + 1)
+    finally:
+      self._lock.release()
+
+  def _open(self):
+    self._count('connections_opened')
+    return self._connection_class(self._host, timeout=self._timeout)
+
+  def _acquire(self):
+    """Returns a tuple of a connection and whether it was reused."""
+    self._lock.acquire()
+    try:
+      if self._idle:
+        self.stats.connections_reused += 1
+        return self._idle.pop(), True
+    finally:
+      self._lock.release()
+    return self._open(), False
+
+  def _release(self, conn):
+    self._lock.acquire()
+    try:
+      if len(self._idle) < self._pool_size:
+        self._idle.append(conn)
+        return
+    finally:
+      self._lock.release()
+    conn.close()
+
+  def request(self, method, path, body=None, headers=None):
+    """Executes an http request on a pooled connection.
+
+    A connection taken from the pool might have been closed by the
+    server in the meantime. If it fails before any part of the response
+    arrived, the request is retried once on a freshly opened connection.
+    Other failures, timeouts in particular, are not retried, as the
+    server may already have processed the request.
+
+    The body can be given as a list of strings, which are then sent one
+    after another without joining them. Empty strings are left out.
+
+    Returns:
+      response_code, returned_page
+    """
+    if headers is None:
+      headers = {}
+    if isinstance(body, list):
+      body = [chunk for chunk in body if chunk]
+      if len(body) < 2:
+        body = ''.join(body)
+      else:
+        headers = dict(headers)
+        headers['Content-Length'] = str(sum([len(chunk) for chunk in body]))
+    self._count('requests')
+    conn, reused = self._acquire()
+    while True:
+      sent = False
+      try:
+        _send_request(conn, method, path, body, headers)
+        sent = True
+        response = conn.getresponse()
+        content = response.read()
+      except (httplib.HTTPException, socket.error), e:
+        conn.close()
+        if reused and _is_stale(e, sent):
+          self._count('retries')
+          conn, reused = self._open(), False
+          continue
+        self._count('errors')
+        raise IOError('Connection to %s failed: %s' % (self._host, e))
+      if response.will_close:
+        conn.close()
+      else:
+        self._release(conn)
+      return response.status, content
+
+  def close(self):
+    """Closes all idle connections."""
+    self._lock.acquire()
+    try:
+      idle = self._idle
+      self._idle = []
+    finally:
+      self._lock.release()
+    for conn in idle:
+      conn.close()
+
+
+class PooledHttpClient(object):
+  """Http client keeping a ConnectionPool per host.
+
+  It is called like Robot.http_post and is what the robot posts its rpcs
+  with by default.
+  """
+
+  def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+               connection_class=None):
+    """Initializes the client.
+
+    Args:
+      pool_size: maximum number of idle connections kept per host.
+      timeout: socket timeout in seconds.
+      connection_class: class used to open new connections. Defaults to
+          httplib.HTTPConnection or httplib.HTTPSConnection depending on
+          the scheme of the url.
+    """
+    self._pool_size = pool_size
+    self._timeout = timeout
+    self._connection_class = connection_class
+    self._pools = {}
+    self._lock = threading.Lock()
+
+  def _pool(self, scheme, host):
+    self._lock.acquire()
+    try:
+      pool = self._pools.get((scheme, host))
+      if pool is None:
+        connection_class = self._connection_class
+        if connection_class is None:
+          if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+          else:
+            connection_class = httplib.HTTPConnection
+        pool = ConnectionPool(host, self._pool_size, self._timeout,
+                              connection_class)
+        self._pools[(scheme, host)] = pool
+      return pool
+    finally:
+      self._lock.release()
+
+  def __call__(self, url, data, headers):
+    """Posts data to url and returns the response code and page."""
+    scheme, host, path, query, _ = urlparse.urlsplit(url)
+    if scheme not in ('http', 'https'):
+      raise ValueError('Only http urls are supported: %s' % url)
+    if query:
+      path += '?' + query
+    return self._pool(scheme, host).request('POST', path or '/', body=data,
+                                            headers=headers)
+
+  def close(self):
+    """Closes the idle connections to all hosts."""
+    self._lock.acquire()
+    try:
+      pools = self._pools.values()
+    finally:
+      self._lock.release()
+    for pool in pools:
+      pool.close()
+
+
+def relay_request(port, events_json):
+  """Returns the (path, body, headers) of the post forwarding a bundle."""
+  if isinstance(events_json, unicode):
+    events_json = events_json.encode('utf-8')
+  return ('/%s/wave' % port, urllib.urlencode({'events': events_json}),
+          {'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+class RelayTransport(object):
+  """Interface for sending event bundles to the relay server.
+
+  Subclass this and override post() to change how bundles reach the
+  relay, then install it on a robot with Robot.set_relay_transport().
+  """
+
+  def post(self, port, events_json):
+    """Posts an event bundle to the relay listening on port.
+
+    Args:
+      port: the relay port taken from the proxyingFor field of the bundle.
+      events_json: the json encoded event bundle.
+
+    Returns:
+      The json encoded list of operations returned by the relay.
+    """
+    raise NotImplementedError()
+
+
+class PooledRelayTransport(RelayTransport):
+  """Relay transport keeping a pool of keep-alive connections per port."""
+
+  def __init__(self, host=DEFAULT_RELAY_HOST, pool_size=DEFAULT_POOL_SIZE,
+               timeout=DEFAULT_TIMEOUT,
+               connection_class=httplib.HTTPConnection):
+    """Initializes the transport.
+
+    Args:
+      host: the host running the relay server.
+      pool_size: maximum number of idle connections kept per relay port.
+      timeout: socket timeout in seconds.
+      connection_class: class used to open new connections.
+    """
+    self._host = host
+    self._pool_size = pool_size
+    self._timeout = timeout
+    self._connection_class = connection_class
+    self._pools = {}
+    self._lock = threading.Lock()
+
+  def _pool(self, port):
+    self._lock.acquire()
+    try:
+      pool = self._pools.get(port)
+      if pool is None:
+        pool = ConnectionPool(self._host, self._pool_size, self._timeout,
+                              self._connection_class)
+        self._pools[port] = pool
+      return pool
+    finally:
+      self._lock.release()
+
+  @property
+  def host(self):
+    return self._host
+
+  def post(self, port, events_json):
+    path, body, headers = relay_request(port, events_json)
+    code, content = self._pool(port).request('POST', path, body=body,
+                                             headers=headers)
+    if code != 200:
+      _log.info('Relay failed: %s', logs.Payload(content))
+      raise IOError('HttpError ' + str(code))
+    return content
+
+  def stats(self):
+    """Returns a dictionary from relay port to its ConnectionStats."""
+    self._lock.acquire()
+    try:
+      return dict([(port, pool.stats) for port, pool in self._pools.items()])
+    finally:
+      self._lock.release()
+
+  def close(self):
+    """Closes all idle connections of all ports."""
+    self._lock.acquire()
+    try:
+      pools = self._pools.values()
+    finally:
+      self._lock.release()
+    for pool in pools:
+      pool.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the relay module."""
+
+
+import cgi
+import errno
+import httplib
+import socket
+import unittest
+
+import relay
+
+
+class FakeResponse(object):
+
+  def __init__(self, status, content, will_close=False):
+    self.status = status
+    self.will_close = will_close
+    self._content = content
+
+  def read(self):
+    return self._content
+
+
+class FakeConnection(object):
+  """Records requests and answers them with the next queued response."""
+
+  opened = []
+  responses = []
+  send_errors = []
+
+  def __init__(self, host, timeout=None):
+    self.host = host
+    self.timeout = timeout
+    self.requests = []
+    self.closed = False
+    FakeConnection.opened.append(self)
+
+  def request(self, method, path, body, headers):
+    self.requests.append((method, path, body, headers))
+    if FakeConnection.send_errors:
+      raise FakeConnection.send_errors.pop(0)
+
+  def putrequest(self, method, path):
+    self.requests.append((method, path, [], {}))
+
+  def putheader(self, name, value):
+    self.requests[-1][3][name] = value
+
+  def endheaders(self, message_body=None):
+    if FakeConnection.send_errors:
+      raise FakeConnection.send_errors.pop(0)
+    self.send(message_body)
+
+  def send(self, data):
+    self.requests[-1][2].append(data)
+
+  def getresponse(self):
+    response = FakeConnection.responses.pop(0)
+    if isinstance(response, Exception):
+      raise response
+    return response
+
+  def close(self):
+    self.closed = True
+
+
+class TestPooledRelayTransport(unittest.TestCase):
+
+  def setUp(self):
+    FakeConnection.opened = []
+    FakeConnection.responses = []
+    FakeConnection.send_errors = []
+    self.transport = relay.PooledRelayTransport(
+        host='relay.test.com', pool_size=1, timeout=5,
+        connection_class=FakeConnection)
+
+  def testPostReusesConnection(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'),
+                                FakeResponse(200, '[1]')]
+    self.assertEquals('[]', self.transport.post(8080, '{"events":[]}'))
+    self.assertEquals('[1]', self.transport.post(8080, '{"events":[]}'))
+    self.assertEquals(1, len(FakeConnection.opened))
+    conn = FakeConnection.opened[0]
+    self.assertEquals('relay.test.com', conn.host)
+    self.assertEquals(5, conn.timeout)
+    method, path, body, headers = conn.requests[0]
+    self.assertEquals('POST', method)
+    self.assertEquals('/8080/wave', path)
+    self.assertEquals({'events': ['{"events":[]}']}, cgi.parse_qs(body))
+    stats = self.transport.stats()[8080]
+    self.assertEquals(2, stats.requests)
+    self.assertEquals(1, stats.connections_opened)
+    self.assertEquals(1, stats.connections_reused)
+
+  def testPoolPerPort(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'),
+                                FakeResponse(200, '[]')]
+    self.transport.post(8080, '{}')
+    self.transport.post(8081, '{}')
+    self.assertEquals(2, len(FakeConnection.opened))
+    self.assertEquals('/8081/wave', FakeConnection.opened[1].requests[0][1])
+
+  def testUnicodeIsSentAsUtf8(self):
+    FakeConnection.responses = [FakeResponse(200, '[]')]
+    self.transport.post(8080, u'{"content":"\u05e9\u05dc\u05d5\u05dd"}')
+    body = FakeConnection.opened[0].requests[0][2]
+    self.assertEquals(u'{"content":"\u05e9\u05dc\u05d5\u05dd"}',
+                      cgi.parse_qs(body)['events'][0].decode('utf-8'))
+
+  def testClosedConnectionNotReused(self):
+    FakeConnection.responses = [FakeResponse(200, '[]', will_close=True),
+                                FakeResponse(200, '[]')]
+    self.transport.post(8080, '{}')
+    self.transport.post(8080, '{}')
+    self.assertEquals(2, len(FakeConnection.opened))
+    self.assertTrue(FakeConnection.opened[0].closed)
+
+  def testStaleConnectionIsRetried(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'),
+                                httplib.BadStatusLine(''),
+                                FakeResponse(200, '[2]')]
+    self.transport.post(8080, '{}')
+    self.assertEquals('[2]', self.transport.post(8080, '{}'))
+    self.assertEquals(2, len(FakeConnection.opened))
+    self.assertEquals(1, self.transport.stats()[8080].retries)
+
+  def testResetWhileSendingIsRetried(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'),
+                                FakeResponse(200, '[2]')]
+    self.transport.post(8080, '{}')
+    FakeConnection.send_errors = [socket.error(errno.EPIPE, 'broken pipe')]
+    self.assertEquals('[2]', self.transport.post(8080, '{}'))
+    self.assertEquals(1, self.transport.stats()[8080].retries)
+
+  def testTimeoutIsNotRetried(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'),
+                                socket.timeout('timed out'),
+                                FakeResponse(200, '[2]')]
+    self.transport.post(8080, '{}')
+    self.assertRaises(IOError, self.transport.post, 8080, '{}')
+    self.assertEquals(1, len(FakeConnection.opened))
+    self.assertEquals(2, len(FakeConnection.opened[0].requests))
+    self.assertEquals(0, self.transport.stats()[8080].retries)
+
+  def testResetAfterSendingIsNotRetried(self):
+    FakeConnection.responses = [
+        FakeResponse(200, '[]'),
+        socket.error(errno.ECONNRESET, 'connection reset')]
+    self.transport.post(8080, '{}')
+    self.assertRaises(IOError, self.transport.post, 8080, '{}')
+    self.assertEquals(1, len(FakeConnection.opened))
+
+  def testRetriedOnlyOnce(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'),
+                                httplib.BadStatusLine(''),
+                                httplib.BadStatusLine(''),
+                                FakeResponse(200, '[2]')]
+    self.transport.post(8080, '{}')
+    self.assertRaises(IOError, self.transport.post, 8080, '{}')
+    self.assertEquals(2, len(FakeConnection.opened))
+    stats = self.transport.stats()[8080]
+    self.assertEquals(1, stats.retries)
+    self.assertEquals(1, stats.errors)
+
+  def testErrors(self):
+    FakeConnection.responses = [FakeResponse(500, 'oops', will_close=True),
+                                socket.error('connection refused')]
+    self.assertRaises(IOError, self.transport.post, 8080, '{}')
+    self.assertRaises(IOError, self.transport.post, 8080, '{}')
+    self.assertEquals(1, self.transport.stats()[8080].errors)
+
+
+class TestConnectionPool(unittest.TestCase):
+
+  def setUp(self):
+    FakeConnection.opened = []
+    FakeConnection.responses = []
+    FakeConnection.send_errors = []
+    self.pool = relay.ConnectionPool('rpc.test.com',
+                                     connection_class=FakeConnection)
+
+  def testChunkedBody(self):
+    FakeConnection.responses = [FakeResponse(200, '[]')]
+    self.pool.request('POST', '/rpc', body=['[1,', '', '2]'],
+                      headers={'a': 'b'})
+    method, path, body, headers = FakeConnection.opened[0].requests[0]
+    self.assertEquals({'a': 'b', 'Content-Length': '5'}, headers)
+    self.assertEquals(['[1,', '2]'], body)
+
+  def testSingleChunkSentAsString(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'), FakeResponse(200, '')]
+    self.pool.request('POST', '/rpc', body=['', '[1]'], headers={'a': 'b'})
+    self.pool.request('POST', '/rpc', body=[''])
+    requests = FakeConnection.opened[0].requests
+    self.assertEquals(('POST', '/rpc', '[1]', {'a': 'b'}), requests[0])
+    self.assertEquals('', requests[1][2])
+
+  def testChunkedBodyResentOnRetry(self):
+    FakeConnection.responses = [FakeResponse(200, '', will_close=False),
+                                httplib.BadStatusLine(''),
+                                FakeResponse(200, '')]
+    self.pool.request('POST', '/rpc', body=['a'])
+    self.pool.request('POST', '/rpc', body=['b', 'c'])
+    self.assertEquals(['b', 'c'], FakeConnection.opened[0].requests[1][2])
+    self.assertEquals(['b', 'c'], FakeConnection.opened[1].requests[0][2])
+
+
+class TestPooledHttpClient(unittest.TestCase):
+
+  def setUp(self):
+    FakeConnection.opened = []
+    FakeConnection.responses = []
+    FakeConnection.send_errors = []
+    self.client = relay.PooledHttpClient(connection_class=FakeConnection)
+
+  def testPostReusesConnection(self):
+    FakeConnection.responses = [FakeResponse(200, '[]'),
+                                FakeResponse(200, '[1]')]
+    self.assertEquals((200, '[]'), self.client(
+        'http://rpc.test.com/api/rpc?oauth_nonce=1', '[]', {}))
+    self.assertEquals((200, '[1]'), self.client(
+        'http://rpc.test.com/api/rpc', '[]', {}))
+    self.assertEquals(1, len(FakeConnection.opened))
+    requests = FakeConnection.opened[0].requests
+    self.assertEquals(['/api/rpc?oauth_nonce=1', '/api/rpc'],
+                      [request[1] for request in requests])
+
+  def testPoolPerHost(self):
+    FakeConnection.responses = [FakeResponse(200, ''), FakeResponse(200, '')]
+    self.client('http://a.test.com/', '', {})
+    self.client('https://a.test.com/', '', {})
+    self.assertEquals(2, len(FakeConnection.opened))
+
+  def testOnlyHttp(self):
+    self.assertRaises(ValueError, self.client, 'ftp://rpc.test.com/', '', {})
+
+
+if __name__ == '__main__':
+  unittest.main()
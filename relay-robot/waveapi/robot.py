@@ -20,31 +20,112 @@ This module provides the Robot class and RobotListener interface,
 as well as some helper functions for web requests and responses.
 """
 
-from google.appengine.api import urlfetch
 import base64
-import logging
-import sys
-import urllib
+import re
+import zlib
 
 try:
   __import__("google3") # setup internal test environment
 except ImportError:
   pass
 
+try:
+  import hashlib # 2.5
+  _sha1 = hashlib.sha1
+except ImportError:
+  import sha # deprecated
+  _sha1 = sha.sha
+
 import simplejson
 
 import blip
+import errors
 import events
+import lazyjson
+import logs
 import ops
-import util
+import relay
+import signing
 import wavelet
+import workers
+
+_log = logs.get('events')
+_rpc_log = logs.get('rpc')
 
-# We only import oauth when we need it
-oauth = None
+# Rpc bodies are encoded into chunks of about this many bytes.
+BODY_CHUNK_SIZE = 64 * 1024
 
 DEFAULT_PROFILE_URL = (
     'http://code.google.com/apis/wave/extensions/robots/python-tutorial.html')
 
+# Event property a handler filter is matched against when dispatching
+# locally. Filters on other event types are only applied by the server.
+FILTER_PROPERTIES = {
+    events.AnnotatedTextChanged.type: 'name',
+}
+
+
+def _compile_filter(event_type, filter):
+  """Returns a predicate on the event properties for filter, or None."""
+  key = FILTER_PROPERTIES.get(event_type)
+  if not filter or not key:
+    return None
+  match = re.compile('(?:%s)$' % filter).match
+  return lambda properties: match(properties.get(key) or '') is not None
+
+
+def _encode_body(value):
+  """Returns the json encoding of value as a list of chunks, and its hash.
+
+  The hash is the base64 encoded sha1 of the whole encoding. It is
+  computed chunk by chunk while encoding, so the body never has to be
+  put together as a single string.
+  """
+  hashed = _sha1()
+  chunks = []
+  pieces = []
+  size = 0
+  for piece in simplejson.JSONEncoder().iterencode(value):
+    pieces.append(piece)
+    size += len(piece)
+    if size >= BODY_CHUNK_SIZE:
+      chunk = ''.join(pieces)
+      hashed.update(chunk)
+      chunks.append(chunk)
+      pieces = []
+      size = 0
+  if pieces or not chunks:
+    chunk = ''.join(pieces)
+    hashed.update(chunk)
+    chunks.append(chunk)
+  return chunks, base64.b64encode(hashed.digest())
+
+
+def _etag(version, body):
+  """Returns a strong etag for body as served at version."""
+  if isinstance(body, unicode):
+    body = body.encode('utf-8')
+  return '"%s-%08x"' % (version, zlib.crc32(body) & 0xffffffff)
+
+
+def etag_matches(if_none_match, etag):
+  """Returns whether an If-None-Match header value matches etag."""
+  if not if_none_match or not etag:
+    return False
+  for candidate in if_none_match.split(','):
+    candidate = candidate.strip()
+    if candidate == '*' or candidate == etag:
+      return True
+  return False
+
+
+def operation_error_handler(event, wavelet):
+  """Default operation error handler, logging what went wrong."""
+  if isinstance(event, events.OperationError):
+    _log.error('Previously operation failed: id=%s, message: %s',
+               event.operation_id, event.error_message)
+
+
 class Robot(object):
   """Robot metadata class.
 
@@ -64,6 +145,7 @@ class Robot(object):
           this robot.
     """
     self._handlers = {}
+    self._dispatch_table = None
     self._name = name
     self._verification_token = None
     self._st = None
@@ -74,6 +156,17 @@ class Robot(object):
     self._image_url = image_url
     self._profile_url = profile_url
     self._capability_hash = 0
+    self._relay_transport = relay.PooledRelayTransport()
+    self._local_event_types = set()
+    self._dispatch_all_locally = False
+    self._compact_operations = False
+    self._worker_pool = None
+    self._http_client = relay.PooledHttpClient()
+    self._rpc_signer = None
+    # Tuples of the response served for a GET and its etag, built on
+    # first use and reset when what they describe changes.
+    self._capabilities_response = None
+    self._profile_response = None
 
   @property
   def name(self):
@@ -92,24 +185,88 @@ class Robot(object):
     """Execute an http post.
 
     Monkey patch this method to use something other than
-    the default urllib.
+    the default relay.PooledHttpClient, which keeps connections to the
+    rpc server alive between posts.
     Args:
         url: to post to
-        body: post body
+        body: post body, a string or, for this default implementation
+            only, a list of strings
         headers: extra headers to pass along
     Returns:
         response_code, returned_page
     """
-    import urllib2
-    req = urllib2.Request(url,
-                          data=data,
-                          headers=headers)
-    try:
-      f = urllib2.urlopen(req)
-      result = f.read()
-      return 200, result
-    except urllib2.URLError, e:
-      return e.code, e.read()
+    return self._http_client(url, data, headers)
+
+  def set_compact_operations(self, compact=True):
+    """Sets whether operation queues are compacted before they are sent.
+
+    See ops.OperationQueue.compact for what compaction removes.
+    """
+    self._compact_operations = compact
+
+  def _compact(self, operation_queue):
+    if self._compact_operations:
+      removed = operation_queue.compact()
+      _log.debug('Compaction removed %d operations', removed)
+
+  def set_worker_pool(self, pool):
+    """Sets the pool process_bundles runs the bundles on.
+
+    A workers.ProcessPool is started right away, so register the
+    handlers first; the processes only know the handlers registered at
+    the time they are forked.
+
+    Args:
+      pool: a workers.WorkerPool or workers.ProcessPool, or an int to
+          create a WorkerPool with that many threads.
+    """
+    if isinstance(pool, (int, long)):
+      pool = workers.WorkerPool(pool)
+    self._worker_pool = pool
+    if isinstance(pool, workers.ProcessPool):
+      pool.start(self.process_events, self._close_connections)
+
+  @property
+  def worker_pool(self):
+    """The pool set with set_worker_pool, or None."""
+    return self._worker_pool
+
+  def _close_connections(self):
+    """Drops the idle connections, which a forked process must not share."""
+    for client in (self._relay_transport, self._http_client):
+      close = getattr(client, 'close', None)
+      if close is not None:
+        close()
+
+  @property
+  def relay_transport(self):
+    """The transport used to forward event bundles to the relay."""
+    return self._relay_transport
+
+  def set_relay_transport(self, transport):
+    """Sets the transport used to forward event bundles to the relay.
+
+    Args:
+      transport: a relay.RelayTransport instance.
+    """
+    self._relay_transport = transport
+
+  def dispatch_locally(self, *event_classes):
+    """Handles events in-process instead of forwarding them to the relay.
+
+    Locally dispatched events are passed to the handlers registered with
+    register_handler and skip the relay round trip entirely. For example:
+
+      myrobot.dispatch_locally(events.AnnotatedTextChanged)
+
+    Args:
+      event_classes: the event classes to handle locally. If none are
+          passed, all events are handled locally.
+    """
+    if not event_classes:
+      self._dispatch_all_locally = True
+    for event_class in event_classes:
+      self._local_event_types.add(event_class.type)
 
   def get_verification_token_info(self):
     return self._verification_token, self._st
@@ -148,6 +305,8 @@ class Robot(object):
     """
     payload = (handler, event_class, context, filter)
     self._handlers.setdefault(event_class.type, []).append(payload)
+    self._dispatch_table = None
+    self._capabilities_response = None
     self._capability_hash = (
         self._capability_hash * 13 + hash(event_class.type)) & 0xfffffff
 
@@ -175,18 +334,11 @@ class Robot(object):
           For wave preview, http://gmodules.com/api/rpc should be used.
           For wave sandbox, http://sandbox.gmodules.com/api/rpc should be used.
     """
-    # Import oauth inline and using __import__ for pyexe compatibility
-    # when oauth is not installed.
-    global oauth
-    __import__('waveapi.oauth')
-    oauth = sys.modules['waveapi.oauth']
-
     self._server_rpc_base = server_rpc_base
     self._consumer_key = consumer_key
     self._consumer_secret = consumer_secret
-    self._oauth_signature_method = oauth.OAuthSignatureMethod_HMAC_SHA1()
-    self._oauth_consumer = oauth.OAuthConsumer(self._consumer_key,
-                                               self._consumer_secret)
+    self._rpc_signer = signing.RpcSigner('google.com:' + consumer_key,
+                                         consumer_secret, server_rpc_base)
 
   def register_profile_handler(self, handler):
     """Sets the profile handler for this robot.
@@ -196,57 +348,69 @@ class Robot(object):
     robot itself. A dictionary with keys for name, imageUrl and
     profileUrl should be returned.
     """
-    this._profile_handler = handler
+    self._profile_handler = handler
+    self._profile_response = None
 
-  def _hash(self, value):
-    """return b64encoded sha1 hash of value."""
-    try:
-      hashlib = __import__('hashlib') # 2.5
-      hashed = hashlib.sha1(value)
-    except ImportError:
-      import sha # deprecated
-      hashed = sha.sha(value)
-    return base64.b64encode(hashed.digest())
-
-
-  def make_rpc(self, operations):
-    """Make an rpc call, submitting the specified operations."""
+  def _signed_chunks(self, operations):
+    """Returns the signed url and the body chunks to submit operations with."""
 
-    if not oauth or not self._oauth_consumer.key:
+    if self._rpc_signer is None or not self._consumer_key:
       raise errors.Error('OAuth has not been configured')
     if (not type(operations) == list and
         not isinstance(operations, ops.OperationQueue)):
       operations = [operations]
 
-    rpcs = [op.serialize(method_prefix='wave') for op in operations]
-
-    post_body = simplejson.dumps(rpcs)
-    body_hash = self._hash(post_body)
-    params = {
-      'oauth_consumer_key': 'google.com:' + self._oauth_consumer.key,
-      'oauth_timestamp': oauth.generate_timestamp(),
-      'oauth_nonce': oauth.generate_nonce(),
-      'oauth_version': oauth.OAuthRequest.version,
-      'oauth_body_hash': body_hash,
-    }
-    oauth_request = oauth.OAuthRequest.from_request('POST',
-                                                    self._server_rpc_base,
-                                                    parameters=params)
-    oauth_request.sign_request(self._oauth_signature_method,
-                               self._oauth_consumer,
-                               None)
-    code, content = self.http_post(
-        url=oauth_request.to_url(),
-        data=post_body,
-        headers={'Content-Type': 'application/json'})
+    rpcs = [isinstance(op, dict) and op or op.serialize(method_prefix='wave')
+            for op in operations]
+
+    chunks, body_hash = _encode_body(rpcs)
+    return self._rpc_signer.sign(body_hash), chunks
+
+  def rpc_request(self, operations):
+    """Returns the signed (url, body, headers) to submit operations with.
+
+    The operations can also be given already serialized, as the
+    dictionaries returned by serialize_rpcs.
+    """
+    url, chunks = self._signed_chunks(operations)
+    return url, ''.join(chunks), {'Content-Type': 'application/json'}
+
+  def rpc_result(self, url, code, content):
+    """Returns the decoded answer to an rpc.
+
+    Raises:
+      errors.HttpError: if the server did not answer with 200.
+      errors.ResponseError: if the answer is not valid json.
+      IOError: if the request failed.
+    """
     if code != 200:
-      logging.info(oauth_request.to_url())
-      logging.info(content)
-      raise IOError('HttpError ' + str(code))
-    return simplejson.loads(content)
+      _rpc_log.info('Rpc to %s failed: %s', url, logs.Payload(content))
+      raise errors.HttpError(code)
+    try:
+      return simplejson.loads(content)
+    except ValueError, e:
+      raise errors.ResponseError('Undecodable answer from %s: %s' % (url, e))
 
-  def capabilities_xml(self):
-    """Return this robot's capabilities as an XML string."""
+  def _posts_chunks(self):
+    """Returns whether http_post is the default, which takes chunked bodies."""
+    return ('http_post' not in self.__dict__ and
+            type(self).http_post.im_func is Robot.http_post.im_func)
+
+  def make_rpc(self, operations):
+    """Make an rpc call, submitting the specified operations.
+
+    With the default http_post the body is sent chunk by chunk as it
+    came out of the json encoder, other http_post functions are passed
+    the body as a string.
+    """
+    url, chunks = self._signed_chunks(operations)
+    if not self._posts_chunks():
+      chunks = ''.join(chunks)
+    code, content = self.http_post(url=url, data=chunks,
+                                   headers={'Content-Type': 'application/json'})
+    return self.rpc_result(url, code, content)
+
+  def _build_capabilities_xml(self):
     lines = []
     for capability, payloads in self._handlers.items():
       for payload in payloads:
@@ -269,6 +433,42 @@ class Robot(object):
                              ops.PROTOCOL_VERSION,
                              '\n'.join(lines))
 
+  def capabilities_xml(self):
+    """Return this robot's capabilities as an XML string."""
+    return self._capabilities()[0]
+
+  def capabilities_etag(self):
+    """Returns the etag of capabilities_xml."""
+    return self._capabilities()[1]
+
+  def _capabilities(self):
+    response = self._capabilities_response
+    if response is None:
+      xml = self._build_capabilities_xml()
+      response = (xml, _etag(self.capabilities_hash(), xml))
+      self._capabilities_response = response
+    return response
+
+  def profile_etag(self):
+    """Returns the etag of the robot's own profile_json.
+
+    None is returned if a profile handler is registered, as the profile
+    it returns can change at any time.
+    """
+    if self._profile_handler:
+      return None
+    return self._default_profile()[1]
+
+  def _default_profile(self):
+    response = self._profile_response
+    if response is None:
+      data = simplejson.dumps({'name': self.name,
+                               'imageUrl': self.image_url,
+                               'profileUrl': self.profile_url})
+      response = (data, _etag(self.capabilities_hash(), data))
+      self._profile_response = response
+    return response
+
   def profile_json(self, name=None):
     """Json representation of the profile.
 
@@ -279,12 +479,8 @@ class Robot(object):
     use register_profile_handler to override this default behavior.
     """
     if self._profile_handler:
-      data = self._profile_handler(name)
-    else:
-      data = {'name': self.name,
-              'imageUrl': self.image_url,
-              'profileUrl': self.profile_url}
-    return simplejson.dumps(data)
+      return simplejson.dumps(self._profile_handler(name))
+    return self._default_profile()[0]
 
   def _wavelet_from_json(self, json, pending_ops):
     """Construct a wavelet from the passed json.
@@ -296,49 +492,156 @@ class Robot(object):
     Alternatively the json can be the result of a previous
     wavelet.serialize() call. In that case the blips will
     be contaned in the wavelet record.
+
+    Blips are only constructed when they are first accessed.
     """
     if isinstance(json, basestring):
-      json = simplejson.loads(json)
+      json = lazyjson.LazyObject(json, lazy_keys=('blips',))
 
-    blips = {}
-    for blip_id, raw_blip_data in json['blips'].items():
-      blips[blip_id] = blip.Blip(raw_blip_data, blips, pending_ops)
+    blips = blip.LazyBlips(json['blips'], pending_ops)
 
     if 'wavelet' in json:
       raw_wavelet_data = json['wavelet']
     else:
       raw_wavelet_data = json
-    wavelet_blips = {}
-    wavelet_id = raw_wavelet_data['waveletId']
-    wave_id = raw_wavelet_data['waveId']
-    for blip_id, instance in blips.items():
-      if instance.wavelet_id == wavelet_id and instance.wave_id == wave_id:
-        wavelet_blips[blip_id] = instance
+    wavelet_blips = blips.restricted_to(raw_wavelet_data['waveId'],
+                                        raw_wavelet_data['waveletId'])
     result = wavelet.Wavelet(raw_wavelet_data, wavelet_blips, self, pending_ops)
     robot_address = json.get('robotAddress')
     if robot_address:
       result.robot_address = robot_address
     return result
 
-  def process_events(self, json):
-    """Process an incoming set of events encoded as json."""
-    parsed = simplejson.loads(json)
+  def _is_local(self, parsed, event_data):
+    """Returns whether event_data should be handled in-process."""
+    return (self._dispatch_all_locally or
+            'proxyingFor' not in parsed or
+            event_data['type'] in self._local_event_types)
 
+  def _compile_dispatch_table(self):
+    """Builds the table used to dispatch events to the handlers.
+
+    The table maps an event type to the ordered list of
+    (handler, event_class, predicate) tuples registered for it, where
+    predicate is the precompiled filter or None.
+    """
+    table = {}
+    for event_type, payloads in self._handlers.items():
+      table[event_type] = [
+          (handler, event_class, _compile_filter(event_type, filter))
+          for handler, event_class, context, filter in payloads]
+    return table
+
+  def _dispatch(self, event_data_list, event_wavelet):
+    """Calls the registered handlers for each event in order."""
+    table = self._dispatch_table
+    if table is None:
+      table = self._dispatch_table = self._compile_dispatch_table()
+    for event_data in event_data_list:
+      entries = table.get(event_data['type'])
+      if not entries:
+        continue
+      properties = event_data.get('properties', {})
+      event = None
+      for handler, event_class, predicate in entries:
+        if predicate and not predicate(properties):
+          continue
+        if event is None or event.__class__ is not event_class:
+          event = event_class(event_data, event_wavelet)
+        handler(event, event_wavelet)
+
+  def process_local_events(self, json):
+    """Dispatches the local events of a bundle, leaving the relay to the caller.
+
+    This does everything process_events does, except posting to the
+    relay, so runners doing their own network io can forward the
+    relayed events without blocking.
+
+    Returns:
+      A tuple of the list of serialized operations, the relay port and
+      the json to post to it. The port and json are None if no events
+      have to be relayed.
+    """
+    parsed = lazyjson.LazyObject(json, lazy_keys=('blips',))
+
+    local_events = []
+    relayed_events = []
+    for event_data in parsed['events']:
+      if self._is_local(parsed, event_data):
+        local_events.append(event_data)
+      else:
+        relayed_events.append(event_data)
+
+    pending_ops = ops.OperationQueue()
+    if local_events:
+      event_wavelet = self._wavelet_from_json(parsed, pending_ops)
+      self._dispatch(local_events, event_wavelet)
+      _log.debug('Materialized %d of %d blips',
+               event_wavelet.blips.materialized_count,
+               len(parsed['blips']))
+    self._compact(pending_ops)
+    pending_ops.set_capability_hash(self._capability_hash)
+    operations = pending_ops.serialize()
+
+    if not relayed_events:
+      return operations, None, None
+    if local_events:
+      json = parsed.splice('events', simplejson.dumps(relayed_events))
     proxying_for = parsed['proxyingFor']
-    logging.info(proxying_for)
+    _log.info('Proxying for %s', proxying_for)
     port = simplejson.loads(proxying_for)['port']
-    response = urlfetch.fetch(url=('http://jem.thewe.net/%s/wave' % port),
-                              payload=urllib.urlencode({'events': json}),
-                              method=urlfetch.POST,
-                              headers={'Content-Type': 'application/x-www-form-urlencoded'}).content
+    return operations, port, json
 
-    first = ops.Operation(ops.ROBOT_NOTIFY_CAPABILITIES_HASH,
-                          '0',
-                          {'capabilitiesHash': self._capability_hash})
-    operations = [util.serialize(first)] + simplejson.loads(response)
+  def process_events(self, json):
+    """Process an incoming set of events encoded as json.
 
+    The json is preferably passed as the utf-8 encoded request body. It
+    is scanned incrementally; the blips are only decoded when a locally
+    dispatched event needs them.
+
+    Events selected with dispatch_locally are passed to the registered
+    handlers. So are all events of a bundle that does not proxy for a
+    relay port. Any other events are forwarded to the relay. The
+    operations of the handlers come first in the response, followed by
+    those returned by the relay.
+    """
+    operations, port, relay_json = self.process_local_events(json)
+    if port is not None:
+      response = self._relay_transport.post(port, relay_json)
+      operations += simplejson.loads(response)
     return simplejson.dumps(operations)
 
+  def _wavelet_key(self, json):
+    """Returns the (wave id, wavelet id) an event bundle is about."""
+    parsed = lazyjson.LazyObject(json, lazy_keys=('blips',))
+    raw_wavelet_data = parsed['wavelet']
+    return raw_wavelet_data['waveId'], raw_wavelet_data['waveletId']
+
+  def process_bundles(self, jsons):
+    """Processes several event bundles, running wavelets concurrently.
+
+    The bundles are handed to the worker pool set with set_worker_pool,
+    a pool of threads by default. Bundles about the same wavelet are
+    processed one after another in the order given, bundles about
+    different wavelets in parallel, each with an operation queue of its
+    own. Handlers should therefore be thread safe. Only a
+    workers.ProcessPool spreads the handlers over several cores.
+
+    Every bundle is the body of a request of its own and needs its own
+    answer, so the operations are not merged across bundles: the queue
+    of every wavelet ends up in the response to its bundle.
+
+    Args:
+      jsons: list of event bundles as passed to process_events.
+
+    Returns:
+      The list of responses of process_events, one for every bundle.
+    """
+    if self._worker_pool is None:
+      self._worker_pool = workers.WorkerPool()
+    keyed = [(self._wavelet_key(json), json) for json in jsons]
+    return self._worker_pool.map(self.process_events, keyed)
+
   def new_wave(self, domain, participants=None, message=''):
     """Create a new wave with the initial participants on it.
 
@@ -419,7 +722,58 @@ class Robot(object):
     or new_wavelet.
     """
     pending = wavelet.get_operation_queue()
+    self._compact(pending)
     res = self.make_rpc(pending)
     pending.clear()
-    logging.info('submit returned:%s' % res)
+    _rpc_log.info('submit returned:%s', logs.Payload(res))
+    return res
+
+  def submit_many(self, wavelets):
+    """Submits the pending operations of several wavelets in a single rpc.
+
+    Returns:
+      A list with, for every wavelet, the list of results the server
+      returned for its operations.
+    """
+    queues = [wavelet.get_operation_queue() for wavelet in wavelets]
+    operations = []
+    for queue in queues:
+      self._compact(queue)
+      operations.extend(queue)
+    if not operations:
+      return [[] for queue in queues]
+    op_ids = [[op.id for op in queue] for queue in queues]
+    res = self.make_rpc(operations)
+    for queue in queues:
+      queue.clear()
+    _rpc_log.info('submit returned:%s', logs.Payload(res))
+    by_id = {}
+    for result in res:
+      if isinstance(result, dict) and 'id' in result:
+        by_id[result['id']] = result
+    return [[by_id[op_id] for op_id in ids if op_id in by_id]
+            for ids in op_ids]
+
+  def serialize_rpcs(self, wavelet):
+    """Takes the pending operations off a wavelet and serializes them.
+
+    The result can be passed to make_rpc later, for instance after it
+    has been written to disk.
+    """
+    pending = wavelet.get_operation_queue()
+    self._compact(pending)
+    rpcs = [op.serialize(method_prefix='wave') for op in pending]
+    pending.clear()
+    return rpcs
+
+  def submit_request(self, wavelet):
+    """Takes the pending operations off a wavelet and returns their rpc.
+
+    This is for runners that post the rpc themselves; see rpc_request
+    for what is returned and rpc_result to decode the answer.
+    """
+    pending = wavelet.get_operation_queue()
+    self._compact(pending)
+    res = self.rpc_request(pending)
+    pending.clear()
     return res
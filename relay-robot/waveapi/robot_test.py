@@ -16,11 +16,15 @@
 
 """Unit tests for the robot module."""
 
+import base64
+import hashlib
 import unittest
 
+import errors
 import events
 import ops
 import robot
+import signing
 import simplejson
 
 BLIP_JSON = ('{"wdykLROk*13":'
@@ -56,6 +60,31 @@ EVENTS_JSON = ('[{"timestamp":1242079611003,'
 
 TEST_JSON = '{"blips":%s,"wavelet":%s,"events":%s}' % (BLIP_JSON, WAVELET_JSON, EVENTS_JSON)
 
+MIXED_EVENTS_JSON = ('[{"timestamp":1242079611003,'
+                      '"modifiedBy":"someguy@test.com",'
+                      '"properties":{"blipId":"wdykLROk*13"},'
+                      '"type":"BLIP_SUBMITTED"},'
+                     '{"timestamp":1242079611004,'
+                      '"modifiedBy":"someguy@test.com",'
+                      '"properties":{"participantsRemoved":[],"participantsAdded":["monty@appspot.com"]},'
+                      '"type":"WAVELET_PARTICIPANTS_CHANGED"}]')
+
+PROXYING_JSON = ('{"blips":%s,"wavelet":%s,"events":%s,'
+                 '"proxyingFor":"{\\"port\\":8080}"}' %
+                 (BLIP_JSON, WAVELET_JSON, MIXED_EVENTS_JSON))
+
+
+class FakeRelayTransport(object):
+  """Records the posted bundles and answers with a fixed operation list."""
+
+  def __init__(self, response='[]'):
+    self.posted = []
+    self.response = response
+
+  def post(self, port, events_json):
+    self.posted.append((port, simplejson.loads(events_json)))
+    return self.response
+
 
 class TestRobot(unittest.TestCase):
   """Tests for testing the basic parsing of json in robots."""
@@ -119,6 +148,70 @@ class TestRobot(unittest.TestCase):
       expected.remove(method)
     self.assertEquals(0, len(expected))
 
+  def testCompactOperations(self):
+    def check(event, wavelet):
+      wavelet.title = 'first title'
+      wavelet.title = 'second title'
+      wavelet.root_blip.append('hello ')
+      wavelet.root_blip.append('world')
+
+    self.robot.register_handler(events.WaveletParticipantsChanged, check)
+    self.assertEquals(5, len(simplejson.loads(
+        self.robot.process_events(TEST_JSON))))
+    self.robot.set_compact_operations()
+    operations = simplejson.loads(self.robot.process_events(TEST_JSON))
+    self.assertEquals([ops.ROBOT_NOTIFY_CAPABILITIES_HASH,
+                       ops.WAVELET_SET_TITLE, ops.DOCUMENT_MODIFY],
+                      [op['method'] for op in operations])
+    self.assertEquals('second title', operations[1]['params']['waveletTitle'])
+    self.assertEquals(['hello world'],
+                      operations[2]['params']['modifyAction']['values'])
+
+  def testProcessBundles(self):
+    other_json = TEST_JSON.replace('test.com!conv+root', 'test.com!other')
+    seen = []
+
+    def check(event, wavelet):
+      seen.append((wavelet.wavelet_id, wavelet.title))
+      wavelet.title = 'title %d' % len(seen)
+
+    self.robot.register_handler(events.WaveletParticipantsChanged, check)
+    self.robot.set_worker_pool(2)
+    responses = self.robot.process_bundles(
+        [TEST_JSON, other_json, TEST_JSON])
+    self.assertEquals(3, len(responses))
+    for response in responses:
+      operations = simplejson.loads(response)
+      self.assertEquals([ops.ROBOT_NOTIFY_CAPABILITIES_HASH,
+                         ops.WAVELET_SET_TITLE],
+                        [op['method'] for op in operations])
+    self.assertEquals(['test.com!conv+root', 'test.com!other'],
+                      sorted(set([wavelet_id for wavelet_id, _ in seen])))
+    self.assertEquals([], self.robot.process_bundles([]))
+
+  def testSubmitMany(self):
+    submitted = []
+
+    def make_rpc(operations):
+      submitted.append(list(operations))
+      return [{'id': op.id, 'data': {}} for op in operations]
+
+    self.robot.make_rpc = make_rpc
+    first = self.robot.blind_wavelet(TEST_JSON)
+    second = self.robot.blind_wavelet(TEST_JSON)
+    empty = self.robot.blind_wavelet(TEST_JSON)
+    first.title = 'first'
+    second.title = 'second'
+    second.root_blip.append('more')
+    results = self.robot.submit_many([first, second, empty])
+    self.assertEquals(1, len(submitted))
+    self.assertEquals([op.id for op in submitted[0][:1]],
+                      [r['id'] for r in results[0]])
+    self.assertEquals([op.id for op in submitted[0][1:]],
+                      [r['id'] for r in results[1]])
+    self.assertEquals([], results[2])
+    self.assertEquals(0, len(first.get_operation_queue()))
+
   def testSerializeWavelets(self):
     wavelet = self.robot.blind_wavelet(TEST_JSON)
     serialized = wavelet.serialize()
@@ -133,6 +226,135 @@ class TestRobot(unittest.TestCase):
     self.assertEquals(wavelet.domain, unserialized.domain)
 
 
+class TestRpcBodies(unittest.TestCase):
+
+  def setUp(self):
+    self.robot = robot.Robot('Testy')
+    self.robot._consumer_key = 'key'
+    self.robot._rpc_signer = signing.RpcSigner(
+        'google.com:key', 'secret', 'http://rpc.test.com/api/rpc')
+    self.old_chunk_size = robot.BODY_CHUNK_SIZE
+
+  def tearDown(self):
+    robot.BODY_CHUNK_SIZE = self.old_chunk_size
+
+  def testEncodeBody(self):
+    value = [{'method': 'wave.robot.folderAction', 'id': 'op%d' % i,
+              'params': {'text': u'\u05e9' * i}} for i in range(50)]
+    robot.BODY_CHUNK_SIZE = 100
+    chunks, body_hash = robot._encode_body(value)
+    body = ''.join(chunks)
+    self.assertTrue(len(chunks) > 1)
+    self.assertEquals(simplejson.dumps(value), body)
+    self.assertEquals(base64.b64encode(hashlib.sha1(body).digest()),
+                      body_hash)
+
+  def testMakeRpcPostsChunks(self):
+    posted = []
+
+    def client(url, data, headers):
+      posted.append((url, data))
+      return 200, '[]'
+
+    self.robot._http_client = client
+    robot.BODY_CHUNK_SIZE = 10
+    operation = ops.Operation(ops.WAVELET_SET_TITLE, 'op1',
+                              {'waveletTitle': 'a title'})
+    self.assertEquals([], self.robot.make_rpc([operation]))
+    url, data = posted[0]
+    self.assertTrue(isinstance(data, list))
+    body = ''.join(data)
+    self.assertEquals([operation.serialize(method_prefix='wave')],
+                      simplejson.loads(body))
+    self.assertTrue('oauth_body_hash=%s' % signing._escape(
+        base64.b64encode(hashlib.sha1(body).digest())) in url)
+
+  def testMonkeyPatchedHttpPostGetsString(self):
+    posted = []
+
+    def http_post(url, data, headers):
+      posted.append(data)
+      return 200, '[]'
+
+    self.robot.http_post = http_post
+    self.robot.make_rpc([ops.Operation(ops.WAVELET_SET_TITLE, 'op1', {})])
+    self.assertTrue(isinstance(posted[0], str))
+
+
+  def testRpcResultErrors(self):
+    self.assertEquals([], self.robot.rpc_result('url', 200, '[]'))
+    self.assertRaises(errors.HttpError, self.robot.rpc_result, 'url', 503, '')
+    self.assertRaises(errors.ResponseError, self.robot.rpc_result, 'url', 200,
+                      '[1,')
+
+
+class TestLocalDispatch(unittest.TestCase):
+  """Tests choosing between local dispatch and the relay."""
+
+  def setUp(self):
+    self.robot = robot.Robot('Testy')
+    self.relay = FakeRelayTransport(
+        '[{"method":"wavelet.setTitle","id":"op99","params":{}}]')
+    self.robot.set_relay_transport(self.relay)
+    self.called = []
+    self.robot.register_handler(events.BlipSubmitted,
+                                lambda e, w: self.called.append(e.type))
+    self.robot.register_handler(events.WaveletParticipantsChanged,
+                                lambda e, w: self.called.append(e.type))
+
+  def testEverythingRelayedByDefault(self):
+    json = self.robot.process_events(PROXYING_JSON)
+    self.assertEquals([], self.called)
+    self.assertEquals(1, len(self.relay.posted))
+    port, bundle = self.relay.posted[0]
+    self.assertEquals(8080, port)
+    self.assertEquals(2, len(bundle['events']))
+    methods = [op['method'] for op in simplejson.loads(json)]
+    self.assertEquals([ops.ROBOT_NOTIFY_CAPABILITIES_HASH,
+                       ops.WAVELET_SET_TITLE], methods)
+
+  def testPerEventType(self):
+    self.robot.dispatch_locally(events.BlipSubmitted)
+    self.robot.process_events(PROXYING_JSON)
+    self.assertEquals([events.BlipSubmitted.type], self.called)
+    self.assertEquals(1, len(self.relay.posted))
+    port, bundle = self.relay.posted[0]
+    self.assertEquals([events.WaveletParticipantsChanged.type],
+                      [e['type'] for e in bundle['events']])
+
+  def testPerRobot(self):
+    def reply(event, wavelet):
+      wavelet.title = 'local title'
+
+    self.robot.register_handler(events.WaveletParticipantsChanged, reply)
+    self.robot.dispatch_locally()
+    json = self.robot.process_events(PROXYING_JSON)
+    self.assertEquals([events.BlipSubmitted.type,
+                       events.WaveletParticipantsChanged.type], self.called)
+    self.assertEquals([], self.relay.posted)
+    methods = [op['method'] for op in simplejson.loads(json)]
+    self.assertEquals([ops.ROBOT_NOTIFY_CAPABILITIES_HASH,
+                       ops.WAVELET_SET_TITLE], methods)
+
+  def testFilteredHandlers(self):
+    def annotation_event(name):
+      return ('{"blips":%s,"wavelet":%s,"events":[{"timestamp":1,'
+              '"modifiedBy":"someguy@test.com","type":"ANNOTATED_TEXT_CHANGED",'
+              '"properties":{"blipId":"wdykLROk*13","name":"%s","value":"x"}}]}'
+              % (BLIP_JSON, WAVELET_JSON, name))
+
+    evaluated = []
+    self.robot.register_handler(events.AnnotatedTextChanged,
+                                lambda e, w: evaluated.append(e.name),
+                                filter='we/eval')
+    self.robot.register_handler(events.AnnotatedTextChanged,
+                                lambda e, w: self.called.append(e.name))
+    self.robot.process_events(annotation_event('we/eval'))
+    self.robot.process_events(annotation_event('we/evaluated'))
+    self.assertEquals(['we/eval'], evaluated)
+    self.assertEquals(['we/eval', 'we/evaluated'], self.called)
+
+
 class TestGetCapabilitiesXml(unittest.TestCase):
 
   def setUp(self):
@@ -184,5 +406,41 @@ class TestGetCapabilitiesXml(unittest.TestCase):
     self.assertStringsEqual(expected, xml)
 
 
+class TestCachedResponses(unittest.TestCase):
+
+  def setUp(self):
+    self.robot = robot.Robot('Testy')
+
+  def testCapabilitiesCachedUntilRegister(self):
+    xml = self.robot.capabilities_xml()
+    etag = self.robot.capabilities_etag()
+    self.assertTrue(xml is self.robot.capabilities_xml())
+    self.assertEquals(etag, self.robot.capabilities_etag())
+    self.robot.register_handler(events.BlipSubmitted, None)
+    self.assertTrue(events.BlipSubmitted.type in self.robot.capabilities_xml())
+    self.assertNotEquals(etag, self.robot.capabilities_etag())
+    self.assertTrue(self.robot.capabilities_etag().startswith(
+        '"%s-' % self.robot.capabilities_hash()))
+
+  def testProfile(self):
+    profile = self.robot.profile_json()
+    etag = self.robot.profile_etag()
+    self.assertTrue(profile is self.robot.profile_json())
+    self.assertEquals('Testy', simplejson.loads(profile)['name'])
+    self.robot.register_profile_handler(lambda name: {'name': name})
+    self.assertEquals(None, self.robot.profile_etag())
+    self.assertEquals({'name': 'other'},
+                      simplejson.loads(self.robot.profile_json('other')))
+    self.robot.register_profile_handler(None)
+    self.assertEquals(etag, self.robot.profile_etag())
+
+  def testEtagMatches(self):
+    self.assertTrue(robot.etag_matches('"a", "b"', '"b"'))
+    self.assertTrue(robot.etag_matches('*', '"b"'))
+    self.assertFalse(robot.etag_matches('"a"', '"b"'))
+    self.assertFalse(robot.etag_matches(None, '"b"'))
+    self.assertFalse(robot.etag_matches('*', None))
+
+
 if __name__ == '__main__':
   unittest.main()
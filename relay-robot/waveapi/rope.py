@@ -0,0 +1,230 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rope used to store the text of a blip.
+
+The text is kept in the leaves of a height balanced binary tree. Nodes
+are never changed once built, so an edit only creates the O(log n)
+nodes on the path to the edited position and copying a rope is free.
+"""
+
+# Leaves are merged with their neighbours while they stay below this size.
+LEAF_SIZE = 256
+
+
+class _Leaf(object):
+
+  height = 0
+
+  def __init__(self, text):
+    self.text = text
+    self.length = len(text)
+
+
+class _Node(object):
+
+  def __init__(self, left, right):
+    self.left = left
+    self.right = right
+    self.length = left.length + right.length
+    self.height = max(left.height, right.height) + 1
+
+
+def _rotate_left(node):
+  right = node.right
+  return _Node(_Node(node.left, right.left), right.right)
+
+
+def _rotate_right(node):
+  left = node.left
+  return _Node(left.left, _Node(left.right, node.right))
+
+
+def _balance(node):
+  """Restores the balance of a node whose children differ at most 2."""
+  diff = node.left.height - node.right.height
+  if diff > 1:
+    if node.left.left.height < node.left.right.height:
+      node = _Node(_rotate_left(node.left), node.right)
+    return _rotate_right(node)
+  if diff < -1:
+    if node.right.right.height < node.right.left.height:
+      node = _Node(node.left, _rotate_right(node.right))
+    return _rotate_left(node)
+  return node
+
+
+def _join(left, right):
+  """Concatenates two trees, either of which may be None."""
+  if left is None:
+    return right
+  if right is None:
+    return left
+  if left.height > right.height + 1:
+    return _balance(_Node(left.left, _join(left.right, right)))
+  if right.height > left.height + 1:
+    return _balance(_Node(_join(left, right.left), right.right))
+  if (left.height == 0 and right.height == 0 and
+      left.length + right.length <= LEAF_SIZE):
+    return _Leaf(left.text + right.text)
+  return _Node(left, right)
+
+
+def _split(node, index):
+  """Splits a tree in the parts before and after index."""
+  if node is None:
+    return None, None
+  if node.height == 0:
+    left = node.text[:index]
+    right = node.text[index:]
+    return left and _Leaf(left) or None, right and _Leaf(right) or None
+  if index < node.left.length:
+    left, right = _split(node.left, index)
+    return left, _join(right, node.right)
+  if index > node.left.length:
+    left, right = _split(node.right, index - node.left.length)
+    return _join(node.left, left), right
+  return node.left, node.right
+
+
+def _from_text(text):
+  """Builds a balanced tree out of a string."""
+  if not text:
+    return None
+  leaves = [_Leaf(text[i:i + LEAF_SIZE])
+            for i in range(0, len(text), LEAF_SIZE)]
+  while len(leaves) > 1:
+    paired = [_join(leaves[i], leaves[i + 1])
+              for i in range(0, len(leaves) - 1, 2)]
+    if len(leaves) % 2:
+      paired[-1] = _join(paired[-1], leaves[-1])
+    leaves = paired
+  return leaves[0]
+
+
+class Rope(object):
+  """Mutable text supporting edits in logarithmic time.
+
+  Slicing a rope and converting it with text returns a plain string of
+  the same type as the text that was put in.
+  """
+
+  def __init__(self, text=''):
+    self._empty = text[:0]
+    self._root = _from_text(text)
+    self._text = text
+
+  def __len__(self):
+    if self._root is None:
+      return 0
+    return self._root.length
+
+  @property
+  def text(self):
+    """The contents of the rope as a single string."""
+    if self._text is None:
+      self._text = self._empty.join(self.pieces(0, len(self)))
+    return self._text
+
+  def copy(self):
+    """Returns a rope with the same text that can be edited independently."""
+    res = Rope(self._empty)
+    res._root = self._root
+    res._text = self._text
+    return res
+
+  def pieces(self, start=0, end=None):
+    """Yields the parts of the leaves between start and end."""
+    if end is None:
+      end = len(self)
+    stack = []
+    node = self._root
+    offset = 0
+    while node is not None or stack:
+      if node is None:
+        node, offset = stack.pop()
+      if offset >= end or offset + node.length <= start:
+        node = None
+      elif node.height == 0:
+        yield node.text[max(start - offset, 0):end - offset]
+        node = None
+      else:
+        stack.append((node.right, offset + node.left.length))
+        node = node.left
+
+  def __getitem__(self, item):
+    if isinstance(item, slice):
+      if item.step is not None:
+        raise ValueError('Step not supported for rope slices')
+      start, end, _ = item.indices(len(self))
+      if self._text is not None:
+        return self._text[start:end]
+      if end <= start:
+        return self._empty
+      return self._empty.join(self.pieces(start, end))
+    if item < 0:
+      item += len(self)
+    if item < 0 or item >= len(self):
+      raise IndexError('Rope index out of range')
+    return self[item:item + 1]
+
+  def replace(self, start, end, text):
+    """Replaces the text between start and end with text."""
+    self._text = None
+    left, rest = _split(self._root, start)
+    _, right = _split(rest, end - start)
+    self._root = _join(_join(left, _from_text(text)), right)
+
+  def insert(self, index, text):
+    """Inserts text at index."""
+    self.replace(index, index, text)
+
+  def delete(self, start, end):
+    """Removes the text between start and end."""
+    self.replace(start, end, self._empty)
+
+  def append(self, text):
+    """Adds text to the end."""
+    self.replace(len(self), len(self), text)
+
+  def find(self, what, start=0):
+    """Returns the lowest index of what at or after start, or -1.
+
+    Only the leaves from start up to the match are looked at, so
+    searching onwards from a previous match does not rescan the text
+    before it.
+    """
+    if self._text is not None:
+      return self._text.find(what, start)
+    if start < 0:
+      start = max(start + len(self), 0)
+    if not what:
+      if start <= len(self):
+        return start
+      return -1
+    overlap = len(what) - 1
+    # Text of the previous leaves that a match could start in.
+    carry = self._empty
+    carry_start = start
+    for piece in self.pieces(start, len(self)):
+      window = carry + piece
+      idx = window.find(what)
+      if idx != -1:
+        return carry_start + idx
+      if overlap:
+        carry = window[-overlap:]
+      carry_start += len(window) - len(carry)
+    return -1
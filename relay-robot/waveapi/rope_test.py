@@ -0,0 +1,94 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the rope module."""
+
+
+import random
+import unittest
+
+import rope
+
+
+class TestRope(unittest.TestCase):
+
+  def setUp(self):
+    self.leaf_size = rope.LEAF_SIZE
+    # Small leaves so the tests exercise the tree rather than one leaf.
+    rope.LEAF_SIZE = 4
+
+  def tearDown(self):
+    rope.LEAF_SIZE = self.leaf_size
+
+  def assertBalanced(self, node):
+    if node is None or node.height == 0:
+      return
+    self.assertTrue(abs(node.left.height - node.right.height) <= 1)
+    self.assertBalanced(node.left)
+    self.assertBalanced(node.right)
+
+  def testEdits(self):
+    r = rope.Rope(u'hello world')
+    r.replace(6, 11, u'jupiter')
+    self.assertEquals(u'hello jupiter', r.text)
+    r.delete(0, 6)
+    r.insert(0, u'hi ')
+    r.append(u'!')
+    self.assertEquals(u'hi jupiter!', r.text)
+    self.assertEquals(11, len(r))
+    self.assertEquals(u'jup', r[3:6])
+    self.assertEquals(u'!', r[-1])
+    self.assertEquals(u'', r[6:3])
+    self.assertRaises(IndexError, r.__getitem__, 11)
+
+  def testFind(self):
+    r = rope.Rope(u'abcabcabc')
+    r.insert(0, u'x')
+    self.assertEquals(1, r.find(u'abc'))
+    self.assertEquals(4, r.find(u'abc', 2))
+    # Matches spanning several leaves are found.
+    self.assertEquals(3, r.find(u'cabca'))
+    self.assertEquals(-1, r.find(u'abcd'))
+    self.assertEquals(7, r.find(u'abc', -3))
+
+  def testCopyIsIndependent(self):
+    r = rope.Rope('some text')
+    c = r.copy()
+    c.append(' more')
+    self.assertEquals('some text', r.text)
+    self.assertEquals('some text more', c.text)
+
+  def testMatchesString(self):
+    rand = random.Random(42)
+    s = u'the quick brown fox'
+    r = rope.Rope(s)
+    for i in range(500):
+      start = rand.randint(0, len(s))
+      end = rand.randint(start, len(s))
+      text = u''.join([rand.choice(u'ab ') for j in range(rand.randint(0, 8))])
+      s = s[:start] + text + s[end:]
+      r.replace(start, end, text)
+      self.assertEquals(len(s), len(r))
+      what = rand.choice([u'a', u'ab', u'b a', u'fox'])
+      start = rand.randint(0, len(s))
+      self.assertEquals(s.find(what, start), r.find(what, start))
+      self.assertEquals(s[start:start + 7], r[start:start + 7])
+      self.assertBalanced(r._root)
+    self.assertEquals(s, r.text)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -17,25 +17,49 @@
 """Script to run all unit tests in this package."""
 
 
+import async_robot_runner_test
 import blip_test
 import element_test
+import lazyjson_test
+import logs_test
 import module_test_runner
 import ops_test
+import positions_test
+import relay_test
 import robot_test
+import rope_test
+import signing_test
+import simplejson_test
+import submission_test
+import textsearch_test
 import util_test
 import wavelet_test
+import workers_test
+import wsgi_robot_runner_test
 
 
 def RunUnitTests():
   """Runs all registered unit tests."""
   test_runner = module_test_runner.ModuleTestRunner()
   test_runner.modules = [
+      async_robot_runner_test,
       blip_test,
       element_test,
+      lazyjson_test,
+      logs_test,
       ops_test,
+      positions_test,
+      relay_test,
       robot_test,
+      rope_test,
+      signing_test,
+      simplejson_test,
+      submission_test,
+      textsearch_test,
       util_test,
       wavelet_test,
+      workers_test,
+      wsgi_robot_runner_test,
   ]
   test_runner.RunAllTests()
 
@@ -0,0 +1,140 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""OAuth signing of the rpcs a robot sends.
+
+The robot always posts to the same url with the same consumer, so most
+of what the oauth module works out for every request never changes.
+RpcSigner does that work once; signing a request then only escapes the
+timestamp, nonce and body hash and feeds the base string to a copy of a
+prepared HMAC-SHA1 object. The signatures are the ones the oauth module
+computes for the same request.
+"""
+
+import base64
+import cgi
+import hmac
+import random
+import time
+import urllib
+import urlparse
+
+try:
+  import hashlib  # 2.5
+  _sha1 = hashlib.sha1
+except ImportError:
+  import sha  # deprecated
+  _sha1 = sha
+
+OAUTH_VERSION = '1.0'
+SIGNATURE_METHOD = 'HMAC-SHA1'
+
+# Parameters that differ for every request.
+_DYNAMIC_PARAMETERS = ('oauth_body_hash', 'oauth_nonce', 'oauth_timestamp')
+
+
+def _escape(s):
+  """Escapes like oauth.escape, so '/' is escaped too."""
+  return urllib.quote(s, safe='~')
+
+
+def generate_timestamp():
+  return int(time.time())
+
+
+def generate_nonce(length=8):
+  return ''.join([str(random.randint(0, 9)) for i in range(length)])
+
+
+class RpcSigner(object):
+  """Signs requests to a fixed url with HMAC-SHA1 for a fixed consumer."""
+
+  def __init__(self, consumer_key, consumer_secret, url, http_method='POST'):
+    """Precomputes everything that is the same for all requests.
+
+    Args:
+      consumer_key: the oauth_consumer_key to send.
+      consumer_secret: the secret of the consumer.
+      url: the url requests are sent to. Parameters in its query string
+          are signed as well.
+      http_method: the method requests are sent with.
+    """
+    scheme, netloc, path, _, query, _ = urlparse.urlparse(url)
+    self._url = '%s://%s%s' % (scheme, netloc, path)
+    parameters = {
+        'oauth_consumer_key': consumer_key,
+        'oauth_signature_method': SIGNATURE_METHOD,
+        'oauth_version': OAUTH_VERSION,
+    }
+    for key, values in cgi.parse_qs(query).items():
+      parameters[key] = urllib.unquote(values[0])
+    for key in _DYNAMIC_PARAMETERS:
+      parameters.pop(key, None)
+    static_pairs = ['%s=%s' % (_escape(str(key)), _escape(str(value)))
+                    for key, value in parameters.items()]
+    self._static_query = '&'.join(static_pairs)
+
+    # The base string is the escaped method, url and sorted parameters,
+    # which is cut into the escaped text around each dynamic parameter.
+    keys = sorted(list(parameters.keys()) + list(_DYNAMIC_PARAMETERS))
+    self._template = []
+    text = _escape(http_method.upper()) + '&' + _escape(self._url) + '&'
+    separator = ''
+    for key in keys:
+      text += _escape(separator + _escape(str(key)) + '=')
+      if key in _DYNAMIC_PARAMETERS:
+        self._template.append((text, key))
+        text = ''
+      else:
+        text += _escape(_escape(str(parameters[key])))
+      separator = '&'
+    self._template_end = text
+
+    key = '%s&' % _escape(consumer_secret)
+    self._hmac = hmac.new(key, digestmod=_sha1)
+
+  def signature(self, body_hash, timestamp, nonce):
+    """Returns the oauth_signature of a request."""
+    values = {'oauth_body_hash': body_hash,
+              'oauth_nonce': nonce,
+              'oauth_timestamp': timestamp}
+    parts = []
+    for text, key in self._template:
+      parts.append(text)
+      parts.append(_escape(_escape(str(values[key]))))
+    parts.append(self._template_end)
+    hashed = self._hmac.copy()
+    hashed.update(''.join(parts))
+    return base64.b64encode(hashed.digest())
+
+  def sign(self, body_hash, timestamp=None, nonce=None):
+    """Returns the signed url to post a body with the given hash to.
+
+    Args:
+      body_hash: the base64 encoded SHA-1 hash of the body.
+      timestamp: the oauth_timestamp; the current time by default.
+      nonce: the oauth_nonce; a random one by default.
+    """
+    if timestamp is None:
+      timestamp = generate_timestamp()
+    if nonce is None:
+      nonce = generate_nonce()
+    signature = self.signature(body_hash, timestamp, nonce)
+    return ('%s?%s&oauth_body_hash=%s&oauth_nonce=%s&oauth_timestamp=%s'
+            '&oauth_signature=%s' % (self._url, self._static_query,
+                                     _escape(body_hash), _escape(str(nonce)),
+                                     _escape(str(timestamp)),
+                                     _escape(signature)))
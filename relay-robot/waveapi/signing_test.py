@@ -0,0 +1,85 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the signing module."""
+
+
+import cgi
+import unittest
+import urlparse
+
+import oauth
+import signing
+
+
+def oauth_module_url(key, secret, url, body_hash, timestamp, nonce):
+  """Signs a request the way Robot.make_rpc did with the oauth module."""
+  params = {
+    'oauth_consumer_key': key,
+    'oauth_timestamp': timestamp,
+    'oauth_nonce': nonce,
+    'oauth_version': oauth.OAuthRequest.version,
+    'oauth_body_hash': body_hash,
+  }
+  oauth_request = oauth.OAuthRequest.from_request('POST', url,
+                                                  parameters=params)
+  oauth_request.sign_request(oauth.OAuthSignatureMethod_HMAC_SHA1(),
+                             oauth.OAuthConsumer(key, secret), None)
+  return oauth_request.to_url()
+
+
+def split_url(url):
+  scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+  return '%s://%s%s' % (scheme, netloc, path), cgi.parse_qs(query)
+
+
+class TestRpcSigner(unittest.TestCase):
+
+  def assertSameAsOAuthModule(self, key, secret, url, body_hash):
+    signer = signing.RpcSigner(key, secret, url)
+    for timestamp, nonce in [(1250000000, '01234567'), (1, '9')]:
+      expected = oauth_module_url(key, secret, url, body_hash, timestamp,
+                                  nonce)
+      actual = signer.sign(body_hash, timestamp, nonce)
+      self.assertEquals(split_url(expected), split_url(actual))
+
+  def testSameAsOAuthModule(self):
+    self.assertSameAsOAuthModule('google.com:robot@appspot.com', 'secret',
+                                 'http://gmodules.com/api/rpc',
+                                 '2jmj7l5rSw0yVb/vlWAYkK/YBwk=')
+
+  def testEscapedValues(self):
+    self.assertSameAsOAuthModule('google.com:a b&c', 's/e+c=r~e t',
+                                 'https://sandbox.gmodules.com/api/rpc',
+                                 '+/=+/=')
+
+  def testQueryParametersSigned(self):
+    self.assertSameAsOAuthModule('google.com:robot', 'secret',
+                                 'http://gmodules.com/api/rpc?v=2&z=a%20b',
+                                 'hash=')
+
+  def testDefaultTimestampAndNonce(self):
+    signer = signing.RpcSigner('key', 'secret', 'http://example.com/rpc')
+    url, params = split_url(signer.sign('hash='))
+    self.assertEquals('http://example.com/rpc', url)
+    self.assertEquals(8, len(params['oauth_nonce'][0]))
+    expected = signer.signature('hash=', params['oauth_timestamp'][0],
+                                params['oauth_nonce'][0])
+    self.assertEquals([expected], params['oauth_signature'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -101,7 +101,7 @@ __version__ = '2.1.0'
 __all__ = [
     'dump', 'dumps', 'load', 'loads',
     'JSONDecoder', 'JSONDecodeError', 'JSONEncoder',
-    'OrderedDict',
+    'OrderedDict', 'toggle_speedups', 'speedups_info',
 ]
 
 __author__ = 'Bob Ippolito <bob@redivi.com>'
@@ -368,16 +368,13 @@ def loads(s, encoding=None, cls=None, object_hook=None, parse_float=None,
 
 
 def _toggle_speedups(enabled):
-    import simplejson.decoder as dec
-    import simplejson.encoder as enc
-    import simplejson.scanner as scan
-    try:
-        from simplejson._speedups import make_encoder as c_make_encoder
-    except ImportError:
-        c_make_encoder = None
+    import decoder as dec
+    import encoder as enc
+    import scanner as scan
+    import speedups
     if enabled:
         dec.scanstring = dec.c_scanstring or dec.py_scanstring
-        enc.c_make_encoder = c_make_encoder
+        enc.c_make_encoder = speedups.c_make_encoder
         enc.encode_basestring_ascii = (enc.c_encode_basestring_ascii or 
             enc.py_encode_basestring_ascii)
         scan.make_scanner = scan.c_make_scanner or scan.py_make_scanner
@@ -403,4 +400,29 @@ def _toggle_speedups(enabled):
        separators=None,
        encoding='utf-8',
        default=None,
-   )
\ No newline at end of file
+   )
+
+
+toggle_speedups = _toggle_speedups
+
+
+def speedups_info():
+    """Return which of the accelerated code paths are currently active.
+
+    The result maps ``'module'`` to the name of the C accelerator that was
+    found (``'_speedups'``, ``'_json'`` or ``None``) and each accelerated
+    function to whether it is the one in use. Use :func:`toggle_speedups`
+    to switch between the C and the pure-Python paths, e.g. to benchmark.
+    """
+    import decoder as dec
+    import encoder as enc
+    import scanner as scan
+    import speedups
+    return {
+        'module': speedups.SPEEDUPS_MODULE,
+        'scanstring': dec.scanstring is not dec.py_scanstring,
+        'make_scanner': dec.make_scanner is not scan.py_make_scanner,
+        'encode_basestring_ascii': (
+            enc.encode_basestring_ascii is not enc.py_encode_basestring_ascii),
+        'make_encoder': enc.c_make_encoder is not None,
+    }
@@ -5,10 +5,7 @@ import sys
 import struct
 
 from scanner import make_scanner
-try:
-    from _speedups import scanstring as c_scanstring
-except ImportError:
-    c_scanstring = None
+from speedups import c_scanstring
 
 __all__ = ['JSONDecoder']
 
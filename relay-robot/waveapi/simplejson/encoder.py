@@ -2,15 +2,7 @@
 """
 import re
 
-try:
-    from _speedups import encode_basestring_ascii as \
-        c_encode_basestring_ascii
-except ImportError:
-    c_encode_basestring_ascii = None
-try:
-    from _speedups import make_encoder as c_make_encoder
-except ImportError:
-    c_make_encoder = None
+from speedups import c_encode_basestring_ascii, c_make_encoder
 
 from decoder import PosInf
 
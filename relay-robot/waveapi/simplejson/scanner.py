@@ -1,10 +1,7 @@
 """JSON token scanner
 """
 import re
-try:
-    from simplejson._speedups import make_scanner as c_make_scanner
-except ImportError:
-    c_make_scanner = None
+from speedups import c_make_scanner
 
 __all__ = ['make_scanner']
 
@@ -0,0 +1,28 @@
+"""Locate the optional C accelerator for simplejson.
+
+The package's own compiled ``_speedups`` extension is used when it has
+been built next to this module. Otherwise the ``_json`` extension that
+ships with CPython 2.7 is used; it is the same accelerator merged into
+the standard library and implements the same interface. Without either
+of them the pure-Python implementation is used.
+"""
+
+__all__ = [
+    'SPEEDUPS_MODULE', 'c_scanstring', 'c_make_scanner',
+    'c_encode_basestring_ascii', 'c_make_encoder',
+]
+
+def _load():
+    for name in ('_speedups', '_json'):
+        try:
+            return name, __import__(name, globals(), locals(), [])
+        except ImportError:
+            pass
+    return None, None
+
+SPEEDUPS_MODULE, _module = _load()
+c_scanstring = getattr(_module, 'scanstring', None)
+c_make_scanner = getattr(_module, 'make_scanner', None)
+c_encode_basestring_ascii = getattr(_module, 'encode_basestring_ascii', None)
+c_make_encoder = getattr(_module, 'make_encoder', None)
+del _module
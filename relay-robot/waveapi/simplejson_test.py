@@ -0,0 +1,61 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the accelerator switch of the vendored simplejson."""
+
+
+import unittest
+
+import simplejson
+
+TEST_DATA = {'blips': {'b+1': {'content': u'\nhello \u05e9 "world"\t',
+                               'lastModifiedTime': 1242079608457,
+                               'elements': {},
+                               'parentBlipId': None}},
+             'events': [{'type': 'BLIP_SUBMITTED', 'ratio': 0.25}],
+             'flags': [True, False]}
+
+
+class TestSpeedups(unittest.TestCase):
+
+  def tearDown(self):
+    simplejson.toggle_speedups(True)
+
+  def testToggle(self):
+    info = simplejson.speedups_info()
+    available = info['module'] is not None
+    self.assertEquals(available, info['scanstring'])
+    simplejson.toggle_speedups(False)
+    info = simplejson.speedups_info()
+    self.assertFalse(info['scanstring'])
+    self.assertFalse(info['make_scanner'])
+    self.assertFalse(info['encode_basestring_ascii'])
+    self.assertFalse(info['make_encoder'])
+    simplejson.toggle_speedups(True)
+    self.assertEquals(available, simplejson.speedups_info()['scanstring'])
+
+  def testSameOutputOnBothPaths(self):
+    results = []
+    for enabled in (True, False):
+      simplejson.toggle_speedups(enabled)
+      encoded = simplejson.dumps(TEST_DATA)
+      results.append((encoded, simplejson.loads(encoded)))
+    self.assertEquals(results[0], results[1])
+    self.assertEquals(TEST_DATA, results[0][1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,309 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scheduling of the submission of operations to the wave server.
+
+Robot.submit makes a round trip to the server per wavelet. A robot that
+touches many waves at once, say from several threads, can instead
+submit through an RpcBatcher, which sends the operations of all
+wavelets submitted within a short window as a single rpc.
+
+Handlers that do not need the answer of the server can submit through a
+SubmissionQueue, which returns right away and leaves the rpc to
+background threads.
+"""
+
+import os
+import Queue
+import threading
+import time
+
+import errors
+import logs
+import simplejson
+
+_log = logs.get('rpc')
+
+# Seconds the first submission of a batch waits for others to join it.
+DEFAULT_WINDOW = 0.05
+# Number of operations at which a batch is sent without waiting longer.
+DEFAULT_MAX_OPERATIONS = 100
+
+# Defaults of SubmissionQueue.
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+
+
+class _Batch(object):
+  """Wavelets that are sent together and what the server answered."""
+
+  def __init__(self):
+    self.wavelets = []
+    self.operation_count = 0
+    self.results = None
+    self.error = None
+    self.full = threading.Event()
+    self.done = threading.Event()
+
+
+class RpcBatcher(object):
+  """Gathers submissions from several threads into one rpc.
+
+  submit blocks like Robot.submit. The first submission of a batch waits
+  for window seconds, or until max_operations operations have joined,
+  and then the whole batch is sent with Robot.submit_many. Every caller
+  gets the results of its own operations.
+  """
+
+  def __init__(self, robot, window=DEFAULT_WINDOW,
+               max_operations=DEFAULT_MAX_OPERATIONS):
+    self._robot = robot
+    self._window = window
+    self._max_operations = max_operations
+    self._batch = None
+    self._lock = threading.Lock()
+
+  def _detach(self, batch):
+    """Returns whether batch was still open; it is closed afterwards."""
+    self._lock.acquire()
+    try:
+      if self._batch is not batch:
+        return False
+      self._batch = None
+      return True
+    finally:
+      self._lock.release()
+
+  def _send(self, batch):
+    try:
+      try:
+        batch.results = self._robot.submit_many(batch.wavelets)
+      except Exception, e:
+        batch.error = e
+    finally:
+      batch.done.set()
+
+  def submit(self, wavelet):
+    """Submits the pending operations of wavelet as part of a batch.
+
+    Returns:
+      The list of results the server returned for the operations.
+
+    Raises:
+      Whatever the rpc of the batch raised.
+    """
+    self._lock.acquire()
+    try:
+      batch = self._batch
+      leader = batch is None
+      if leader:
+        batch = self._batch = _Batch()
+      index = len(batch.wavelets)
+      batch.wavelets.append(wavelet)
+      batch.operation_count += len(wavelet.get_operation_queue())
+      if batch.operation_count >= self._max_operations:
+        batch.full.set()
+    finally:
+      self._lock.release()
+
+    if leader or batch.full.isSet():
+      batch.full.wait(self._window)
+      if self._detach(batch):
+        self._send(batch)
+    batch.done.wait()
+    if batch.error is not None:
+      raise batch.error
+    return batch.results[index]
+
+  def flush(self):
+    """Sends the open batch right away instead of at the end of its window."""
+    self._lock.acquire()
+    try:
+      if self._batch is not None:
+        self._batch.full.set()
+    finally:
+      self._lock.release()
+
+
+class SubmissionQueue(object):
+  """Submits operations from background threads.
+
+  submit takes the pending operations off a wavelet and returns at once.
+  A fixed number of worker threads sends them, retrying failed rpcs with
+  exponential backoff. Only network errors and 5xx answers are retried;
+  rpcs the server rejects otherwise are logged and dropped, as sending
+  them again would not help. Rpcs that still fail after max_attempts,
+  and those still queued when the queue is closed, are appended to the
+  spool file if one is given, one json encoded rpc per line.
+  resubmit_spooled puts them back in the queue, for instance after a
+  restart.
+  """
+
+  def __init__(self, robot, workers=DEFAULT_WORKERS,
+               max_attempts=DEFAULT_MAX_ATTEMPTS, backoff=DEFAULT_BACKOFF,
+               max_backoff=DEFAULT_MAX_BACKOFF, spool_path=None):
+    """Initializes the queue; the workers start on the first submit.
+
+    Args:
+      robot: the robot to submit with.
+      workers: number of rpcs that are in flight at most.
+      max_attempts: number of times an rpc is tried before it is spooled.
+      backoff: seconds to wait before the first retry. The wait doubles
+          with every further retry.
+      max_backoff: maximum number of seconds to wait before a retry.
+      spool_path: file undelivered rpcs are appended to, or None to drop
+          them.
+    """
+    self._robot = robot
+    self._workers = workers
+    self._max_attempts = max_attempts
+    self._backoff = backoff
+    self._max_backoff = max_backoff
+    self._spool_path = spool_path
+    self._queue = Queue.Queue()
+    self._threads = []
+    self._lock = threading.Lock()
+
+  def _start(self):
+    self._lock.acquire()
+    try:
+      while len(self._threads) < self._workers:
+        thread = threading.Thread(target=self._work)
+        thread.setDaemon(True)
+        thread.start()
+        self._threads.append(thread)
+    finally:
+      self._lock.release()
+
+  def submit(self, wavelet):
+    """Queues the pending operations of wavelet for submission."""
+    rpcs = self._robot.serialize_rpcs(wavelet)
+    if rpcs:
+      self._start()
+      self._queue.put(rpcs)
+
+  def _work(self):
+    while True:
+      rpcs = self._queue.get()
+      try:
+        if rpcs is None:
+          return
+        self._deliver(rpcs)
+      finally:
+        self._queue.task_done()
+
+  def _deliver(self, rpcs):
+    delay = self._backoff
+    for attempt in range(1, self._max_attempts + 1):
+      try:
+        res = self._robot.make_rpc(rpcs)
+        _log.info('submit returned:%s', logs.Payload(res))
+        return
+      except errors.ResponseError, e:
+        # The server has applied the operations, sending them again would
+        # apply them twice.
+        _log.error('Dropping the answer to a delivered rpc: %s', e)
+        return
+      except IOError, e:
+        # HttpError, or urllib2.HTTPError from a replaced http_post.
+        code = getattr(e, 'code', None)
+        if code is not None and code < 500:
+          _log.error('Dropping rpc the server rejected: %s', e)
+          return
+        _log.warning('Submission attempt %d failed: %s', attempt, e)
+      except Exception:
+        _log.exception('Submission failed')
+        break
+      if attempt < self._max_attempts:
+        time.sleep(delay)
+        delay = min(delay * 2, self._max_backoff)
+    self._spool([rpcs])
+
+  def _spool(self, rpcs_list):
+    if self._spool_path is None:
+      _log.error('Dropping %d undelivered rpcs', len(rpcs_list))
+      return
+    self._lock.acquire()
+    try:
+      spool = open(self._spool_path, 'a')
+      try:
+        for rpcs in rpcs_list:
+          spool.write(simplejson.dumps(rpcs) + '\n')
+      finally:
+        spool.close()
+    finally:
+      self._lock.release()
+
+  def resubmit_spooled(self):
+    """Queues the rpcs from the spool file again and empties it.
+
+    Returns:
+      The number of rpcs queued.
+    """
+    if self._spool_path is None:
+      return 0
+    self._lock.acquire()
+    try:
+      if not os.path.exists(self._spool_path):
+        return 0
+      spool = open(self._spool_path)
+      try:
+        lines = spool.readlines()
+      finally:
+        spool.close()
+      os.remove(self._spool_path)
+    finally:
+      self._lock.release()
+    count = 0
+    for line in lines:
+      if line.strip():
+        self._start()
+        self._queue.put(simplejson.loads(line))
+        count += 1
+    return count
+
+  def join(self):
+    """Blocks until everything submitted so far is delivered or spooled."""
+    self._queue.join()
+
+  def close(self):
+    """Spools what is still queued and stops the workers.
+
+    Rpcs that are being sent are finished first.
+    """
+    undelivered = []
+    while True:
+      try:
+        rpcs = self._queue.get_nowait()
+      except Queue.Empty:
+        break
+      self._queue.task_done()
+      if rpcs is not None:
+        undelivered.append(rpcs)
+    if undelivered:
+      self._spool(undelivered)
+    self._lock.acquire()
+    try:
+      threads = self._threads
+      self._threads = []
+    finally:
+      self._lock.release()
+    for thread in threads:
+      self._queue.put(None)
+    for thread in threads:
+      thread.join()
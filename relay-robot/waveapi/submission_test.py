@@ -0,0 +1,223 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the submission module."""
+
+
+import os
+import tempfile
+import threading
+import unittest
+
+import errors
+import robot
+import robot_test
+import submission
+
+
+class FakeRpcRobot(robot.Robot):
+  """Robot answering rpcs itself, recording the operations of each."""
+
+  def __init__(self):
+    robot.Robot.__init__(self, 'Testy')
+    self.rpcs = []
+    self.fail = False
+
+  def make_rpc(self, operations):
+    self.rpcs.append([op.id for op in operations])
+    if self.fail:
+      raise IOError('HttpError 500')
+    return [{'id': op.id, 'data': {'title': op.params.get('waveletTitle')}}
+            for op in operations]
+
+
+class TestRpcBatcher(unittest.TestCase):
+
+  def setUp(self):
+    self.robot = FakeRpcRobot()
+
+  def wavelet(self, title):
+    wavelet = self.robot.blind_wavelet(robot_test.TEST_JSON)
+    wavelet.title = title
+    return wavelet
+
+  def submitAll(self, batcher, wavelets):
+    results = [None] * len(wavelets)
+
+    def submit(index):
+      try:
+        results[index] = batcher.submit(wavelets[index])
+      except IOError, e:
+        results[index] = e
+
+    threads = [threading.Thread(target=submit, args=(i,))
+               for i in range(len(wavelets))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def testConcurrentSubmissionsShareAnRpc(self):
+    batcher = submission.RpcBatcher(self.robot, window=5, max_operations=4)
+    wavelets = [self.wavelet('title %d' % i) for i in range(4)]
+    results = self.submitAll(batcher, wavelets)
+    self.assertEquals(1, len(self.robot.rpcs))
+    self.assertEquals(4, len(self.robot.rpcs[0]))
+    for i, result in enumerate(results):
+      self.assertEquals([{'title': 'title %d' % i}],
+                        [r['data'] for r in result])
+    for wavelet in wavelets:
+      self.assertEquals(0, len(wavelet.get_operation_queue()))
+
+  def testWindowEnds(self):
+    batcher = submission.RpcBatcher(self.robot, window=0.01)
+    self.assertEquals(1, len(batcher.submit(self.wavelet('first'))))
+    self.assertEquals(1, len(batcher.submit(self.wavelet('second'))))
+    self.assertEquals(2, len(self.robot.rpcs))
+
+  def testErrorsReachEveryCaller(self):
+    self.robot.fail = True
+    batcher = submission.RpcBatcher(self.robot, window=5, max_operations=2)
+    results = self.submitAll(batcher, [self.wavelet('a'), self.wavelet('b')])
+    self.assertEquals(1, len(self.robot.rpcs))
+    for result in results:
+      self.assertTrue(isinstance(result, IOError))
+
+
+class QueueRobot(robot.Robot):
+  """Robot whose rpcs fail a given number of times before succeeding."""
+
+  def __init__(self, failures=0, code=503):
+    robot.Robot.__init__(self, 'Testy')
+    self.failures = failures
+    self.code = code
+    self.attempts = []
+    self.delivered = []
+    self.release = threading.Event()
+    self.release.set()
+
+  def make_rpc(self, operations):
+    self.release.wait()
+    self.attempts.append(operations)
+    if self.failures:
+      self.failures -= 1
+      if self.code == 200:
+        raise errors.ResponseError('garbage')
+      raise errors.HttpError(self.code)
+    self.delivered.append(operations)
+    return [{'id': op['id'], 'data': {}} for op in operations]
+
+
+class TestSubmissionQueue(unittest.TestCase):
+
+  def setUp(self):
+    handle, self.spool_path = tempfile.mkstemp()
+    os.close(handle)
+    os.remove(self.spool_path)
+
+  def tearDown(self):
+    if os.path.exists(self.spool_path):
+      os.remove(self.spool_path)
+
+  def wavelet(self, submitter, title):
+    wavelet = submitter.blind_wavelet(robot_test.TEST_JSON)
+    wavelet.title = title
+    return wavelet
+
+  def spooled(self):
+    if not os.path.exists(self.spool_path):
+      return []
+    return open(self.spool_path).readlines()
+
+  def testSubmitReturnsAtOnce(self):
+    submitter = QueueRobot()
+    submitter.release.clear()
+    queue = submission.SubmissionQueue(submitter, workers=1)
+    wavelet = self.wavelet(submitter, 'title')
+    queue.submit(wavelet)
+    self.assertEquals(0, len(wavelet.get_operation_queue()))
+    self.assertEquals([], submitter.delivered)
+    submitter.release.set()
+    queue.join()
+    self.assertEquals(1, len(submitter.delivered))
+    self.assertEquals('wave.wavelet.setTitle',
+                      submitter.delivered[0][0]['method'])
+    queue.close()
+
+  def testRetries(self):
+    submitter = QueueRobot(failures=2)
+    queue = submission.SubmissionQueue(submitter, backoff=0, max_attempts=3,
+                                       spool_path=self.spool_path)
+    queue.submit(self.wavelet(submitter, 'title'))
+    queue.join()
+    self.assertEquals(3, len(submitter.attempts))
+    self.assertEquals(1, len(submitter.delivered))
+    self.assertFalse(os.path.exists(self.spool_path))
+    queue.close()
+
+  def testRejectedRpcIsDropped(self):
+    submitter = QueueRobot(failures=1, code=400)
+    queue = submission.SubmissionQueue(submitter, backoff=0, max_attempts=3,
+                                       spool_path=self.spool_path)
+    queue.submit(self.wavelet(submitter, 'title'))
+    queue.join()
+    self.assertEquals(1, len(submitter.attempts))
+    self.assertEquals([], submitter.delivered)
+    self.assertEquals([], self.spooled())
+    queue.close()
+
+  def testUndecodableAnswerIsNotResent(self):
+    submitter = QueueRobot(failures=1, code=200)
+    queue = submission.SubmissionQueue(submitter, backoff=0, max_attempts=3,
+                                       spool_path=self.spool_path)
+    queue.submit(self.wavelet(submitter, 'title'))
+    queue.join()
+    self.assertEquals(1, len(submitter.attempts))
+    self.assertEquals([], self.spooled())
+    queue.close()
+
+  def testSpoolAndResubmit(self):
+    submitter = QueueRobot(failures=2)
+    queue = submission.SubmissionQueue(submitter, backoff=0, max_attempts=2,
+                                       spool_path=self.spool_path)
+    queue.submit(self.wavelet(submitter, 'title'))
+    queue.join()
+    self.assertEquals([], submitter.delivered)
+    self.assertEquals(1, len(self.spooled()))
+    self.assertEquals(1, queue.resubmit_spooled())
+    queue.join()
+    self.assertEquals(1, len(submitter.delivered))
+    self.assertEquals(submitter.attempts[0], submitter.delivered[0])
+    self.assertFalse(os.path.exists(self.spool_path))
+    queue.close()
+
+  def testCloseSpoolsQueued(self):
+    submitter = QueueRobot()
+    submitter.release.clear()
+    queue = submission.SubmissionQueue(submitter, workers=1,
+                                       spool_path=self.spool_path)
+    for i in range(3):
+      queue.submit(self.wavelet(submitter, 'title %d' % i))
+    closer = threading.Thread(target=queue.close)
+    closer.start()
+    submitter.release.set()
+    closer.join()
+    self.assertEquals(3, len(submitter.attempts) + len(self.spooled()))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,236 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Searching blip content for several patterns at once.
+
+A pattern set is a set, list or tuple of strings and compiled regular
+expressions, or a single compiled regular expression. The strings are
+matched together by an Aho-Corasick automaton, the regular expressions
+are searched one by one. Compiled pattern sets are cached, so
+handlers searching for the same keywords on every event only pay for
+building them once.
+"""
+
+import re
+
+# Maximum number of compiled pattern sets kept by compile().
+MAX_CACHED_PATTERN_SETS = 128
+
+_REGEX_TYPE = type(re.compile(''))
+
+_pattern_sets = {}
+
+
+def is_pattern_set(what):
+  """Returns whether what can be passed to compile()."""
+  return (isinstance(what, (set, frozenset, list, tuple)) or
+          isinstance(what, _REGEX_TYPE))
+
+
+class _Automaton(object):
+  """Aho-Corasick automaton matching a set of strings."""
+
+  def __init__(self, words):
+    # For every state: transitions, failure state, length of the prefix
+    # it represents and the lengths of the words ending in it.
+    self._goto = [{}]
+    self._fail = [0]
+    self._depth = [0]
+    self._out = [()]
+    for word in words:
+      state = 0
+      for ch in word:
+        next_state = self._goto[state].get(ch)
+        if next_state is None:
+          next_state = len(self._goto)
+          self._goto[state][ch] = next_state
+          self._goto.append({})
+          self._fail.append(0)
+          self._depth.append(self._depth[state] + 1)
+          self._out.append(())
+        state = next_state
+      self._out[state] = (len(word),)
+    queue = list(self._goto[0].values())
+    while queue:
+      state = queue.pop(0)
+      for ch, next_state in self._goto[state].items():
+        queue.append(next_state)
+        fail = self._fail[state]
+        while fail and ch not in self._goto[fail]:
+          fail = self._fail[fail]
+        fail = self._goto[fail].get(ch, 0)
+        if fail == next_state:
+          fail = 0
+        self._fail[next_state] = fail
+        self._out[next_state] = self._out[next_state] + self._out[fail]
+
+  def find(self, pieces, pos):
+    """Returns the leftmost, then longest, match in pieces or None.
+
+    Args:
+      pieces: iterable of strings making up the text from pos onwards.
+      pos: position in the text of the first piece.
+    """
+    goto = self._goto
+    fail = self._fail
+    depth = self._depth
+    out = self._out
+    state = 0
+    best = None
+    for piece in pieces:
+      for ch in piece:
+        while state and ch not in goto[state]:
+          state = fail[state]
+        state = goto[state].get(ch, 0)
+        pos += 1
+        for length in out[state]:
+          start = pos - length
+          if (best is None or start < best[0] or
+              (start == best[0] and pos > best[1])):
+            best = (start, pos)
+        # Anything found later starts where the current prefix starts.
+        if best is not None and pos - depth[state] > best[0]:
+          return best
+    return best
+
+
+class PatternSet(object):
+  """A compiled set of strings and regular expressions."""
+
+  def __init__(self, patterns):
+    if isinstance(patterns, _REGEX_TYPE):
+      patterns = [patterns]
+    words = []
+    self._regexes = []
+    for pattern in patterns:
+      if isinstance(pattern, basestring):
+        if pattern:
+          words.append(pattern)
+      elif isinstance(pattern, _REGEX_TYPE):
+        self._regexes.append(pattern)
+      else:
+        raise ValueError('Not a string or regular expression: %r' % pattern)
+    self._automaton = None
+    if words:
+      self._automaton = _Automaton(words)
+
+  def _searchers(self, content):
+    """Returns a function per automaton and regex finding its next match.
+
+    Each function takes the position to search from and returns the
+    range of the leftmost, then longest, match from there, or None.
+    """
+    searchers = []
+    automaton = self._automaton
+    if automaton is not None:
+      if isinstance(content, basestring):
+        searchers.append(lambda pos, text=content:
+                         automaton.find(_chunks(text, pos), pos))
+      else:
+        searchers.append(lambda pos, document=content:
+                         automaton.find(document.pieces(pos), pos))
+    if self._regexes:
+      text = content
+      if not isinstance(text, basestring):
+        text = text.text
+      for regex in self._regexes:
+        searchers.append(lambda pos, regex=regex, text=text:
+                         _span(regex.search(text, pos)))
+    return searchers
+
+  def find(self, content, start=0):
+    """Returns the range of the first match at or after start, or None.
+
+    Of matches starting at the same position the longest is returned.
+
+    Args:
+      content: a string or a rope.Rope to search.
+      start: where to start searching.
+    """
+    best = None
+    for search in self._searchers(content):
+      best = _better(best, search(start))
+    return best
+
+  def find_all(self, content, maxres=-1):
+    """Returns the ranges of the matches in content, in order.
+
+    After a match, the search goes on at its end, or one further for an
+    empty match, so matches do not overlap. The match of every string or
+    regular expression is kept until the search has passed its start, so
+    one that matches rarely, or never, does not rescan the rest of the
+    text for every match of the others.
+
+    Args:
+      content: a string or a rope.Rope to search.
+      maxres: number of matches to return at most, or <= 0 for all.
+    """
+    searchers = self._searchers(content)
+    # The position every searcher last searched from and what it found.
+    found = [(None, None)] * len(searchers)
+    hits = []
+    pos = 0
+    # Past the end re would still find empty matches at the end.
+    while pos <= len(content) and (maxres <= 0 or len(hits) < maxres):
+      best = None
+      for i, search in enumerate(searchers):
+        searched_from, hit = found[i]
+        if searched_from is None or (hit is not None and hit[0] < pos):
+          hit = search(pos)
+          found[i] = (pos, hit)
+        best = _better(best, hit)
+      if best is None:
+        break
+      hits.append(best)
+      pos = max(best[1], best[0] + 1)
+    return hits
+
+
+def _chunks(text, start, size=1024):
+  """Yields text from start on in slices, so it is not copied at once."""
+  for i in xrange(start, len(text), size):
+    yield text[i:i + size]
+
+
+def _span(match):
+  if match is None:
+    return None
+  return match.span()
+
+
+def _better(best, hit):
+  """Returns the leftmost, then longest, of two ranges that may be None."""
+  if hit is None:
+    return best
+  if (best is None or hit[0] < best[0] or
+      (hit[0] == best[0] and hit[1] > best[1])):
+    return hit
+  return best
+
+
+def compile(patterns):
+  """Returns the PatternSet for patterns, reusing an earlier one if cached."""
+  if isinstance(patterns, _REGEX_TYPE):
+    key = patterns
+  else:
+    key = frozenset(patterns)
+  pattern_set = _pattern_sets.get(key)
+  if pattern_set is None:
+    if len(_pattern_sets) >= MAX_CACHED_PATTERN_SETS:
+      _pattern_sets.clear()
+    pattern_set = PatternSet(patterns)
+    _pattern_sets[key] = pattern_set
+  return pattern_set
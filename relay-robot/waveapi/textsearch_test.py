@@ -0,0 +1,136 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the textsearch module."""
+
+
+import random
+import re
+import unittest
+
+import rope
+import textsearch
+
+
+def find_all(pattern_set, content):
+  res = []
+  hit = pattern_set.find(content)
+  while hit is not None:
+    res.append(hit)
+    pos = max(hit[1], hit[0] + 1)
+    if pos > len(content):
+      break
+    hit = pattern_set.find(content, pos)
+  return res
+
+
+class TestPatternSet(unittest.TestCase):
+
+  def testLeftmostLongest(self):
+    pattern_set = textsearch.PatternSet(['he', 'she', 'hers', 'his'])
+    self.assertEquals([(1, 4), (7, 10)], find_all(pattern_set, 'ushers his'))
+    pattern_set = textsearch.PatternSet(['bc', 'abcd', 'ab'])
+    self.assertEquals((1, 5), pattern_set.find('xabcd'))
+    self.assertEquals((1, 3), pattern_set.find('xabc'))
+    self.assertEquals(None, pattern_set.find('xyz'))
+
+  def testRegularExpressions(self):
+    pattern_set = textsearch.PatternSet(
+        ['cat', re.compile('do+g'), re.compile('BIRD', re.I)])
+    self.assertEquals([(0, 4), (5, 8), (9, 13)],
+                      find_all(pattern_set, 'doog cat bird'))
+    pattern_set = textsearch.PatternSet(re.compile('[0-9]+'))
+    self.assertEquals([(2, 4)], find_all(pattern_set, 'a 42 b'))
+    self.assertRaises(ValueError, textsearch.PatternSet, [42])
+
+  def testOverlappingRegularExpressions(self):
+    pattern_set = textsearch.PatternSet([re.compile('a'), re.compile('ab')])
+    self.assertEquals((1, 3), pattern_set.find('xab'))
+    pattern_set = textsearch.PatternSet([re.compile('(?P<w>x)y'),
+                                         re.compile('(?P<w>z)')])
+    self.assertEquals([(0, 2), (3, 4)], find_all(pattern_set, 'xy z'))
+    pattern_set = textsearch.PatternSet([re.compile('(a)b'),
+                                         re.compile(r'(c)\1')])
+    self.assertEquals([(2, 4)], find_all(pattern_set, 'c cc'))
+
+  def testRope(self):
+    leaf_size = rope.LEAF_SIZE
+    rope.LEAF_SIZE = 3
+    try:
+      content = rope.Rope(u'one two three')
+      content.insert(0, u'zero ')
+      pattern_set = textsearch.PatternSet([u'two', u'three', re.compile('z')])
+      self.assertEquals([(0, 1), (9, 12), (13, 18)],
+                        find_all(pattern_set, content))
+    finally:
+      rope.LEAF_SIZE = leaf_size
+
+  def testMatchesNaiveSearch(self):
+    rand = random.Random(42)
+    for i in range(200):
+      words = set([''.join([rand.choice('ab') for j in range(rand.randint(1, 4))])
+                   for k in range(rand.randint(1, 4))])
+      text = ''.join([rand.choice('abc') for j in range(30)])
+      expected = None
+      for word in words:
+        idx = text.find(word, 5)
+        if idx != -1:
+          hit = (idx, idx + len(word))
+          if (expected is None or hit[0] < expected[0] or
+              (hit[0] == expected[0] and hit[1] > expected[1])):
+            expected = hit
+      self.assertEquals(expected, textsearch.PatternSet(words).find(text, 5))
+
+  def testFindAll(self):
+    rand = random.Random(7)
+    for i in range(100):
+      patterns = set([''.join([rand.choice('ab')
+                               for j in range(rand.randint(1, 3))])
+                      for k in range(rand.randint(0, 3))])
+      patterns.add(re.compile(rand.choice(['c+', 'q+z', 'b?', 'a(b|c)'])))
+      pattern_set = textsearch.PatternSet(patterns)
+      text = ''.join([rand.choice('abc') for j in range(40)])
+      self.assertEquals(find_all(pattern_set, text), pattern_set.find_all(text))
+      content = rope.Rope(text)
+      self.assertEquals(find_all(pattern_set, text)[:3],
+                        pattern_set.find_all(content, 3))
+
+  def testFindAllSearchesRareRegexOnce(self):
+    searches = []
+
+    class CountingRegex(object):
+
+      def search(self, text, pos):
+        searches.append(pos)
+        return None
+
+    pattern_set = textsearch.PatternSet(['foo'])
+    pattern_set._regexes.append(CountingRegex())
+    self.assertEquals(100, len(pattern_set.find_all('foo ' * 100)))
+    self.assertEquals([0], searches)
+
+  def testCompileIsCached(self):
+    self.assertTrue(textsearch.compile(set(['a', 'b'])) is
+                    textsearch.compile(['b', 'a']))
+    regex = re.compile('a+')
+    self.assertTrue(textsearch.compile(regex) is textsearch.compile(regex))
+    self.assertTrue(textsearch.is_pattern_set(regex))
+    self.assertTrue(textsearch.is_pattern_set(('a',)))
+    self.assertFalse(textsearch.is_pattern_set('a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -19,6 +19,9 @@
 
 CUSTOM_SERIALIZE_METHOD_NAME = 'serialize'
 
+# Maximum number of conversions remembered per key conversion function.
+MAX_CACHED_KEYS = 1024
+
 
 def is_iterable(inst):
   """Returns whether or not this is a list, tuple, set or dict .
@@ -38,6 +41,64 @@ def is_user_defined_new_style_class(obj):
   return type(obj).__module__ != '__builtin__'
 
 
+class KeyCache(object):
+  """Bounded memo for a string conversion function.
+
+  Serialized objects use the same few dozen keys over and over, so key
+  conversions are remembered. Once max_size conversions are stored the
+  cache is emptied and starts over.
+  """
+
+  def __init__(self, convert, max_size=MAX_CACHED_KEYS):
+    self._convert = convert
+    self._max_size = max_size
+    self._cache = {}
+    self.hits = 0
+    self.misses = 0
+
+  def __call__(self, s):
+    try:
+      result = self._cache[s]
+    except KeyError:
+      self.misses += 1
+      result = self._convert(s)
+      if len(self._cache) >= self._max_size:
+        self._cache.clear()
+      self._cache[s] = result
+      return result
+    self.hits += 1
+    return result
+
+  def clear(self):
+    """Forgets all conversions and resets the counters."""
+    self._cache.clear()
+    self.hits = 0
+    self.misses = 0
+
+  def stats(self):
+    """Returns a dictionary with the hits, misses and size of the cache."""
+    return {'hits': self.hits, 'misses': self.misses,
+            'size': len(self._cache)}
+
+
+def _lower_camel_case(s):
+  return reduce(lambda a, b: a + (a and b.capitalize() or b), s.split('_'))
+
+
+def _upper_camel_case(s):
+  return ''.join(fragment.capitalize() for fragment in s.split('_'))
+
+
+_lower_camel_case_cache = KeyCache(_lower_camel_case)
+_upper_camel_case_cache = KeyCache(_upper_camel_case)
+
+
+def key_cache_stats():
+  """Returns the KeyCache stats of lower_camel_case and upper_camel_case."""
+  return {'lowerCamelCase': _lower_camel_case_cache.stats(),
+          'upperCamelCase': _upper_camel_case_cache.stats()}
+
+
 def lower_camel_case(s):
   """Converts a string to lower camel case.
 
@@ -53,7 +114,7 @@ def lower_camel_case(s):
   Returns:
     The lower camel cased string.
   """
-  return reduce(lambda a, b: a + (a and b.capitalize() or b), s.split('_'))
+  return _lower_camel_case_cache(s)
 
 
 def upper_camel_case(s):
@@ -71,7 +132,7 @@ def upper_camel_case(s):
   Returns:
     The upper camel cased string.
   """
-  return ''.join(fragment.capitalize() for fragment in s.split('_'))
+  return _upper_camel_case_cache(s)
 
 
 def default_keywriter(key_name):
@@ -88,7 +149,7 @@ def default_keywriter(key_name):
   return lower_camel_case(key_name)
 
 
-def _serialize_attributes(obj, key_writer=default_keywriter):
+def _serialize_attributes_by_reflection(obj, key_writer=default_keywriter):
   """Serializes attributes of an instance.
 
   Iterates all attributes of an object and invokes serialize if they are
@@ -117,6 +178,96 @@ def _serialize_attributes(obj, key_writer=default_keywriter):
   return data
 
 
+# Maximum number of attribute plans kept by _attribute_plan.
+MAX_ATTRIBUTE_PLANS = 1000
+
+_attribute_plans = {}
+
+
+def _compile_attribute_plan(cls, instance_attrs):
+  """Works out which attributes of instances of a class get serialized.
+
+  This finds the same attributes _serialize_attributes_by_reflection
+  finds through dir(): the public ones, in sorted order, leaving out
+  the methods of the class. Whether a value is None or callable can only
+  be decided at serialization time, so that is still checked then.
+
+  Args:
+    cls: The class of the instances.
+    instance_attrs: The names in the instance dictionary.
+
+  Returns:
+    A list of (attribute name, lower camel cased name, from_dict) tuples.
+    If from_dict is set, the value is read from the instance dictionary,
+    otherwise through getattr.
+  """
+  plan = []
+  for attr_name in sorted(set(dir(cls)) | set(instance_attrs)):
+    if attr_name.startswith('_'):
+      continue
+    class_attr = None
+    for klass in cls.__mro__:
+      if attr_name in klass.__dict__:
+        class_attr = klass.__dict__[attr_name]
+        break
+    if hasattr(class_attr, '__set__'):
+      # Data descriptors such as properties win from the instance.
+      from_dict = False
+    elif attr_name in instance_attrs:
+      from_dict = True
+    elif callable(getattr(cls, attr_name)):
+      continue
+    else:
+      from_dict = False
+    plan.append((attr_name, default_keywriter(attr_name), from_dict))
+  return plan
+
+
+def _attribute_plan(obj, instance_dict):
+  """Returns the cached attribute plan for obj, compiling it if needed."""
+  key = (type(obj), tuple(instance_dict))
+  plan = _attribute_plans.get(key)
+  if plan is None:
+    if len(_attribute_plans) >= MAX_ATTRIBUTE_PLANS:
+      _attribute_plans.clear()
+    plan = _compile_attribute_plan(type(obj), key[1])
+    _attribute_plans[key] = plan
+  return plan
+
+
+def _serialize_attributes(obj, key_writer=default_keywriter):
+  """Serializes attributes of an instance.
+
+  Serializes the same attributes as _serialize_attributes_by_reflection,
+  but looks them up once per class and instance layout rather than on
+  every call.
+
+  Args:
+    obj: The instance to serialize.
+    key_writer: Optional key writer function.
+
+  Returns:
+    The serialized object.
+  """
+  try:
+    instance_dict = obj.__dict__
+  except AttributeError:
+    return _serialize_attributes_by_reflection(obj, key_writer)
+  data = {}
+  for attr_name, camel_name, from_dict in _attribute_plan(obj, instance_dict):
+    if from_dict:
+      attr = instance_dict[attr_name]
+    else:
+      attr = getattr(obj, attr_name)
+    if attr is None or callable(attr):
+      continue
+    if key_writer is default_keywriter:
+      data[camel_name] = serialize(attr)
+    else:
+      data[key_writer(attr_name)] = serialize(attr)
+  return data
+
+
 def _serialize_list(l, key_writer):
   """Invokes serialize on all of its elements.
 
@@ -95,6 +95,36 @@ class TestUtils(unittest.TestCase):
     for k, v in a.iteritems():
       self.assertEquals(v, b[k])
 
+  def testKeyCache(self):
+    calls = []
+
+    def convert(s):
+      calls.append(s)
+      return s.upper()
+
+    cache = util.KeyCache(convert, max_size=2)
+    self.assertEquals('A', cache('a'))
+    self.assertEquals('A', cache('a'))
+    self.assertEquals(['a'], calls)
+    self.assertEquals({'hits': 1, 'misses': 1, 'size': 1}, cache.stats())
+    cache('b')
+    cache('c')
+    # The cache was full, so it started over.
+    self.assertEquals(1, cache.stats()['size'])
+    self.assertEquals('A', cache('a'))
+    self.assertEquals(['a', 'b', 'c', 'a'], calls)
+    cache.clear()
+    self.assertEquals({'hits': 0, 'misses': 0, 'size': 0}, cache.stats())
+
+  def testKeyCacheStats(self):
+    before = util.key_cache_stats()['lowerCamelCase']
+    util.lower_camel_case('wave_id')
+    util.lower_camel_case('wave_id')
+    after = util.key_cache_stats()['lowerCamelCase']
+    self.assertEquals(before['hits'] + before['misses'] + 2,
+                      after['hits'] + after['misses'])
+    self.assertTrue(after['hits'] > before['hits'])
+
   def testSerializeList(self):
     data = [1, 2, 3]
     output = util.serialize(data)
@@ -122,6 +152,45 @@ class TestUtils(unittest.TestCase):
     self.assertEquals(1, len(output.keys()))
     self.assertEquals(data.public, output['public'])
 
+  def testSerializeAttributesMatchesReflection(self):
+
+    class Base(object):
+      kind = 'base'
+
+      def __init__(self):
+        self.shadowed_method = 'value'
+        self.missing = None
+        self.func = lambda: None
+
+      def shadowed_method(self):
+        pass
+
+      @property
+      def computed_value(self):
+        return 42
+
+    class Derived(Base):
+      pass
+
+    instances = [Base(), Derived(),
+                 ops.Operation('wavelet.setTitle', 'op1',
+                               {'waveId': 'wave1', 'range': ops.OpsRange(1, 2)}),
+                 ops.BlipData('wave1', 'wavelet1', 'blip1', 'text'),
+                 ops.OpsRange(3, 4)]
+    for instance in instances:
+      expected = util._serialize_attributes_by_reflection(instance)
+      # Twice, so the second call goes through the cached plan.
+      self.assertEquals(expected, util._serialize_attributes(instance))
+      self.assertEquals(expected, util._serialize_attributes(instance))
+    self.assertEquals({'kind': 'base', 'shadowedMethod': 'value',
+                       'computedValue': 42},
+                      util._serialize_attributes(Base()))
+
+  def testSerializeAttributesKeyWriter(self):
+    output = util._serialize_attributes(ops.OpsRange(3, 4),
+                                        key_writer=lambda key: key.upper())
+    self.assertEquals({'START': 3, 'END': 4}, output)
+
   def testStringEnum(self):
     empty = util.StringEnum()
     single = util.StringEnum('foo')
@@ -122,7 +122,10 @@ class Wavelet(object):
                                       operation_queue)
     self._title = json.get('title', '')
     self._raw_data = json
-    self._blips = blip.Blips(blips)
+    if isinstance(blips, blip.Blips):
+      self._blips = blips
+    else:
+      self._blips = blip.Blips(blips)
     self._root_blip_id = json.get('rootBlipId')
     if self._root_blip_id and self._root_blip_id in self._blips:
       self._root_blip = self._blips[self._root_blip_id]
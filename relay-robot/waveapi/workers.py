@@ -0,0 +1,407 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pools of workers that keep related work in order.
+
+Work is handed to a pool as (key, item) pairs. Items with different
+keys run concurrently, items with the same key run one after another in
+the order they were given. The robot uses the wavelet as key, so the
+bundles of one wavelet are processed in order while other wavelets
+proceed in parallel.
+
+A WorkerPool runs the items on threads, which suits handlers that wait
+for io. The threads share the interpreter lock though, so handlers that
+keep the cpu busy are better run on the processes of a ProcessPool.
+"""
+
+import cPickle
+import Queue
+import sys
+import threading
+import traceback
+
+try:
+  import multiprocessing  # 2.6
+except ImportError:
+  multiprocessing = None
+
+import logs
+
+DEFAULT_POOL_SIZE = 4
+
+# Seconds between checks whether the processes of a ProcessPool still run.
+PROCESS_CHECK_INTERVAL = 1.0
+
+_log = logs.get('workers')
+
+
+class _Call(object):
+  """Collects the results of one WorkerPool.map call."""
+
+  def __init__(self, count):
+    self.results = [None] * count
+    self.error = None
+    self._pending = count
+    self._done = threading.Condition()
+
+  def finished(self, count):
+    self._done.acquire()
+    try:
+      self._pending -= count
+      if self._pending == 0:
+        self._done.notifyAll()
+    finally:
+      self._done.release()
+
+  def fail(self, error, count):
+    if self.error is None:
+      self.error = error
+    self.finished(count)
+
+  def wait(self, timeout=None):
+    """Waits until all items are done, or at most timeout seconds.
+
+    Returns:
+      Whether all items are done.
+    """
+    self._done.acquire()
+    try:
+      if timeout is not None:
+        if self._pending:
+          self._done.wait(timeout)
+      else:
+        while self._pending:
+          self._done.wait()
+      return not self._pending
+    finally:
+      self._done.release()
+
+
+def _group(keyed_items):
+  """Returns the keys in order of appearance and the items of every key.
+
+  The items of a key are (index, item) tuples, index being the position
+  in keyed_items.
+  """
+  groups = {}
+  order = []
+  for index, (key, item) in enumerate(keyed_items):
+    if not key in groups:
+      groups[key] = []
+      order.append(key)
+    groups[key].append((index, item))
+  return order, groups
+
+
+class WorkerPool(object):
+  """Fixed size pool of daemon threads, started on first use."""
+
+  def __init__(self, size=DEFAULT_POOL_SIZE):
+    self._size = size
+    self._tasks = Queue.Queue()
+    self._threads = []
+    self._lock = threading.Lock()
+
+  @property
+  def size(self):
+    return self._size
+
+  def _start(self):
+    self._lock.acquire()
+    try:
+      while len(self._threads) < self._size:
+        thread = threading.Thread(target=self._work)
+        thread.setDaemon(True)
+        thread.start()
+        self._threads.append(thread)
+    finally:
+      self._lock.release()
+
+  def _work(self):
+    while True:
+      task = self._tasks.get()
+      if task is None:
+        return
+      func, call, group = task
+      for index, item in group:
+        try:
+          call.results[index] = func(item)
+        except:
+          _log.exception('Worker failed')
+          if call.error is None:
+            call.error = sys.exc_info()
+      call.finished(len(group))
+
+  def map(self, func, keyed_items):
+    """Calls func for every item and returns the results in order.
+
+    Args:
+      func: function taking a single item.
+      keyed_items: list of (key, item) tuples. Items with the same key
+          are passed to func one at a time, in the order of the list.
+
+    Returns:
+      The list of results of func, in the order of keyed_items.
+
+    Raises:
+      Whatever func raised first, once all other items have been
+      processed.
+    """
+    order, groups = _group(keyed_items)
+    call = _Call(len(keyed_items))
+    if not keyed_items:
+      return call.results
+    self._start()
+    for key in order:
+      self._tasks.put((func, call, groups[key]))
+    call.wait()
+    if call.error is not None:
+      raise call.error[0], call.error[1], call.error[2]
+    return call.results
+
+  def close(self):
+    """Stops the worker threads once they are done with queued work."""
+    self._lock.acquire()
+    try:
+      threads = self._threads
+      self._threads = []
+    finally:
+      self._lock.release()
+    for thread in threads:
+      self._tasks.put(None)
+    for thread in threads:
+      thread.join()
+
+
+def _serve(func, initializer, tasks, results):
+  """Main function of a ProcessPool process; returns when it gets None."""
+  if initializer is not None:
+    initializer()
+  while True:
+    task = tasks.get()
+    if task is None:
+      return
+    call_id, group = task
+    for index, item in group:
+      result = error = None
+      try:
+        # Pickled here, as the queue would silently drop what it cannot
+        # pickle and leave the caller waiting.
+        result = cPickle.dumps(func(item), 2)
+      except:
+        _log.exception('Worker failed')
+        error = sys.exc_info()[1]
+        try:
+          cPickle.loads(cPickle.dumps(error, 2))
+        except Exception:
+          error = RuntimeError(traceback.format_exc())
+      results.put((call_id, index, result, error))
+
+
+class ProcessPool(object):
+  """Fixed size pool of worker processes.
+
+  Items with the same key always go to the same process, so they stay in
+  order, also across map calls. The processes are forked when the pool
+  is started and from then on run the function it was started with.
+  Items and results are pickled on their way, and anything the function
+  changes stays in its process. Needs the multiprocessing module and a
+  platform that forks.
+
+  A process that dies is replaced by a new one, and the items it had not
+  answered yet fail with a RuntimeError.
+  """
+
+  def __init__(self, size=None):
+    """Initializes the pool.
+
+    Args:
+      size: number of processes, by default the number of cpus.
+    """
+    if multiprocessing is None:
+      raise ImportError('ProcessPool needs the multiprocessing module')
+    if size is None:
+      size = multiprocessing.cpu_count()
+    self._size = size
+    self._func = None
+    self._initializer = None
+    self._tasks = []
+    self._processes = []
+    self._results = None
+    self._collector = None
+    # From call id to the call and, for every item not answered yet, the
+    # index of the process it went to.
+    self._calls = {}
+    self._next_call_id = 0
+    self._lock = threading.Lock()
+
+  @property
+  def size(self):
+    return self._size
+
+  def start(self, func, initializer=None):
+    """Forks the processes unless they are running already.
+
+    Best done before other threads are started, as locks held by them
+    at the time of the fork stay locked in the processes.
+
+    Args:
+      func: function taking a single item, run by the processes.
+      initializer: optional function each process calls once first.
+
+    Raises:
+      ValueError: if the pool was started with another function.
+    """
+    self._lock.acquire()
+    try:
+      if self._processes:
+        if func != self._func:
+          raise ValueError('The pool already runs %r' % self._func)
+        return
+      self._func = func
+      self._initializer = initializer
+      self._results = multiprocessing.Queue()
+      self._tasks = [None] * self._size
+      self._processes = [None] * self._size
+      for slot in range(self._size):
+        self._spawn(slot)
+      self._collector = threading.Thread(target=self._collect)
+      self._collector.setDaemon(True)
+      self._collector.start()
+    finally:
+      self._lock.release()
+
+  def _spawn(self, slot):
+    """Starts the process at slot, with a queue of its own."""
+    tasks = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_serve,
+        args=(self._func, self._initializer, tasks, self._results))
+    process.daemon = True
+    process.start()
+    self._tasks[slot] = tasks
+    self._processes[slot] = process
+
+  def _replace_dead(self):
+    """Replaces processes that died and fails the items they had."""
+    failed = []
+    self._lock.acquire()
+    try:
+      for slot, process in enumerate(self._processes):
+        if process.is_alive():
+          continue
+        _log.error('Worker process %d died with exit code %s',
+                   process.pid, process.exitcode)
+        error = RuntimeError('Worker process died with exit code %s' %
+                             process.exitcode)
+        for call, slots in self._calls.values():
+          lost = [index for index, at in slots.items() if at == slot]
+          for index in lost:
+            del slots[index]
+          if lost:
+            failed.append((call, (RuntimeError, error, None), len(lost)))
+        self._spawn(slot)
+    finally:
+      self._lock.release()
+    for call, error, count in failed:
+      call.fail(error, count)
+
+  def _collect(self):
+    while True:
+      try:
+        answer = self._results.get()
+      except Exception:
+        # The answer is lost; its items fail when the process is checked.
+        _log.exception('Receiving a result failed')
+        continue
+      if answer is None:
+        return
+      call_id, index, result, error = answer
+      self._lock.acquire()
+      try:
+        call, slots = self._calls.get(call_id, (None, {}))
+        # Gone if the item already failed with its process.
+        slot = slots.pop(index, None)
+      finally:
+        self._lock.release()
+      if slot is None:
+        continue
+      if error is None:
+        try:
+          call.results[index] = cPickle.loads(result)
+        except:
+          _log.exception('Unpickling a result failed')
+          call.fail(sys.exc_info(), 1)
+          continue
+        call.finished(1)
+      else:
+        call.fail((error.__class__, error, None), 1)
+
+  def map(self, func, keyed_items):
+    """Calls func for every item in the processes, see WorkerPool.map.
+
+    The pool is started with func if it is not running yet.
+    """
+    order, groups = _group(keyed_items)
+    call = _Call(len(keyed_items))
+    if not keyed_items:
+      return call.results
+    self.start(func)
+    self._lock.acquire()
+    try:
+      call_id = self._next_call_id
+      self._next_call_id += 1
+      slots = {}
+      self._calls[call_id] = (call, slots)
+      for key in order:
+        slot = hash(key) % self._size
+        for index, item in groups[key]:
+          slots[index] = slot
+        self._tasks[slot].put((call_id, groups[key]))
+    finally:
+      self._lock.release()
+    try:
+      while not call.wait(PROCESS_CHECK_INTERVAL):
+        self._replace_dead()
+    finally:
+      self._lock.acquire()
+      try:
+        del self._calls[call_id]
+      finally:
+        self._lock.release()
+    if call.error is not None:
+      raise call.error[0], call.error[1], call.error[2]
+    return call.results
+
+  def close(self):
+    """Stops the processes once they are done with queued work."""
+    self._lock.acquire()
+    try:
+      tasks = self._tasks
+      processes = self._processes
+      collector = self._collector
+      self._tasks = []
+      self._processes = []
+      self._collector = None
+    finally:
+      self._lock.release()
+    for queue in tasks:
+      queue.put(None)
+    for process in processes:
+      process.join()
+    if collector is not None:
+      self._results.put(None)
+      collector.join()
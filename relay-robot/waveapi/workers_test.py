@@ -0,0 +1,163 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the workers module."""
+
+
+import cPickle
+import os
+import threading
+import time
+import unittest
+
+import workers
+
+
+def fail_unpickling():
+  raise ValueError('cannot unpickle')
+
+
+class Unpicklable(object):
+
+  def __reduce__(self):
+    return fail_unpickling, ()
+
+
+class TestWorkerPool(unittest.TestCase):
+
+  def setUp(self):
+    self.pool = workers.WorkerPool(3)
+
+  def tearDown(self):
+    self.pool.close()
+
+  def testResultsInOrder(self):
+    items = [(i % 4, i) for i in range(40)]
+    self.assertEquals([i * i for i in range(40)],
+                      self.pool.map(lambda i: i * i, items))
+
+  def testSameKeyRunsInOrder(self):
+    running = {}
+    seen = []
+    lock = threading.Lock()
+
+    def work(item):
+      key, index = item
+      lock.acquire()
+      try:
+        self.assertFalse(running.get(key))
+        running[key] = True
+      finally:
+        lock.release()
+      time.sleep(0.001)
+      seen.append(item)
+      running[key] = False
+
+    items = [(i % 3, (i % 3, i)) for i in range(30)]
+    self.pool.map(work, items)
+    for key in range(3):
+      self.assertEquals([i for k, (_, i) in items if k == key],
+                        [i for k, i in seen if k == key])
+
+  def testKeysRunConcurrently(self):
+    started = threading.Event()
+
+    def work(index):
+      # The first item only finishes in time if the second one runs
+      # while it waits.
+      if index == 1:
+        started.wait(5)
+        return started.isSet()
+      started.set()
+      return True
+
+    self.assertEquals([True, True], self.pool.map(work, [(1, 1), (2, 2)]))
+
+  def testErrorRaisedAfterAllItems(self):
+    done = []
+
+    def work(index):
+      if index == 1:
+        raise ValueError('bad item')
+      done.append(index)
+
+    self.assertRaises(ValueError, self.pool.map, work,
+                      [(i, i) for i in range(5)])
+    self.assertEquals([0, 2, 3, 4], sorted(done))
+
+
+class TestProcessPool(unittest.TestCase):
+
+  def setUp(self):
+    self.pool = workers.ProcessPool(3)
+
+  def tearDown(self):
+    self.pool.close()
+
+  def testResultsInOrder(self):
+    items = [(i % 4, i) for i in range(40)]
+    square = lambda i: i * i
+    self.assertEquals([i * i for i in range(40)], self.pool.map(square, items))
+    self.assertEquals([4], self.pool.map(square, [(0, 2)]))
+
+  def testSameKeyRunsInSameProcess(self):
+    items = [(i % 5, i) for i in range(30)]
+    pids = self.pool.map(lambda i: os.getpid(), items)
+    self.assertFalse(os.getpid() in pids)
+    for key in range(5):
+      self.assertEquals(1, len(set([pid for (k, _), pid in zip(items, pids)
+                                    if k == key])))
+
+  def testErrors(self):
+    def work(index):
+      if index == 1:
+        raise ValueError('bad item')
+      if index == 2:
+        return lambda: None
+      return index
+
+    self.assertRaises(ValueError, self.pool.map, work, [(0, 0), (1, 1)])
+    self.assertRaises(cPickle.PicklingError, self.pool.map, work, [(2, 2)])
+    self.assertEquals([0], self.pool.map(work, [(0, 0)]))
+
+  def testUnpicklableResult(self):
+    work = lambda i: i or Unpicklable()
+    self.assertRaises(ValueError, self.pool.map, work, [(0, 0)])
+    self.assertEquals([1], self.pool.map(work, [(0, 1)]))
+
+  def testDeadProcessReplaced(self):
+    def work(item):
+      if item == 'exit':
+        os._exit(1)
+      return os.getpid()
+
+    interval = workers.PROCESS_CHECK_INTERVAL
+    workers.PROCESS_CHECK_INTERVAL = 0.05
+    try:
+      pid = self.pool.map(work, [(0, 'pid')])[0]
+      self.assertRaises(RuntimeError, self.pool.map, work,
+                        [(0, 'exit'), (0, 'pid'), (1, 'pid')])
+      self.assertNotEquals([pid], self.pool.map(work, [(0, 'pid')]))
+    finally:
+      workers.PROCESS_CHECK_INTERVAL = interval
+
+  def testStartedWithOneFunction(self):
+    self.pool.map(abs, [(0, -1)])
+    self.assertRaises(ValueError, self.pool.map, len, [(0, 'x')])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A module to run wave robots in any WSGI server.
+
+Unlike appengine_robot_runner this does not need the App Engine SDK.
+create_robot_app returns a plain WSGI application serving the same urls
+as create_robot_webapp, which can be mounted in any WSGI server, also
+one with several worker processes or threads. run serves it with the
+threaded wsgiref server, which is enough for local testing, and can
+hand the events to a pool of processes to use several cores.
+
+Outgoing rpcs go through robot.http_post, which keeps connections alive
+by default; run can install another http client.
+"""
+
+import cgi
+import SocketServer
+from wsgiref import simple_server
+
+import events
+import logs
+import robot as robot_module
+import workers
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+_log = logs.get('events')
+
+
+def _read_body(environ):
+  try:
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+  except ValueError:
+    length = 0
+  if not length:
+    return ''
+  return environ['wsgi.input'].read(length)
+
+
+class RobotApp(object):
+  """WSGI application dispatching the wave urls to a robot."""
+
+  def __init__(self, robot):
+    self._robot = robot
+    self._routes = {
+        '/_wave/capabilities.xml': self.capabilities,
+        '/_wave/robot/profile': self.profile,
+        '/_wave/robot/jsonrpc': self.jsonrpc,
+        '/_wave/verify_token': self.verify_token,
+    }
+
+  def __call__(self, environ, start_response):
+    handler = self._routes.get(environ.get('PATH_INFO', ''))
+    headers = []
+    if handler is None:
+      code, content_type, body = '404 Not Found', 'text/plain', 'Not found'
+    else:
+      try:
+        res = handler(environ)
+        code, content_type, body = res[:3]
+        headers.extend(res[3:])
+      except:
+        _log.exception('Handling %s failed', environ.get('PATH_INFO'))
+        code, content_type, body = ('500 Internal Server Error', 'text/plain',
+                                    'Internal error')
+    if isinstance(body, unicode):
+      body = body.encode('utf-8')
+    headers.extend([('Content-Type', content_type),
+                    ('Content-Length', str(len(body)))])
+    start_response(code, headers)
+    return [body]
+
+  def _cached(self, environ, content_type, etag, method):
+    """Returns the response for method, or a 304 if the client has it."""
+    if etag is None:
+      return '200 OK', content_type, method()
+    if robot_module.etag_matches(environ.get('HTTP_IF_NONE_MATCH'), etag):
+      return '304 Not Modified', content_type, '', ('ETag', etag)
+    return '200 OK', content_type, method(), ('ETag', etag)
+
+  def capabilities(self, environ):
+    return self._cached(environ, 'application/xml',
+                        self._robot.capabilities_etag(),
+                        self._robot.capabilities_xml)
+
+  def profile(self, environ):
+    return self._cached(environ, 'application/json',
+                        self._robot.profile_etag(), self._robot.profile_json)
+
+  def jsonrpc(self, environ):
+    """Processes the posted event bundle, or the ops parameter of a get."""
+    if environ.get('REQUEST_METHOD') == 'POST':
+      json_body = _read_body(environ)
+    else:
+      json_body = _query_param(environ, 'ops')
+    if not json_body:
+      return '200 OK', 'text/plain', ''
+    _log.info('Incoming: %s', logs.Payload(json_body))
+    if self._robot.worker_pool is not None:
+      json_response = self._robot.process_bundles([json_body])[0]
+    else:
+      json_response = self._robot.process_events(json_body)
+    _log.info('Outgoing: %s', logs.Payload(json_response))
+    return '200 OK', JSON_CONTENT_TYPE, json_response
+
+  def verify_token(self, environ):
+    token, st = self._robot.get_verification_token_info()
+    if token is None:
+      return '404 Not Found', 'text/plain', 'No token set'
+    if st is not None and _query_param(environ, 'st') != st:
+      return '200 OK', 'text/plain', 'Invalid st value passed'
+    return '200 OK', 'text/plain', token
+
+
+def _query_param(environ, name):
+  return cgi.parse_qs(environ.get('QUERY_STRING', '')).get(name, [''])[0]
+
+
+def create_robot_app(robot):
+  """Returns a WSGI application serving the robot."""
+  return RobotApp(robot)
+
+
+class _ThreadingServer(SocketServer.ThreadingMixIn,
+                       simple_server.WSGIServer):
+  daemon_threads = True
+
+
+class _QuietHandler(simple_server.WSGIRequestHandler):
+
+  def log_message(self, format, *args):
+    _log.debug(format, *args)
+
+
+def run(robot, host='', port=8080, log_errors=True, http_post=None,
+        processes=None):
+  """Serves the robot with the threaded wsgiref server.
+
+  Args:
+    robot: the robot to run.
+    host: interface to listen on, all of them by default.
+    port: port to listen on.
+    log_errors: whether to register a handler logging failed operations.
+    http_post: optional function used for outgoing rpcs instead of
+        Robot.http_post.
+    processes: number of processes to handle the events in, so busy
+        handlers can use several cores. By default the events are
+        handled in the request threads.
+  """
+  if log_errors:
+    robot.register_handler(events.OperationError,
+                           robot_module.operation_error_handler)
+  if http_post is not None:
+    robot.http_post = http_post
+  if processes:
+    robot.set_worker_pool(workers.ProcessPool(processes))
+  server = simple_server.make_server(host, port, create_robot_app(robot),
+                                     server_class=_ThreadingServer,
+                                     handler_class=_QuietHandler)
+  server.serve_forever()
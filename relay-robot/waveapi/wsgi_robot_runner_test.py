@@ -0,0 +1,141 @@
+#!/usr/bin/python2.4
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the wsgi_robot_runner module."""
+
+
+import os
+import StringIO
+import unittest
+from wsgiref import util as wsgi_util
+
+import events
+import ops
+import robot
+import robot_test
+import simplejson
+import workers
+import wsgi_robot_runner
+
+
+class TestRobotApp(unittest.TestCase):
+
+  def setUp(self):
+    self.robot = robot.Robot('Testy')
+    self.app = wsgi_robot_runner.create_robot_app(self.robot)
+
+  def request(self, method, path, body='', query='', if_none_match=None):
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+               'QUERY_STRING': query, 'CONTENT_LENGTH': str(len(body)),
+               'wsgi.input': StringIO.StringIO(body)}
+    if if_none_match:
+      environ['HTTP_IF_NONE_MATCH'] = if_none_match
+    wsgi_util.setup_testing_defaults(environ)
+    started = []
+
+    def start_response(status, headers):
+      started.append((status, dict(headers)))
+
+    body = ''.join(self.app(environ, start_response))
+    status, headers = started[0]
+    self.assertEquals(str(len(body)), headers['Content-Length'])
+    self.etag = headers.get('ETag')
+    return status, headers['Content-Type'], body
+
+  def testCapabilities(self):
+    self.robot.register_handler(events.BlipSubmitted, lambda e, w: None)
+    status, content_type, body = self.request('GET', '/_wave/capabilities.xml')
+    self.assertEquals('200 OK', status)
+    self.assertEquals('application/xml', content_type)
+    self.assertEquals(self.robot.capabilities_xml(), body)
+
+  def testCapabilitiesNotModified(self):
+    self.request('GET', '/_wave/capabilities.xml')
+    self.assertEquals(self.robot.capabilities_etag(), self.etag)
+    status, _, body = self.request('GET', '/_wave/capabilities.xml',
+                                   if_none_match=self.etag)
+    self.assertEquals('304 Not Modified', status)
+    self.assertEquals('', body)
+    self.robot.register_handler(events.BlipSubmitted, lambda e, w: None)
+    self.assertEquals('200 OK', self.request('GET', '/_wave/capabilities.xml',
+                                             if_none_match=self.etag)[0])
+
+  def testProfileWithHandlerNotCached(self):
+    self.robot.register_profile_handler(lambda name: {'name': 'dynamic'})
+    status, _, body = self.request('GET', '/_wave/robot/profile',
+                                   if_none_match='*')
+    self.assertEquals('200 OK', status)
+    self.assertEquals(None, self.etag)
+
+  def testProfile(self):
+    status, _, body = self.request('GET', '/_wave/robot/profile')
+    self.assertEquals('Testy', simplejson.loads(body)['name'])
+
+  def testVerifyToken(self):
+    self.assertEquals('404 Not Found',
+                      self.request('GET', '/_wave/verify_token')[0])
+    self.robot.set_verification_token_info('token', 'st')
+    self.assertEquals('token', self.request('GET', '/_wave/verify_token',
+                                            query='st=st')[2])
+    self.assertEquals('Invalid st value passed',
+                      self.request('GET', '/_wave/verify_token',
+                                   query='st=x')[2])
+
+  def testUnknownPath(self):
+    self.assertEquals('404 Not Found', self.request('GET', '/nothing')[0])
+
+  def testEvents(self):
+    def check(event, wavelet):
+      wavelet.title = 'new title'
+
+    self.robot.register_handler(events.WaveletParticipantsChanged, check)
+    status, content_type, body = self.request('POST', '/_wave/robot/jsonrpc',
+                                              robot_test.TEST_JSON)
+    self.assertEquals('200 OK', status)
+    self.assertEquals(wsgi_robot_runner.JSON_CONTENT_TYPE, content_type)
+    self.assertEquals([ops.ROBOT_NOTIFY_CAPABILITIES_HASH,
+                       ops.WAVELET_SET_TITLE],
+                      [op['method'] for op in simplejson.loads(body)])
+
+  def testEventsInProcesses(self):
+    def check(event, wavelet):
+      wavelet.title = 'pid %d' % os.getpid()
+
+    self.robot.register_handler(events.WaveletParticipantsChanged, check)
+    pool = workers.ProcessPool(2)
+    self.robot.set_worker_pool(pool)
+    try:
+      status, _, body = self.request('POST', '/_wave/robot/jsonrpc',
+                                     robot_test.TEST_JSON)
+    finally:
+      pool.close()
+    self.assertEquals('200 OK', status)
+    operations = simplejson.loads(body)
+    self.assertNotEquals('pid %d' % os.getpid(),
+                         operations[1]['params']['waveletTitle'])
+
+  def testHandlerError(self):
+    def fail(event, wavelet):
+      raise ValueError('broken handler')
+
+    self.robot.register_handler(events.WaveletParticipantsChanged, fail)
+    self.assertEquals('500 Internal Server Error',
+                      self.request('POST', '/_wave/robot/jsonrpc',
+                                   robot_test.TEST_JSON)[0])
+
+
+if __name__ == '__main__':
+  unittest.main()